@@ -0,0 +1,52 @@
+"""
+Decoding throughput of process_weather_request / process_forecast_request, into Pandas and into Arrow
+"""
+
+import argparse
+import time
+
+import fixtures  # noqa: F401 (notebook helpers path)
+from pipeline.fake_openmeteo import decode_messages, encode_daily_response, synthetic_daily_values
+from weather_utils import process_forecast_request, process_weather_request
+
+def best_time(function, responses, repeat):
+    """
+    Best wall-clock time, in seconds, of decoding all the responses
+    """
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for response in responses:
+            function(response)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('--locations', type = int, default = 50, help = 'number of responses to decode')
+    parser.add_argument('--days', type = int, default = 3650, help = 'days per response')
+    parser.add_argument('--repeat', type = int, default = 5)
+    args = parser.parse_args()
+
+    history = decode_messages(b''.join(
+        encode_daily_response(synthetic_daily_values(args.days, seed = i)) for i in range(args.locations)))
+    forecast = decode_messages(b''.join(
+        encode_daily_response(synthetic_daily_values(args.days, with_weather_code = False, seed = i))
+        for i in range(args.locations)))
+
+    cases = [
+        ('history', 'process_weather_request', process_weather_request, history),
+        ('history', 'process_weather_request (arrow)', lambda r: process_weather_request(r, as_arrow = True), history),
+        ('forecast', 'process_forecast_request', process_forecast_request, forecast),
+        ('forecast', 'process_forecast_request (arrow)', lambda r: process_forecast_request(r, as_arrow = True), forecast),
+    ]
+
+    rows = args.locations * args.days
+    print(f"{args.locations} responses x {args.days} days, best of {args.repeat}")
+    for kind, name, function, responses in cases:
+        seconds = best_time(function, responses, args.repeat)
+        print(f"{kind:<9} {name:<34} {seconds * 1000:9.2f} ms {rows / seconds / 1e6:8.2f} M rows/s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Memory footprint of a many-location history with the compact column schema, against the default dtypes it replaced:
+Python dates, int64 codes and month, float64 rolling features and description strings repeated on every row
+"""
+
+import argparse
+
+import numpy as np
+
+from fixtures import synthetic_history
+from weather_utils import ROLLING_FEATURES, memory_footprint
+
+def default_dtypes(df):
+    """
+    Same history with the dtypes used before the compact schema
+    """
+
+    df = df.copy()
+    df['date'] = df['date'].dt.date
+    for column in ['weather_code_wmo', 'weather_code', 'month']:
+        df[column] = df[column].astype(np.int64)
+    for column in ROLLING_FEATURES:
+        df[column] = df[column].astype(np.float64)
+    for column in ['weather_code_desc', 'weather_code_desc_short']:
+        df[column] = df[column].astype(object)
+    return df
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('--locations', type = int, default = 200)
+    parser.add_argument('--days', type = int, default = 3650, help = 'days per location')
+    args = parser.parse_args()
+
+    df_compact = synthetic_history(args.locations, args.days)
+    df_default = default_dtypes(df_compact)
+
+    print(f"{args.locations} locations x {args.days} days = {len(df_compact):,} rows")
+    print(f"{'column':<26} {'default':>16} {'compact':>16} {'MB default':>11} {'MB compact':>11}")
+    default_usage = df_default.memory_usage(deep = True, index = False)
+    compact_usage = df_compact.memory_usage(deep = True, index = False)
+    for column in df_compact.columns:
+        print(f"{column:<26} {str(df_default[column].dtype):>16} {str(df_compact[column].dtype):>16} "
+              f"{default_usage[column] / 1e6:11.2f} {compact_usage[column] / 1e6:11.2f}")
+
+    default, compact = memory_footprint(df_default), memory_footprint(df_compact)
+    for name, key in [('in memory', 'memory_bytes'), ('pickled', 'pickle_bytes'), ('Parquet', 'parquet_bytes')]:
+        print(f"{'total ' + name:<26} {default[key] / 1e6:10.2f} MB -> {compact[key] / 1e6:8.2f} MB "
+              f"({default[key] / compact[key]:.1f}x smaller)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Compare the blocking Open-Meteo client with the asyncio one on a fan-out fetch, against a local fake server
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import fixtures
+from openmeteo_async import OpenMeteoClient
+from pipeline.fake_openmeteo import FakeOpenMeteoServer
+from weather_utils import WEATHER_SCHEMA, daily_variables, fetch_locations, get_openmeteo_connection
+
+def timed_fetch(client, url, locations, params, chunk_size, max_workers):
+    start = time.perf_counter()
+    fetch_locations(client, url, locations, params, chunk_size = chunk_size, max_workers = max_workers)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('--locations', type = int, default = 400)
+    parser.add_argument('--chunk-size', type = int, default = 10, help = 'locations per request')
+    parser.add_argument('--workers', type = int, default = 8, help = 'concurrent fetches of fetch_locations')
+    parser.add_argument('--rate-per-minute', type = int, default = 60000,
+                        help = 'request budget of the asyncio client (600 for the Open-Meteo free quota, which throttles large fetches)')
+    parser.add_argument('--latency', type = float, default = 0.05, help = 'seconds the fake server takes per request')
+    args = parser.parse_args()
+
+    locations = pd.DataFrame({
+        'location_id': [f"location_{i}" for i in range(args.locations)],
+        'latitude': np.linspace(40, 65, args.locations).round(4),
+        'longitude': np.linspace(-5, 25, args.locations).round(4),
+    })
+    params = {
+        "daily": daily_variables(WEATHER_SCHEMA),
+        "timezone": 'Europe/Berlin',
+        "start_date": '2024-01-01',
+        "end_date": '2024-03-31',
+    }
+
+    n_requests = -(-args.locations // args.chunk_size)
+    print(f"{args.locations} locations, {n_requests} requests, {args.latency * 1000:.0f} ms server latency")
+
+    with FakeOpenMeteoServer(latency = args.latency) as server, tempfile.TemporaryDirectory() as cache_dir:
+        # blocking client (its cache file goes in the working directory), one request at a time as in the notebooks,
+        # then with the thread pool
+        os.chdir(cache_dir)
+        sync_client = get_openmeteo_connection()
+        seconds = timed_fetch(sync_client, server.url, locations, params, args.chunk_size, max_workers = 1)
+        print(f"{'blocking, serial':<28} {seconds:8.2f} s")
+        sync_client._session.cache.clear()
+        seconds = timed_fetch(sync_client, server.url, locations, params, args.chunk_size, args.workers)
+        print(f"{'blocking, ' + str(args.workers) + ' threads':<28} {seconds:8.2f} s")
+
+        # asyncio client, cold then warm shared cache
+        cache_path = os.path.join(cache_dir, 'cache.sqlite')
+        async_client = OpenMeteoClient(cache_path = cache_path, rate_per_minute = args.rate_per_minute, max_connections = args.workers)
+        seconds = timed_fetch(async_client, server.url, locations, params, args.chunk_size, args.workers)
+        print(f"{'asyncio, cold cache':<28} {seconds:8.2f} s")
+        seconds = timed_fetch(async_client, server.url, locations, params, args.chunk_size, args.workers)
+        print(f"{'asyncio, warm cache':<28} {seconds:8.2f} s")
+
+        # a second process-like client reading the same cache
+        other_client = OpenMeteoClient(cache_path = cache_path, rate_per_minute = args.rate_per_minute)
+        seconds = timed_fetch(other_client, server.url, locations, params, args.chunk_size, args.workers)
+        print(f"{'asyncio, other client':<28} {seconds:8.2f} s  ({other_client.stats['hits']} shared cache hits)")
+        async_client.close()
+        other_client.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Import time of each entry point against its budget, in fresh interpreters: the best of several cold imports, and the
+heavy modules that must not be loaded at import (they are imported by the code paths that need them).
+Exits with status 1 when an entry point is over budget or loads a deferred module.
+
+    python bench_imports.py [--repeat 5] [--scale 1.0]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from fixtures import ROOT_DIR
+
+# entry point: (module, working directory, budget in seconds, modules deferred until needed)
+ENTRY_POINTS = {
+    'pipeline': ('pipeline.__main__', 'notebooks', 0.6,
+                 ['xgboost', 'sklearn', 'requests_cache', 'openmeteo_requests', 'hopsworks', 'matplotlib', 'seaborn']),
+    'inference_service': ('inference_service', 'notebooks', 0.6, ['sklearn', 'requests_cache', 'hopsworks', 'matplotlib']),
+    'weather_codes': ('weather_codes', 'notebooks', 0.5, ['xgboost', 'sklearn', 'requests_cache', 'openmeteo_requests']),
+    'weather_utils': ('weather_utils', 'notebooks', 0.5, ['xgboost', 'sklearn', 'requests_cache', 'openmeteo_requests']),
+    'webapp_snapshot': ('forecast_snapshot', 'webapp', 0.9, ['hopsworks', 'xgboost', 'sklearn']),
+}
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'loaded': [name for name in {deferred!r} if name in sys.modules]}}))
+"""
+
+def measure(module, work_dir, deferred, repeat):
+    """
+    Best import time over repeat fresh interpreters, and the deferred modules loaded by the import
+    """
+
+    results = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', PROBE.format(module = module, deferred = deferred)],
+                                cwd = os.path.join(ROOT_DIR, work_dir), capture_output = True, text = True, check = True)
+        results.append(json.loads(output.stdout.splitlines()[-1]))
+    return min(result['seconds'] for result in results), results[0]['loaded']
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--scale', type = float, default = 1.0, help = 'budget multiplier, for slower machines')
+    parser.add_argument('--only', nargs = '+', default = None, help = 'entry points to measure')
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'entry point':<20} {'import':>10} {'budget':>10}  deferred modules loaded")
+    for name, (module, work_dir, budget, deferred) in ENTRY_POINTS.items():
+        if args.only is not None and name not in args.only:
+            continue
+        seconds, loaded = measure(module, work_dir, deferred, args.repeat)
+        over = seconds > budget * args.scale
+        if over or loaded:
+            failures.append(name)
+        flag = '  OVER BUDGET' if over else ''
+        print(f"{name:<20} {seconds * 1000:8.0f} ms {budget * args.scale * 1000:7.0f} ms  {', '.join(loaded) or '-'}{flag}")
+
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Offline Open-Meteo fixtures of the benchmarks: multi-location payloads and prepared histories, from the synthetic
+daily responses of the pipeline fakes (notebooks/pipeline/fake_openmeteo.py)
+"""
+
+import os
+import sys
+
+# Make the notebook helpers and the configuration importable
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, 'notebooks'))
+sys.path.append(ROOT_DIR)
+
+from pipeline.fake_openmeteo import decode_messages, encode_daily_response, synthetic_daily_values
+
+def history_payload(n_locations, n_days, seed = 0):
+    """
+    FlatBuffers payload of a multi-location history request, one message per location
+    """
+
+    return b''.join(encode_daily_response(synthetic_daily_values(n_days, seed = seed + i)) for i in range(n_locations))
+
+def forecast_payload(n_locations, n_days = 15, seed = 0):
+    """
+    FlatBuffers payload of a multi-location forecast request, one message per location
+    """
+
+    return b''.join(encode_daily_response(synthetic_daily_values(n_days, with_weather_code = False, seed = seed + i))
+                    for i in range(n_locations))
+
+def synthetic_history(n_locations, n_days, seed = 0):
+    """
+    History of n_locations locations over n_days days, as prepared by the feature pipeline:
+    parsed responses with the month, the grouped codes, their labels and the rolling features
+    """
+
+    import pandas as pd
+    from weather_utils import add_rolling_features, add_weather_code_labels, group_wmo_weather_codes, process_weather_request
+
+    dfs = []
+    for i, response in enumerate(decode_messages(history_payload(n_locations, n_days, seed))):
+        df = process_weather_request(response)
+        df.insert(0, 'location_id', f"location_{i}")
+        dfs.append(df)
+    df = pd.concat(dfs, ignore_index = True)
+    df['month'] = df['date'].dt.month.astype('uint8')
+    df = add_weather_code_labels(group_wmo_weather_codes(df))
+    return add_rolling_features(df)
@@ -0,0 +1,292 @@
+"""
+Benchmark suite of the pipeline stages, fully offline: parsing of the Open-Meteo responses, validation, code mapping,
+label merging, rolling features, hyperparameter search, training, prediction, artifact loading and the web app data
+preparation.
+Each benchmark reports its best wall time and the peak memory of its Python and NumPy allocations (tracemalloc,
+native XGBoost buffers are not seen). Results are written as JSON and compared against a stored baseline.
+
+    python suite.py --locations 50 --years 5 --output results.json
+    python suite.py --baseline baseline.json --tolerance 0.25
+    python suite.py --responses history.fb      # recorded response instead of the synthetic ones
+
+A recorded response is the raw body of a daily history request with format=flatbuffers, e.g. saved with
+curl "https://archive-api.open-meteo.com/v1/archive?latitude=59.33,57.71&longitude=18.07,11.97&start_date=2014-01-01
+&end_date=2023-12-31&daily=weather_code,temperature_2m_min,precipitation_sum,wind_gusts_10m_max&format=flatbuffers"
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from fixtures import ROOT_DIR, forecast_payload, history_payload, synthetic_history
+
+sys.path.append(os.path.join(ROOT_DIR, 'webapp'))
+
+from config import MODEL_FEATURES, MODEL_LABEL, VALIDATION_RANGES
+from pipeline.fake_openmeteo import decode_messages
+from weather_codes import to_weather_codes
+from weather_tuning import tune_hyperparameters
+from weather_utils import (ROLLING_FEATURES, add_rolling_features, add_weather_code_labels, apply_schema, group_wmo_weather_codes,
+                           process_forecast_request, process_weather_request)
+from weather_validation import validate_weather_days
+
+# setup builds the inputs once (not measured), run is measured and returns the number of rows, for the throughput
+Benchmark = namedtuple('Benchmark', ['name', 'setup', 'run'])
+
+TUNING_PARAMS = {
+    'learning_rate': [0.1, 0.2],
+    'n_estimators': [50, 100],
+    'max_depth': [3, 5],
+    'subsample': [0.8, 1.0],
+    'colsample_bytree': [0.8, 1.0],
+}
+
+def training_sample(df_history, max_rows, seed = 0):
+    df = df_history.sample(n = min(max_rows, len(df_history)), random_state = seed)
+    return df[MODEL_FEATURES], df[MODEL_LABEL]
+
+def forecast_features(n_locations, today = '2024-03-10'):
+    """
+    Forecast features of the locations, as fetched by the inference pipeline (rolling windows without stored context)
+    """
+
+    dfs = []
+    for i, response in enumerate(decode_messages(forecast_payload(n_locations))):
+        df = process_forecast_request(response)
+        df.insert(0, 'location_id', f"location_{i}")
+        dfs.append(df)
+    df = pd.concat(dfs, ignore_index = True)
+    df['prediction_date'] = pd.Timestamp(today)
+    df['month'] = df['forecast_date'].dt.month.astype('uint8')
+    return apply_schema(add_rolling_features(df, date_column = 'forecast_date'))
+
+def make_benchmarks(args):
+    """
+    Benchmarks at the scale of the arguments. Inputs shared by several benchmarks are built once, on first use.
+    """
+
+    n_days = int(args.years * 365)
+    cache = {}
+
+    def shared(name, build):
+        if name not in cache:
+            cache[name] = build()
+        return cache[name]
+
+    def payload():
+        if args.responses is not None:
+            with open(args.responses, 'rb') as file:
+                return file.read()
+        return history_payload(args.locations, n_days)
+
+    def responses():
+        return shared('responses', lambda: decode_messages(shared('payload', payload)))
+
+    def history():
+        return shared('history', lambda: synthetic_history(args.locations, n_days))
+
+    def model():
+        def build():
+            from xgboost import XGBRegressor
+
+            X, y = training_sample(history(), args.train_rows)
+            xgb_model = XGBRegressor(objective = 'reg:squarederror', n_estimators = 100, max_depth = 5, random_state = 42)
+            return xgb_model.fit(X, y)
+        return shared('model', build)
+
+    def forecasts():
+        return shared('forecasts', lambda: forecast_features(args.locations))
+
+    def forecast_file():
+        # forecast as the web app downloads it
+        def build():
+            from artifacts import FORECAST_FILE
+            from webapp.forecast_file import write_forecast
+
+            df = forecasts().copy()
+            df['weather_code'] = to_weather_codes(model().predict(df[MODEL_FEATURES]))
+            df = add_weather_code_labels(df)
+            df['location_name'] = df['location_id'].str.replace('_', ' ').str.title()
+            path = os.path.join(args.work_dir, FORECAST_FILE)
+            write_forecast(df, path, model_version = 'benchmark')
+            return path
+        return shared('forecast_file', build)
+
+    def model_dir():
+        # model as the inference pipelines download it
+        def build():
+            from artifacts import save_model
+
+            path = os.path.join(args.work_dir, 'model')
+            save_model(model(), path, 'benchmark_model')
+            return path
+        return shared('model_dir', build)
+
+    def parse_history(responses):
+        return sum(len(process_weather_request(response)) for response in responses)
+
+    def decode_history(responses):
+        return sum(len(process_weather_request(response, as_arrow = True)) for response in responses)
+
+    def tune(X, y):
+        tune_hyperparameters(X, y, TUNING_PARAMS, n_iter = 6, n_folds = 3, early_stopping_rounds = 10, random_state = 42)
+        return len(X)
+
+    def train(X, y):
+        from xgboost import XGBRegressor
+
+        XGBRegressor(objective = 'reg:squarederror', n_estimators = 100, max_depth = 5, random_state = 42).fit(X, y)
+        return len(X)
+
+    def predict_xgboost(xgb_model, X):
+        to_weather_codes(xgb_model.predict(X))
+        return len(X)
+
+    def load_artifacts(path, forecast_path):
+        from artifacts import load_model
+        from webapp.forecast_file import read_forecast
+
+        load_model(path, 'benchmark_model')
+        return len(read_forecast(forecast_path)[0])
+
+    def webapp_snapshot(path):
+        from forecast_file import read_forecast
+        from forecast_snapshot import build_snapshot
+
+        snapshot = build_snapshot(read_forecast(path)[0], version = 'benchmark')
+        location_id = snapshot.index.locations['location_id'].iloc[0]
+        snapshot.index.view(location_id)
+        return len(snapshot.index.df)
+
+    return [
+        Benchmark('parse_history', lambda: (responses(),), parse_history),
+        Benchmark('decode_history', lambda: (responses(),), decode_history),
+        Benchmark('validation', lambda: (history()[['location_id', 'date', 'weather_code_wmo', 'temperature_min', 'precipitation_sum',
+                                                    'wind_gusts_max']],),
+                  lambda df: len(validate_weather_days(df, VALIDATION_RANGES).valid)),
+        Benchmark('code_mapping', lambda: (history().drop(columns = ['weather_code']),),
+                  lambda df: len(group_wmo_weather_codes(df.copy(deep = False)))),
+        Benchmark('label_merging', lambda: (history()[['location_id', 'date', 'weather_code']],),
+                  lambda df: len(add_weather_code_labels(df))),
+        Benchmark('rolling_features', lambda: (history().drop(columns = ROLLING_FEATURES),),
+                  lambda df: len(add_rolling_features(df))),
+        Benchmark('hyperparameter_search', lambda: training_sample(history(), args.train_rows), tune),
+        Benchmark('training', lambda: training_sample(history(), args.train_rows), train),
+        Benchmark('prediction_xgboost', lambda: (model(), forecasts()[MODEL_FEATURES]), predict_xgboost),
+        Benchmark('artifact_loading', lambda: (model_dir(), forecast_file()), load_artifacts),
+        Benchmark('webapp_snapshot', lambda: (forecast_file(),), webapp_snapshot),
+    ]
+
+def measure(benchmark, repeat):
+    """
+    Best wall time over repeat runs, then the peak memory of one more run
+    """
+
+    inputs = benchmark.setup()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = benchmark.run(*inputs)
+        timings.append(time.perf_counter() - start)
+    seconds = min(timings)
+
+    tracemalloc.start()
+    benchmark.run(*inputs)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'seconds': round(seconds, 6),
+        'peak_mb': round(peak_bytes / 1e6, 3),
+        'rows': rows,
+        'rows_per_second': round(rows / seconds, 1) if seconds > 0 else None,
+    }
+
+def compare(results, baseline, tolerance):
+    """
+    Relative change of each result against the baseline, and the names of the benchmarks slower or larger than
+    the baseline by more than tolerance
+    """
+
+    changes, regressions = {}, []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        change = {metric: result[metric] / reference[metric] - 1 for metric in ('seconds', 'peak_mb') if reference[metric]}
+        changes[name] = change
+        if any(ratio > tolerance for ratio in change.values()):
+            regressions.append(name)
+    return changes, regressions
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--locations', type = int, default = 20)
+    parser.add_argument('--years', type = float, default = 2, help = 'years of history per location')
+    parser.add_argument('--train-rows', type = int, default = 20000, help = 'rows of the hyperparameter search and training sample')
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--only', nargs = '+', default = None, help = 'benchmarks to run')
+    parser.add_argument('--responses', default = None, help = 'recorded FlatBuffers history response to parse')
+    parser.add_argument('--output', default = None, help = 'JSON file of the results')
+    parser.add_argument('--baseline', default = None, help = 'JSON results to compare with')
+    parser.add_argument('--tolerance', type = float, default = 0.25, help = 'relative slowdown or memory growth reported as a regression')
+    parser.add_argument('--work-dir', default = None, help = 'folder of the temporary files (a temporary folder by default)')
+    args = parser.parse_args()
+
+    warnings.filterwarnings("ignore")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        args.work_dir = args.work_dir or tmp_dir
+        benchmarks = [benchmark for benchmark in make_benchmarks(args) if args.only is None or benchmark.name in args.only]
+
+        results = {}
+        for benchmark in benchmarks:
+            results[benchmark.name] = measure(benchmark, args.repeat)
+            result = results[benchmark.name]
+            print(f"{benchmark.name:<24} {result['seconds'] * 1000:10.2f} ms {result['peak_mb']:9.2f} MB "
+                  f"{result['rows']:>10,} rows", flush = True)
+
+    report = {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(timespec = 'seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'packages': {module.__name__: module.__version__ for module in (np, pd)},
+            'scale': {'locations': args.locations, 'years': args.years, 'train_rows': args.train_rows,
+                      'responses': os.path.basename(args.responses) if args.responses else 'synthetic'},
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent = 2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline['meta']['scale'] != report['meta']['scale']:
+            print(f"Warning: baseline scale {baseline['meta']['scale']} differs from {report['meta']['scale']}")
+
+        changes, regressions = compare(results, baseline['results'], args.tolerance)
+        print(f"\n{'vs baseline':<24} {'time':>10} {'memory':>10}")
+        for name, change in changes.items():
+            flag = '  REGRESSION' if name in regressions else ''
+            print(f"{name:<24} {change.get('seconds', 0):+10.0%} {change.get('peak_mb', 0):+10.0%}{flag}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
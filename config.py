@@ -2,35 +2,94 @@
 
 # 1) Feature Group about historical weather data
 FG_HISTORY_NAME = 'weather_historical_fg'
-FG_HISTORY_V = 1 # version
-FG_HISTORY_PK = ["date"] # primary key
+FG_HISTORY_V = 4 # version (2: rolling-window features, 3: compact dtypes, 4: location_id in the primary key)
+FG_HISTORY_PK = ["location_id", "date"] # primary key, one row per location and day
 FG_HISTORY_DESC = 'Daily Weather Information' # description
 
 # 2) Feature Group about forecast weather data
 FG_FORECAST_NAME = 'weather_forecast_fg'
-FG_FORECAST_V = 1 # version
-FG_FORECAST_PK = ['forecast_date', 'prediction_date'] # primary key
+FG_FORECAST_V = 3 # version (2: compact dtypes, 3: location_id in the primary key)
+FG_FORECAST_PK = ['location_id', 'forecast_date', 'prediction_date'] # primary key, one row per location and forecast
 FG_FORECAST_DESC = 'Daily Weather Forecast' # description
 
+# Local history store, partitioned by location and month (path from the project root)
+HISTORY_STORE_PATH = 'history_store'
+HISTORY_START_DATE = '2023-12-10' # first day of the backfill
+HISTORY_LOOKBACK_DAYS = 92 # days checked for gaps by the daily feature pipeline (Open-Meteo past days limit)
+BACKFILL_CHUNK_DAYS = 90 # days per chunk of the streaming backfill
+BACKFILL_LOCATION_CHUNK_SIZE = 100 # locations per chunk of the streaming backfill
+USE_LOCAL_HISTORY = False # train from the local history store instead of the Hopsworks Feature View
+QUARANTINE_PATH = 'quarantine' # days failing validation, with the checks they failed (path from the project root)
+QUARANTINE_RETRY_DAYS = 1 # days before a quarantined day is queried again, doubled at each new failure
+QUARANTINE_MAX_RETRY_DAYS = 32 # longest wait before a day failing validation again and again is queried again
+VALIDATION_RANGES = { # plausible values of the measurements, both ends included: days outside are quarantined
+    'temperature_min': (-90, 60), # degrees Celsius
+    'precipitation_sum': (0, 500), # mm
+    'wind_gusts_max': (0, 400), # km/h
+}
+
 # 3) Feature View for historical weather data
 FEATURE_VIEW_NAME = 'weather_fv'
-FEATURE_VIEW_V = 1 # version
+FEATURE_VIEW_V = 4 # version, follows the history Feature Group
 
 # MODEL
 MODEL_NAME = 'weather_code_xgboost_model'
-MODEL_METRIC = 'CV MSE mean'
+MODEL_METRIC = 'MSE' # on the test days, models are ranked on the test days of the same run
 OPTIMIZE_DIRECTION = 'min'
+MODEL_REGISTRY_PATH = 'model_registry' # local file-based registry (path from the project root)
+RANKED_MODEL_VERSIONS = 5 # latest registry versions scored on the test days of the run to pick the model served
+EVALUATION_CACHE_PATH = 'evaluation_cache' # metrics of the models by model version and test days (path from the project root)
+EVALUATION_CACHE_SIZE = 64 # cached evaluations, least recently used first evicted
 MODEL_PATH = 'weather_code_model'
+HEADLESS = False # skip the figures of the training notebook (F1, residuals, importance), for unattended runs
+MODEL_FEATURES = ['temperature_min', 'precipitation_sum', 'wind_gusts_max', 'month',
+                  'precipitation_sum_3d', 'precipitation_sum_7d', 'temperature_min_delta_3d', 'temperature_min_delta_7d']
+MODEL_LABEL = 'weather_code'
+TEST_HOLDOUT_DAYS = 14 # most recent days of the history, held out as test set and never trained on
 N_FOLD_CV = 10 # number of folds for the k-fold Cross-Validation
 LEARNING_RATE_RANGE = [0.01, 0.1, 0.2]
 N_ESTIMATORS_RANGE = [50, 100, 200]
 MAX_DEPTH_RANGE = [3, 5, 7]
 SUBSAMPLE_RANGE = [0.8, 1.0]
 COLSAMPLE_BYTREE_RANGE = [0.8, 1.0]
+TUNING_N_ITER = 10 # number of sampled hyperparameter candidates
+TUNING_HALVING_FACTOR = 3 # successive halving: keep the best 1/factor candidates at each rung
+TUNING_EARLY_STOPPING_ROUNDS = 10 # stop boosting when the early stopping error does not improve
+TUNING_EARLY_STOPPING_FRACTION = 0.1 # share of the training rows of each fold monitored by early stopping, not scored
+INCREMENTAL_TRAINING = True # continue boosting the best model on the new days, instead of retraining from scratch
+INCREMENTAL_ROUNDS = 10 # boosting rounds added by an incremental update
+INCREMENTAL_WINDOW_DAYS = 28 # trailing days of the training set, new days included, an incremental update is fitted on
+RETUNE_EVERY_DAYS = 7 # full tuning and training at least every RETUNE_EVERY_DAYS days
+RETUNE_DRIFT_TOLERANCE = 0.2 # full tuning and training when the validation MSE grows by more than 20%
+BACKTEST_HORIZON_DAYS = 14 # forecast days scored per prediction date, as published by the inference pipeline
+BACKTEST_BATCH_SIZE = 100000 # rows per prediction batch of the backtest
+
+# INFERENCE SERVICE
+INFERENCE_POLL_SECONDS = 30 # interval between checks for a better model version
+INFERENCE_MAX_BATCH_SIZE = 4096 # maximum number of rows of a batched prediction
+INFERENCE_MAX_WAIT_MS = 5 # maximum time a request waits for other requests to batch with
+INFERENCE_CACHE_PATH = 'inference_cache' # cached predictions and published forecast rows of the batch inference (path from the project root)
+PREDICTION_CACHE_SIZE = 100000 # predictions kept by the cache, least recently used evicted first
+
+# PIPELINE
+PIPELINE_SHARD_SIZE = 500 # locations per ingest and inference task of the parallel pipeline
+PIPELINE_MAX_WORKERS = None # worker processes of the parallel pipeline (number of CPUs if None)
+PIPELINE_TASK_RETRIES = 2 # retries of a failed task before the run fails
+PIPELINE_CHECKPOINT_PATH = 'pipeline_checkpoints' # results of the completed tasks of an unfinished run (path from the project root)
 
 # Open-Meteo
 BASELINE_URL_OPEN_METEO = 'https://api.open-meteo.com/v1/forecast'
+BASELINE_URL_OPEN_METEO_ARCHIVE = 'https://archive-api.open-meteo.com/v1/archive' # historical data older than 3 months
 TIMEZONE = 'Europe/Berlin'
+FETCH_CHUNK_SIZE = 100 # number of locations per multi-coordinate request
+FETCH_MAX_WORKERS = 4 # maximum number of concurrent requests
+LOCATIONS_FILE = 'locations.csv' # table of locations in the resources folder
+OPENMETEO_ASYNC = True # pipelines use the asyncio client, with a cache and a request budget shared across processes
+OPENMETEO_CACHE_PATH = 'openmeteo_cache.sqlite' # shared response cache (path from the project root)
+OPENMETEO_RATE_PER_MINUTE = 600 # request budget, one call per location of a multi-location request
+OPENMETEO_MAX_CONNECTIONS = 8 # pooled HTTP connections per process
+OPENMETEO_HISTORY_TTL = 7 * 86400 # seconds a response ending before today is cached
+OPENMETEO_FORECAST_TTL = 3600 # seconds a forecast response is cached
 
 # Stockholm coordinates
 LATITUDE = '59.3294'
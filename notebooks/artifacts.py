@@ -0,0 +1,81 @@
+"""
+Binary artifacts of the pipelines, read without pickle:
+- the model as the native XGBoost booster in UBJSON, parsed by XGBoost itself;
+- the forecast as an uncompressed Arrow IPC file, with a metadata header (model version, prediction date, schema),
+  memory-mapped on read so the table is not copied before the conversion to pandas. Its format is implemented once,
+  in webapp/forecast_file.py, which is deployed with the web app: the pipelines import it from the project root,
+  which they put on the path for the configuration.
+
+    save_model(xgb_model, MODEL_PATH, MODEL_NAME)
+    model = load_model(MODEL_PATH, MODEL_NAME)
+
+    from webapp.forecast_file import read_forecast, write_forecast
+    write_forecast(df_forecasts, '../resources/' + FORECAST_FILE, model_version = model_version(model))
+    df_forecasts, metadata = read_forecast('../resources/' + FORECAST_FILE)
+
+Model versions saved before the binary format only have a pickle. They are converted offline, where unpickling is
+trusted, and published again:
+    python artifacts.py MODEL_DIR
+"""
+
+import argparse
+import os
+import sys
+
+# Forecast file uploaded by the inference pipeline and read by the web app
+FORECAST_FILE = 'forecast.arrow'
+
+def model_file(model_dir, model_name):
+    return os.path.join(model_dir, model_name + '.ubj')
+
+def save_model(model, model_dir, model_name):
+    """
+    Save the model as its native XGBoost booster in UBJSON
+    """
+
+    os.makedirs(model_dir, exist_ok = True)
+    model.save_model(model_file(model_dir, model_name))
+
+def load_model(model_dir, model_name):
+    """
+    XGBRegressor loaded from its UBJSON booster. A model directory without one (a version saved as a pickle only)
+    is an error: pickles are never loaded here, they are converted offline with convert_model.
+    """
+
+    path = model_file(model_dir, model_name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No native booster {path}: convert the pickled model offline with "
+                                f"'python artifacts.py {model_dir}' and publish it again")
+
+    from xgboost import XGBRegressor
+
+    model = XGBRegressor()
+    model.load_model(path)
+    return model
+
+def convert_model(model_dir, model_name):
+    """
+    Save the pickled model of a directory as its native booster next to it, return the booster path.
+    Unpickling runs code from the file: only convert trusted models, never in the serving path.
+    """
+
+    import joblib
+
+    model = joblib.load(os.path.join(model_dir, model_name + '.pkl'))
+    save_model(model, model_dir, model_name)
+    return model_file(model_dir, model_name)
+
+def main():
+    from config import MODEL_NAME
+
+    parser = argparse.ArgumentParser(description = 'Convert a pickled model to its native XGBoost booster')
+    parser.add_argument('model_dir', help = 'directory of the pickled model')
+    parser.add_argument('--model-name', default = MODEL_NAME)
+    args = parser.parse_args()
+
+    print(convert_model(args.model_dir, args.model_name))
+
+if __name__ == '__main__':
+    # Make the configuration importable, as the notebooks do
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    main()
@@ -0,0 +1,150 @@
+"""
+Caches of the batch inference: predictions keyed by model version and feature hash, so consecutive runs only score
+the forecast days whose features or model changed, and hashes of the published forecast rows, so only new or changed
+rows are inserted into the forecast Feature Group.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+import pandas as pd
+
+def model_version(model):
+    """
+    Version of a model from its content: the same trees give the same version, whatever the registry version
+    """
+
+    return hashlib.sha256(bytes(model.get_booster().save_raw('ubj'))).hexdigest()[:16]
+
+def row_hashes(df):
+    """
+    64-bit hash of each row of the dataframe, stable across processes and runs
+    """
+
+    return pd.util.hash_pandas_object(df, index = False).to_numpy()
+
+def load_state(path, default):
+    if path is None or not os.path.exists(path):
+        return default
+    return joblib.load(path)
+
+def save_state(path, state):
+    # written aside and renamed, so a crash never leaves a truncated file
+    os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+    joblib.dump(state, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+class PredictionCache:
+    """
+    Bounded LRU cache of predicted weather codes, keyed by (model version, hash of the feature vector)
+
+        cache = PredictionCache.load('predictions.joblib')
+        y = cache.predict(model_version(model), X, lambda X: to_weather_codes(model.predict(X)))
+        cache.save()
+    """
+
+    def __init__(self, max_size = 100000, path = None, entries = None):
+        self.max_size = max_size
+        self.path = path
+        self.entries = entries if entries is not None else OrderedDict()
+
+        # rows answered from the cache and rows scored by the model, since the cache was loaded
+        self.stats = {'hits': 0, 'misses': 0}
+
+    @classmethod
+    def load(cls, path, max_size = 100000):
+        return cls(max_size, path, load_state(path, None))
+
+    def save(self, path = None):
+        save_state(path or self.path, self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, version, hashes):
+        """
+        Cached predictions of the hashes (0 where missing) and the mask of the hashes found
+        """
+
+        y = np.zeros(len(hashes), dtype = int)
+        found = np.zeros(len(hashes), dtype = bool)
+        for i, row_hash in enumerate(hashes.tolist()):
+            key = (version, row_hash)
+            code = self.entries.get(key)
+            if code is not None:
+                self.entries.move_to_end(key)
+                y[i] = code
+                found[i] = True
+        return y, found
+
+    def add(self, version, X, y):
+        """
+        Add the predictions y of the feature rows X, evicting the least recently used entries beyond max_size
+        """
+
+        for row_hash, code in zip(row_hashes(X).tolist(), np.asarray(y).tolist()):
+            self.entries[(version, row_hash)] = code
+            self.entries.move_to_end((version, row_hash))
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last = False)
+
+    def predict(self, version, X, predict_fn):
+        """
+        Predictions of the feature rows X: cached rows are looked up, the others are scored with predict_fn and cached
+        """
+
+        y, found = self.lookup(version, row_hashes(X))
+        self.stats['hits'] += int(found.sum())
+        self.stats['misses'] += int((~found).sum())
+
+        if not found.all():
+            X_missing = X[~found]
+            y[~found] = predict_fn(X_missing)
+            self.add(version, X_missing, y[~found])
+        return y
+
+class PublishedRows:
+    """
+    Hashes of the rows last published to a Feature Group, by primary key, to insert only the new or changed rows
+    """
+
+    def __init__(self, key, path = None, hashes = None):
+        self.key = list(key)
+        self.path = path
+        self.hashes = hashes if hashes is not None else {}
+
+    @classmethod
+    def load(cls, path, key):
+        return cls(key, path, load_state(path, None))
+
+    def save(self, path = None):
+        save_state(path or self.path, self.hashes)
+
+    def delta(self, df):
+        """
+        Rows of df that are new or differ from the published rows with the same primary key
+        """
+
+        keys = pd.MultiIndex.from_frame(df[self.key].astype(str))
+        hashes = row_hashes(df)
+        changed = np.fromiter((self.hashes.get(key) != row_hash for key, row_hash in zip(keys, hashes.tolist())),
+                              dtype = bool, count = len(df))
+        return df[changed]
+
+    def mark_published(self, df, keep_since = None, date_key = 'forecast_date'):
+        """
+        Record the rows of df as published. Rows whose date_key part of the primary key is before keep_since
+        are forgotten, such as the forecasts of past days.
+        """
+
+        keys = pd.MultiIndex.from_frame(df[self.key].astype(str))
+        self.hashes.update(zip(keys, row_hashes(df).tolist()))
+        if keep_since is not None and self.hashes:
+            position = self.key.index(date_key)
+            stored_keys = list(self.hashes)
+            dates = pd.to_datetime([key[position] for key in stored_keys])
+            keep = dates >= pd.Timestamp(keep_since)
+            self.hashes = {key: self.hashes[key] for key, kept in zip(stored_keys, keep) if kept}
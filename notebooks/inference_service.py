@@ -0,0 +1,248 @@
+"""
+Resident inference service: keeps the best model in memory, hot-swaps it when a better version is published,
+and micro-batches concurrent predict requests into a single model.predict call.
+
+Run locally with the file-based registry:
+    python inference_service.py --registry ../model_registry --features forecast_features.csv --port 8080
+"""
+
+import argparse
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from artifacts import load_model
+from local_registry import LocalModelRegistry
+from weather_codes import to_weather_codes
+
+logger = logging.getLogger(__name__)
+
+class ModelCache:
+    """
+    Best model of the registry, loaded once and swapped atomically when a better version is published
+    """
+
+    def __init__(self, registry, model_name, metric, direction):
+        self.registry = registry
+        self.model_name = model_name
+        self.metric = metric
+        self.direction = direction
+
+        # (version, model) is replaced as a whole, so readers always get a consistent pair
+        self.current = (None, None)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def refresh(self):
+        """
+        Load the best model version if it changed, return True if the model was swapped
+        """
+
+        with self.lock:
+            best_model = self.registry.get_best_model(self.model_name, self.metric, self.direction)
+            if best_model is None or best_model.version == self.current[0]:
+                return False
+
+            # the new model is fully loaded (from its native booster, without pickle) before it replaces the current one
+            model = load_model(best_model.download(), self.model_name)
+            self.current = (best_model.version, model)
+            logger.info("Loaded model %s version %s", self.model_name, best_model.version)
+            return True
+
+    def watch(self, poll_interval):
+        """
+        Check the registry for a better model every poll_interval seconds, in a background thread
+        """
+
+        def loop():
+            while not self.stop_event.wait(poll_interval):
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception("Model refresh failed, keeping version %s", self.current[0])
+
+        thread = threading.Thread(target = loop, name = 'model-watcher', daemon = True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stop_event.set()
+
+def forecast_feature_source(df_features, features):
+    """
+    Feature lookup over a table of forecast features indexed by (location_id, forecast_date).
+    Return a function mapping lists of locations and dates to the feature rows of every combination in the table.
+    Rows with missing features are kept, XGBoost follows the default branch of the splits for them.
+    """
+
+    df_features = df_features.copy()
+    df_features['forecast_date'] = pd.to_datetime(df_features['forecast_date'])
+    if 'month' not in df_features.columns:
+        df_features['month'] = df_features['forecast_date'].dt.month
+    df_features = df_features.set_index(['location_id', 'forecast_date']).sort_index()[features]
+
+    def lookup(locations, dates):
+        index = pd.MultiIndex.from_product([list(locations), pd.to_datetime(list(dates))],
+                                           names = ['location_id', 'forecast_date'])
+        return df_features.reindex(index[index.isin(df_features.index)])
+
+    return lookup
+
+class InferenceServer:
+    """
+    Batched predictions over the cached model: concurrent requests waiting less than max_wait seconds
+    are merged into one model.predict call of at most max_batch_size rows.
+    """
+
+    def __init__(self, model_cache, feature_source, features, max_batch_size = 4096, max_wait = 0.005):
+        self.model_cache = model_cache
+        self.feature_source = feature_source
+        self.features = features
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+
+        self.thread = threading.Thread(target = self.batch_loop, name = 'inference-batcher', daemon = True)
+        self.thread.start()
+
+    def predict(self, locations, dates):
+        """
+        Predict the weather code of every combination of locations and dates with features available.
+        Return a dataframe with location_id, forecast_date, weather_code and model_version.
+        """
+
+        X = self.feature_source(locations, dates)
+        if X.empty:
+            return pd.DataFrame(columns = ['location_id', 'forecast_date', 'weather_code', 'model_version'])
+
+        future = Future()
+        self.requests.put((X, future))
+        y, version = future.result()
+
+        df = X.index.to_frame(index = False)
+        df['weather_code'] = y
+        df['model_version'] = version
+        return df
+
+    def next_batch(self):
+        """
+        Block for the first request, then gather the requests arriving within max_wait seconds
+        """
+
+        batch = [self.requests.get()]
+        n_rows = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while n_rows < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout = timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            n_rows += len(request[0])
+        return batch
+
+    def batch_loop(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                version, model = self.model_cache.current
+                if model is None:
+                    raise RuntimeError("No model loaded")
+
+                X = pd.concat([X for X, future in batch])[self.features]
+
+                # Round predicted value to closest weather code, within the code range
+                y = to_weather_codes(model.predict(X))
+
+                # hand each request its slice of the batch
+                start = 0
+                for X, future in batch:
+                    future.set_result((y[start:start + len(X)], version))
+                    start += len(X)
+            except Exception as e:
+                for X, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+def make_handler(server):
+    """
+    HTTP handler: POST /predict with {"locations": [...], "dates": [...]}, GET /health
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != '/health':
+                return self.send_json(404, {'error': 'not found'})
+            self.send_json(200, {'model_version': server.model_cache.current[0]})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                return self.send_json(404, {'error': 'not found'})
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                df = server.predict(request['locations'], request['dates'])
+            except Exception as e:
+                return self.send_json(400, {'error': str(e)})
+            df['forecast_date'] = df['forecast_date'].dt.strftime('%Y-%m-%d')
+            self.send_json(200, df.to_dict(orient = 'records'))
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    return Handler
+
+def main():
+    from webapp.forecast_file import read_forecast
+    from config import (INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_MS, INFERENCE_POLL_SECONDS, MODEL_FEATURES, MODEL_METRIC,
+                        MODEL_NAME, MODEL_REGISTRY_PATH, OPTIMIZE_DIRECTION)
+
+    parser = argparse.ArgumentParser(description = 'Weather code inference service')
+    parser.add_argument('--registry', default = os.path.join('..', MODEL_REGISTRY_PATH), help = 'local model registry directory')
+    parser.add_argument('--features', required = True, help = 'Arrow forecast file, CSV or Parquet table of forecast features')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8080)
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.INFO)
+
+    if args.features.endswith('.arrow'):
+        df_features, _ = read_forecast(args.features)
+    elif args.features.endswith('.parquet'):
+        df_features = pd.read_parquet(args.features)
+    else:
+        df_features = pd.read_csv(args.features, index_col = None)
+
+    model_cache = ModelCache(LocalModelRegistry(args.registry), MODEL_NAME, MODEL_METRIC, OPTIMIZE_DIRECTION)
+    model_cache.refresh()
+    model_cache.watch(INFERENCE_POLL_SECONDS)
+
+    server = InferenceServer(model_cache, forecast_feature_source(df_features, MODEL_FEATURES), MODEL_FEATURES,
+                             max_batch_size = INFERENCE_MAX_BATCH_SIZE, max_wait = INFERENCE_MAX_WAIT_MS / 1000)
+
+    httpd = ThreadingHTTPServer((args.host, args.port), make_handler(server))
+    logger.info("Serving on http://%s:%s", args.host, args.port)
+    httpd.serve_forever()
+
+if __name__ == '__main__':
+    # Make the configuration and the forecast file importable, as the notebooks do
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    main()
@@ -0,0 +1,96 @@
+"""
+File-based model registry standing in for the Hopsworks Model Registry when running locally.
+Each model version is a directory <registry>/<model name>/<version>/ with the model files and a metrics.json.
+"""
+
+import json
+import os
+import shutil
+
+METRICS_FILE = 'metrics.json'
+
+class LocalModel:
+    """
+    A model version of the local registry, with the subset of the Hopsworks model API used by the pipelines
+    """
+
+    def __init__(self, registry, name, version = None, metrics = None, description = None):
+        self.registry = registry
+        self.name = name
+        self.version = version
+        self.training_metrics = metrics or {}
+        self.description = description
+
+    @property
+    def model_path(self):
+        return os.path.join(self.registry.path, self.name, str(self.version))
+
+    def download(self):
+        """
+        Local directory of the model files (already on disk)
+        """
+
+        return self.model_path
+
+    def save(self, model_path):
+        """
+        Publish the files of model_path as the next version, atomically
+        """
+
+        model_root = os.path.join(self.registry.path, self.name)
+        os.makedirs(model_root, exist_ok = True)
+        self.version = max(self.registry.versions(self.name), default = 0) + 1
+
+        # copied to a hidden directory first, so readers never see a half-written version
+        tmp_path = os.path.join(model_root, f".{self.version}.tmp")
+        shutil.rmtree(tmp_path, ignore_errors = True)
+        shutil.copytree(model_path, tmp_path)
+        with open(os.path.join(tmp_path, METRICS_FILE), 'w') as file:
+            json.dump({'metrics': self.training_metrics, 'description': self.description}, file, indent = 4)
+        os.rename(tmp_path, self.model_path)
+        return self
+
+class LocalModelRegistry:
+    """
+    Local model registry, with the subset of the Hopsworks Model Registry API used by the pipelines
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+
+        # Hopsworks creates Python models through mr.python
+        self.python = self
+
+    def create_model(self, name, metrics = None, description = None, **kwargs):
+        return LocalModel(self, name, metrics = metrics, description = description)
+
+    def versions(self, name):
+        """
+        Published versions of a model
+        """
+
+        model_root = os.path.join(self.path, name)
+        if not os.path.isdir(model_root):
+            return []
+        return sorted(int(version) for version in os.listdir(model_root) if version.isdigit())
+
+    def get_model(self, name, version):
+        with open(os.path.join(self.path, name, str(version), METRICS_FILE)) as file:
+            info = json.load(file)
+        return LocalModel(self, name, version, info['metrics'], info.get('description'))
+
+    def get_models(self, name):
+        return [self.get_model(name, version) for version in self.versions(name)]
+
+    def get_best_model(self, name, metric, direction):
+        """
+        Version with the best value of the metric ('max' or 'min' direction), None if no version has the metric
+        """
+
+        models = [model for model in self.get_models(name) if metric in model.training_metrics]
+        if not models:
+            return None
+
+        sign = 1 if direction == 'max' else -1
+        return max(models, key = lambda model: (sign * model.training_metrics[metric], model.version))
@@ -0,0 +1,235 @@
+"""
+Lightweight instrumentation of the pipelines and the web app: counters, gauges and timers in a process-wide registry,
+exported as a JSON-lines run report or in the Prometheus text format.
+Disabled by default: every call then returns after checking one flag, so the hot paths stay instrumented for free.
+
+    metrics.enable()
+    with metrics.timer('openmeteo_request_seconds'):
+        responses = openmeteo.weather_api(url, params)
+    metrics.incr('openmeteo_requests_total')
+    metrics.write_jsonl('run.jsonl', run = '2024-03-10')
+
+Worker processes start from an empty registry and hand a snapshot() of it back, which the parent merge()s.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from functools import wraps
+
+class Registry:
+    """
+    Series of the process, keyed by (name, sorted labels). A timer keeps its count, total and maximum seconds.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timers.clear()
+
+REGISTRY = Registry()
+
+# returned by timer() when disabled, shared so that nothing is allocated
+NULL_TIMER = nullcontext()
+
+def enable():
+    REGISTRY.enabled = True
+
+def disable():
+    REGISTRY.enabled = False
+
+def is_enabled():
+    return REGISTRY.enabled
+
+def reset():
+    REGISTRY.reset()
+
+def series_key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def incr(name, value = 1, **labels):
+    if not REGISTRY.enabled:
+        return
+    key = series_key(name, labels)
+    with REGISTRY.lock:
+        REGISTRY.counters[key] = REGISTRY.counters.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    if not REGISTRY.enabled:
+        return
+    key = series_key(name, labels)
+    with REGISTRY.lock:
+        REGISTRY.gauges[key] = value
+
+def observe(name, seconds, **labels):
+    """
+    Record one duration of the timer name
+    """
+
+    if not REGISTRY.enabled:
+        return
+    key = series_key(name, labels)
+    with REGISTRY.lock:
+        count, total, maximum = REGISTRY.timers.get(key, (0, 0.0, 0.0))
+        REGISTRY.timers[key] = (count + 1, total + seconds, max(maximum, seconds))
+
+class Timer:
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.start
+        observe(self.name, self.seconds, **self.labels)
+
+def timer(name, **labels):
+    """
+    Context manager timing its block into the timer name
+    """
+
+    if not REGISTRY.enabled:
+        return NULL_TIMER
+    return Timer(name, labels)
+
+def timed(name, **labels):
+    """
+    Decorator timing each call of the function into the timer name
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not REGISTRY.enabled:
+                return function(*args, **kwargs)
+            with Timer(name, labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_frame(name, df, **labels):
+    """
+    Rows and in-memory bytes of a dataframe, as the gauges <name>_rows and <name>_bytes
+    """
+
+    if not REGISTRY.enabled:
+        return
+    set_gauge(name + '_rows', len(df), **labels)
+    set_gauge(name + '_bytes', int(df.memory_usage(deep = True).sum()), **labels)
+
+def requests_cache_hook(response, *args, **kwargs):
+    """
+    Response hook of a requests_cache session, counting the responses served from the cache and from the network
+    """
+
+    from_cache = getattr(response, 'from_cache', None)
+    if from_cache is not None:
+        incr('openmeteo_cache_hits_total' if from_cache else 'openmeteo_cache_misses_total', backend = 'requests_cache')
+    return response
+
+def series():
+    """
+    Every series of the registry as a dict: type, name, labels and values
+    """
+
+    with REGISTRY.lock:
+        counters, gauges, timers = dict(REGISTRY.counters), dict(REGISTRY.gauges), dict(REGISTRY.timers)
+
+    rows = []
+    for (name, labels), value in sorted(counters.items()):
+        rows.append({'type': 'counter', 'name': name, 'labels': dict(labels), 'value': value})
+    for (name, labels), value in sorted(gauges.items()):
+        rows.append({'type': 'gauge', 'name': name, 'labels': dict(labels), 'value': value})
+    for (name, labels), (count, total, maximum) in sorted(timers.items()):
+        rows.append({'type': 'timer', 'name': name, 'labels': dict(labels),
+                     'count': count, 'sum': round(total, 6), 'max': round(maximum, 6)})
+    return rows
+
+def snapshot():
+    """
+    Copy of the series of the process, picklable, to be merged into the registry of another process
+    """
+
+    with REGISTRY.lock:
+        return dict(REGISTRY.counters), dict(REGISTRY.gauges), dict(REGISTRY.timers)
+
+def merge(series_snapshot):
+    """
+    Add the series of a snapshot taken in another process, such as a worker of a process pool:
+    counters and timers are summed, gauges replaced
+    """
+
+    if not REGISTRY.enabled:
+        return
+    counters, gauges, timers = series_snapshot
+    with REGISTRY.lock:
+        for key, value in counters.items():
+            REGISTRY.counters[key] = REGISTRY.counters.get(key, 0) + value
+        REGISTRY.gauges.update(gauges)
+        for key, (count, total, maximum) in timers.items():
+            previous_count, previous_total, previous_maximum = REGISTRY.timers.get(key, (0, 0.0, 0.0))
+            REGISTRY.timers[key] = (previous_count + count, previous_total + total, max(previous_maximum, maximum))
+
+def write_jsonl(path, **run_labels):
+    """
+    Append the series to a JSON-lines run report, one line per series with the run labels and the time of the report
+    """
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+    timestamp = time.time()
+    with open(path, 'a') as file:
+        for row in series():
+            file.write(json.dumps(dict(run_labels, timestamp = timestamp, **row)) + '\n')
+
+def prometheus_text():
+    """
+    Series in the Prometheus text exposition format: timers as summaries (count and sum) with a _max gauge
+    """
+
+    def format_labels(labels):
+        if not labels:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+        return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+    # samples of each family, in order: the parsers expect the samples of a family after its TYPE line, together
+    families = {}
+    def add(family, kind, sample):
+        families.setdefault(family, (kind, []))[1].append(sample)
+
+    for row in series():
+        name, labels = row['name'], format_labels(row['labels'])
+        if row['type'] == 'timer':
+            add(name, 'summary', f"{name}_count{labels} {row['count']}")
+            add(name, 'summary', f"{name}_sum{labels} {row['sum']}")
+            add(f"{name}_max", 'gauge', f"{name}_max{labels} {row['max']}")
+        else:
+            add(name, row['type'], f"{name}{labels} {row['value']}")
+
+    lines = []
+    for family, (kind, samples) in families.items():
+        lines += [f"# TYPE {family} {kind}", *samples]
+    return '\n'.join(lines) + '\n'
+
+def write_prometheus(path):
+    """
+    Write the series for the textfile collector of the node exporter, atomically
+    """
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+    with open(path + '.tmp', 'w') as file:
+        file.write(prometheus_text())
+    os.replace(path + '.tmp', path)
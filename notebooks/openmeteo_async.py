@@ -0,0 +1,254 @@
+"""
+Asynchronous Open-Meteo client: one pooled aiohttp session, a token bucket keeping the request rate within the
+Open-Meteo quotas, coalescing of identical in-flight requests, and a response cache in a SQLite database (WAL mode)
+that processes share. Historical and forecast responses are cached with different TTLs.
+SQLite calls block (the token bucket waits up to 30 s for the write lock of another process), so the asynchronous
+client runs them in worker threads and the event loop keeps serving the other requests.
+
+OpenMeteoClient runs the asynchronous client on a background event loop and exposes the blocking weather_api of
+openmeteo_requests.Client, so it plugs into fetch_locations and the pipelines unchanged.
+"""
+
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from datetime import date
+
+import aiohttp
+from openmeteo_requests.Client import OpenMeteoRequestsError
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+
+import metrics
+
+# Responses with dates until yesterday do not change anymore, forecasts are updated every hour
+HISTORY_TTL = 7 * 86400
+FORECAST_TTL = 3600
+
+# Free API quota: 600 calls per minute, a multi-location request counts one call per location
+RATE_PER_MINUTE = 600
+
+# Status codes worth retrying, with exponential backoff
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+def normalize_params(params):
+    """
+    Canonical query string of the params: sorted keys, lists joined by commas, numbers without trailing zeros
+    """
+
+    def normalize(value):
+        if isinstance(value, (list, tuple)):
+            return ','.join(normalize(item) for item in value)
+        if isinstance(value, float):
+            return repr(value)
+        if isinstance(value, str) and '.' in value:
+            try:
+                return repr(float(value))
+            except ValueError:
+                return value
+        return str(value)
+
+    return '&'.join(f"{key}={normalize(params[key])}" for key in sorted(params))
+
+def cache_key(url, params):
+    return hashlib.sha256(f"{url}?{normalize_params(params)}".encode()).hexdigest()
+
+def response_ttl(params, history_ttl = HISTORY_TTL, forecast_ttl = FORECAST_TTL):
+    """
+    Historical TTL for requests ending before today, forecast TTL otherwise
+    """
+
+    end_date = params.get('end_date')
+    if end_date is not None and date.fromisoformat(str(end_date)) < date.today():
+        return history_ttl
+    return forecast_ttl
+
+def decode_responses(data):
+    """
+    Split the FlatBuffers payload into one WeatherApiResponse per location, as openmeteo_requests.Client does
+    """
+
+    responses = []
+    pos = 0
+    while pos < len(data):
+        length = int.from_bytes(data[pos:pos + 4], byteorder = 'little')
+        # error messages in the stream start with "Unexpected"
+        if length == 0x78656E55:
+            raise OpenMeteoRequestsError(data[pos:].decode('utf-8'))
+        responses.append(WeatherApiResponse.GetRootAs(data, pos + 4))
+        pos += length + 4
+    return responses
+
+class SQLiteCache:
+    """
+    Response cache and token bucket state in a SQLite database. WAL mode lets readers go on while a process writes,
+    so pipeline workers share the cache and the request budget. The bucket has its own connection, so cached
+    responses are read while a request waits for the write lock of the bucket.
+    """
+
+    def __init__(self, path, rate_per_minute = RATE_PER_MINUTE):
+        self.path = path
+        self.rate = rate_per_minute / 60
+        self.capacity = rate_per_minute
+        self.lock = threading.Lock()
+        self.bucket_lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, timeout = 30, check_same_thread = False, isolation_level = None)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, body BLOB, expires REAL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS bucket (id INTEGER PRIMARY KEY CHECK (id = 0), tokens REAL, updated REAL)")
+        self.connection.execute("INSERT OR IGNORE INTO bucket VALUES (0, ?, ?)", (self.capacity, time.time()))
+        self.connection.execute("DELETE FROM responses WHERE expires < ?", (time.time(),))
+
+        self.bucket_connection = sqlite3.connect(path, timeout = 30, check_same_thread = False, isolation_level = None)
+        self.bucket_connection.execute("PRAGMA synchronous = NORMAL")
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT body FROM responses WHERE key = ? AND expires >= ?", (key, time.time())).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, key, body, ttl):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, body, time.time() + ttl))
+
+    def take_tokens(self, cost):
+        """
+        Take cost tokens from the shared bucket, refilled at the quota rate.
+        Return 0 when taken, otherwise the seconds to wait before trying again.
+        """
+
+        cost = min(cost, self.capacity)
+        with self.bucket_lock:
+            # the write lock is taken upfront, so two processes never spend the same tokens
+            self.bucket_connection.execute("BEGIN IMMEDIATE")
+            try:
+                tokens, updated = self.bucket_connection.execute("SELECT tokens, updated FROM bucket").fetchone()
+                now = time.time()
+                tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+                wait = 0 if tokens >= cost else (cost - tokens) / self.rate
+                if wait == 0:
+                    tokens -= cost
+                self.bucket_connection.execute("UPDATE bucket SET tokens = ?, updated = ?", (tokens, now))
+            finally:
+                self.bucket_connection.execute("COMMIT")
+        return wait
+
+    def close(self):
+        # waits for the calls running in other threads
+        with self.lock, self.bucket_lock:
+            self.connection.close()
+            self.bucket_connection.close()
+
+class AsyncOpenMeteo:
+    """
+    Asynchronous Open-Meteo client. Identical requests in flight at the same time share one HTTP request,
+    and cached responses do not spend any of the request budget.
+    """
+
+    def __init__(self, cache_path = '.cache.sqlite', rate_per_minute = RATE_PER_MINUTE, max_connections = 8,
+                 history_ttl = HISTORY_TTL, forecast_ttl = FORECAST_TTL, retries = 5, backoff_factor = 0.2, timeout = 60):
+        self.cache = SQLiteCache(cache_path, rate_per_minute)
+        self.history_ttl = history_ttl
+        self.forecast_ttl = forecast_ttl
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.session = None
+        self.in_flight = {}
+
+        # hits, misses and coalesced requests
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+
+    async def weather_api(self, url, params):
+        params = dict(params, format = 'flatbuffers')
+        key = cache_key(url, params)
+
+        body = await asyncio.to_thread(self.cache.get, key)
+        if body is not None:
+            self.stats['hits'] += 1
+            metrics.incr('openmeteo_cache_hits_total', backend = 'sqlite')
+            return decode_responses(body)
+
+        # an identical request is already running (possibly started while the cache was read): wait for its response
+        if key in self.in_flight:
+            self.stats['coalesced'] += 1
+            metrics.incr('openmeteo_coalesced_total')
+            return decode_responses(await asyncio.shield(self.in_flight[key]))
+
+        self.stats['misses'] += 1
+        metrics.incr('openmeteo_cache_misses_total', backend = 'sqlite')
+        task = asyncio.ensure_future(self.fetch(url, params, key))
+        self.in_flight[key] = task
+        try:
+            return decode_responses(await asyncio.shield(task))
+        finally:
+            self.in_flight.pop(key, None)
+
+    async def fetch(self, url, params, key):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit = self.max_connections)
+            self.session = aiohttp.ClientSession(connector = connector, timeout = aiohttp.ClientTimeout(total = self.timeout))
+
+        # one call per location of a multi-location request
+        latitude = params.get('latitude')
+        cost = len(latitude) if isinstance(latitude, (list, tuple)) else 1
+        query = {name: ','.join(map(str, value)) if isinstance(value, (list, tuple)) else str(value) for name, value in params.items()}
+
+        for attempt in range(self.retries + 1):
+            while (wait := await asyncio.to_thread(self.cache.take_tokens, cost)) > 0:
+                await asyncio.sleep(wait)
+
+            try:
+                async with self.session.get(url, params = query) as response:
+                    body = await response.read()
+                    if response.status == 400:
+                        raise OpenMeteoRequestsError(body.decode('utf-8', errors = 'replace'))
+                    if response.status not in RETRY_STATUS:
+                        response.raise_for_status()
+                        await asyncio.to_thread(self.cache.put, key, body, response_ttl(params, self.history_ttl, self.forecast_ttl))
+                        return body
+                    retry_after = response.headers.get('Retry-After')
+                    error = OpenMeteoRequestsError(f"HTTP {response.status}")
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as connection_error:
+                retry_after, error = None, connection_error
+
+            if attempt == self.retries:
+                raise OpenMeteoRequestsError(f"failed to request {url!r}: {error}") from error
+            delay = float(retry_after) if retry_after is not None else self.backoff_factor * 2 ** attempt
+            await asyncio.sleep(delay)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        await asyncio.to_thread(self.cache.close)
+
+class OpenMeteoClient:
+    """
+    Blocking facade of AsyncOpenMeteo, with the weather_api method of openmeteo_requests.Client.
+    Requests from any thread run on one background event loop, so they share the connection pool,
+    the request budget and the coalescing of identical requests.
+    """
+
+    def __init__(self, **client_kwargs):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target = self.loop.run_forever, name = 'openmeteo-loop', daemon = True).start()
+        self.client = asyncio.run_coroutine_threadsafe(self.create_client(client_kwargs), self.loop).result()
+
+    async def create_client(self, client_kwargs):
+        return AsyncOpenMeteo(**client_kwargs)
+
+    @property
+    def stats(self):
+        return self.client.stats
+
+    def weather_api(self, url, params):
+        return asyncio.run_coroutine_threadsafe(self.client.weather_api(url, params), self.loop).result()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,13 @@
+"""
+Feature, training and inference pipelines as functions of one process.
+The stages share one Hopsworks connection and one Open-Meteo session through a PipelineContext, and hand over
+their dataframes and the trained model in memory.
+
+Run from the notebooks folder:
+    python -m pipeline
+    python -m pipeline --offline --stages feature training
+    python -m pipeline --parallel
+"""
+
+from pipeline.context import PipelineContext
+from pipeline.stages import STAGES, feature_stage, inference_stage, run_pipeline, training_stage
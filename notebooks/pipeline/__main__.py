@@ -0,0 +1,102 @@
+"""
+Command line entry point:
+    python -m pipeline [--stages feature training inference] [--offline] [--today YYYY-MM-DD]
+    python -m pipeline --parallel [--shard-size N] [--workers N]
+    python -m pipeline --backfill YYYY-MM-DD [--offline]
+    python -m pipeline --backtest YYYY-MM-DD [--backtest-end YYYY-MM-DD] [--offline]
+    python -m pipeline ... --metrics DIR      # run report DIR/<date>.jsonl and Prometheus text DIR/pipeline.prom
+"""
+
+import argparse
+import logging
+import os
+import time
+import warnings
+from functools import partial
+
+import pandas as pd
+
+import metrics
+from pipeline.context import ROOT_DIR, PipelineContext, open_openmeteo
+from pipeline.stages import STAGES, backfill_stage, backtest_stage, run_pipeline
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Weather code feature, training and inference pipeline')
+    parser.add_argument('--stages', nargs = '+', choices = list(STAGES), default = list(STAGES), help = 'stages to run, in order')
+    parser.add_argument('--offline', action = 'store_true', help = 'run with local stand-ins for Hopsworks and Open-Meteo')
+    parser.add_argument('--local-project', default = 'local_project', help = 'local Hopsworks stand-in folder (path from the project root), with --offline')
+    parser.add_argument('--parallel', action = 'store_true', help = 'run ingest and inference per location shard on a process pool')
+    parser.add_argument('--shard-size', type = int, default = None, help = 'locations per shard, with --parallel')
+    parser.add_argument('--workers', type = int, default = None, help = 'worker processes, with --parallel')
+    parser.add_argument('--openmeteo-url', default = None, help = 'Open-Meteo endpoint, e.g. a local fake server')
+    parser.add_argument('--backfill', type = pd.Timestamp, default = None, metavar = 'START',
+                        help = 'stream the history from START until yesterday into the feature store, instead of the stages')
+    parser.add_argument('--backtest', type = pd.Timestamp, default = None, metavar = 'START',
+                        help = 'backtest the best model on the forecasts archived since START, instead of the stages')
+    parser.add_argument('--backtest-end', type = pd.Timestamp, default = None, metavar = 'END',
+                        help = 'last prediction date of the backtest, the day before yesterday by default')
+    parser.add_argument('--today', type = pd.Timestamp, default = None, help = 'date of the run, today by default')
+    parser.add_argument('--metrics', default = None, metavar = 'DIR',
+                        help = 'collect the run metrics and write them to DIR (path from the project root)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.INFO, format = '%(asctime)s %(name)s %(message)s')
+    warnings.filterwarnings("ignore")
+
+    if args.metrics is not None:
+        metrics.enable()
+
+    today = args.today.date() if args.today is not None else pd.Timestamp.today().date()
+    if args.offline:
+        from config import MODEL_REGISTRY_PATH
+        from pipeline.fake_openmeteo import FakeOpenMeteo
+        from pipeline.local import LocalProject
+
+        project = LocalProject(os.path.join(ROOT_DIR, args.local_project), os.path.join(ROOT_DIR, MODEL_REGISTRY_PATH))
+        # synthetic Open-Meteo in process, unless a (fake) endpoint is given
+        openmeteo_factory = open_openmeteo if args.openmeteo_url is not None else partial(FakeOpenMeteo, today = today)
+        ctx = PipelineContext(project = project, openmeteo_factory = openmeteo_factory, today = today, offline = True)
+    else:
+        ctx = PipelineContext(today = today)
+
+    if args.openmeteo_url is not None:
+        ctx.openmeteo_url = args.openmeteo_url
+
+    if args.backfill is not None:
+        from config import BASELINE_URL_OPEN_METEO_ARCHIVE
+
+        start = time.perf_counter()
+        backfill_stage(ctx, args.backfill.date(), url = args.openmeteo_url or BASELINE_URL_OPEN_METEO_ARCHIVE)
+        timings = [('backfill', time.perf_counter() - start)]
+    elif args.backtest is not None:
+        start = time.perf_counter()
+        backtest_stage(ctx, args.backtest, end = args.backtest_end)
+        timings = [('backtest', time.perf_counter() - start)]
+    elif args.parallel:
+        from config import PIPELINE_MAX_WORKERS, PIPELINE_SHARD_SIZE
+        from pipeline.sharded import run_sharded_pipeline
+
+        run_sharded_pipeline(ctx, args.stages,
+                             shard_size = args.shard_size or PIPELINE_SHARD_SIZE,
+                             max_workers = args.workers or PIPELINE_MAX_WORKERS)
+        timings = ctx.timings
+    else:
+        timings = run_pipeline(ctx, args.stages)
+
+    # Timing report
+    for name, seconds in timings:
+        print(f"{name:<16} {seconds:8.2f} s")
+    print(f"{'total':<16} {sum(seconds for name, seconds in timings):8.2f} s")
+
+    # Metrics export, the stage timings along with the counters and timers of the run
+    if args.metrics is not None:
+        for name, seconds in timings:
+            metrics.observe('stage_seconds', seconds, stage = name)
+        metrics_dir = os.path.join(ROOT_DIR, args.metrics)
+        mode = ('backfill' if args.backfill is not None else 'backtest' if args.backtest is not None
+                else 'parallel' if args.parallel else 'sequential')
+        metrics.write_jsonl(os.path.join(metrics_dir, f"{today}.jsonl"), run = str(today), mode = mode, offline = args.offline)
+        metrics.write_prometheus(os.path.join(metrics_dir, 'pipeline.prom'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+State shared by the stages of one pipeline run
+"""
+
+import os
+import sys
+
+import pandas as pd
+
+# Make the configuration importable, as the notebooks do
+NOTEBOOKS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROOT_DIR = os.path.dirname(NOTEBOOKS_DIR)
+sys.path.append(ROOT_DIR)
+
+from config import *
+from forecast_cache import PredictionCache, PublishedRows
+from weather_evaluation import EvaluationCache
+from weather_store import HistoryStore
+from weather_utils import get_openmeteo_connection
+from weather_validation import Quarantine
+
+def open_openmeteo():
+    """
+    Open-Meteo client of the pipelines: the asyncio one, with the response cache and the request budget
+    shared by all the processes of a run, or the blocking one
+    """
+
+    if OPENMETEO_ASYNC:
+        return get_openmeteo_connection(asynchronous = True,
+                                        cache_path = os.path.join(ROOT_DIR, OPENMETEO_CACHE_PATH),
+                                        rate_per_minute = OPENMETEO_RATE_PER_MINUTE,
+                                        max_connections = OPENMETEO_MAX_CONNECTIONS,
+                                        history_ttl = OPENMETEO_HISTORY_TTL,
+                                        forecast_ttl = OPENMETEO_FORECAST_TTL)
+    return get_openmeteo_connection()
+
+class PipelineContext:
+    """
+    One Hopsworks connection, one Open-Meteo session and the dataframes handed over between stages.
+    Connections are opened on first use, so a stage that does not need one does not pay for it.
+    A local stand-in project and Open-Meteo client can be passed in to run offline, and the local files can be kept
+    under another root_dir than the project root. The Open-Meteo factory is picklable, so worker processes open their
+    own session the same way.
+    """
+
+    def __init__(self, project = None, openmeteo = None, openmeteo_url = BASELINE_URL_OPEN_METEO, today = None, offline = False,
+                 openmeteo_factory = open_openmeteo, root_dir = ROOT_DIR):
+        self._project = project
+        self._openmeteo = openmeteo
+        self.openmeteo_factory = openmeteo_factory
+        self._fs = None
+        self._mr = None
+        self._history_store = None
+        self._locations = None
+        self._prediction_cache = None
+        self._evaluation_cache = None
+        self._published_forecasts = None
+        self._quarantine = None
+        self.openmeteo_url = openmeteo_url
+        self.today = today or pd.Timestamp.today().date()
+        self.offline = offline
+        self.root_dir = root_dir
+
+        # outputs of the stages, read by the following ones
+        self.frames = {}
+        self.model = None
+        self.model_dir = None
+
+        # (stage, seconds) of the stages run so far
+        self.timings = []
+
+    @property
+    def project(self):
+        if self._project is None:
+            import hopsworks
+            self._project = hopsworks.login()
+        return self._project
+
+    @property
+    def fs(self):
+        if self._fs is None:
+            self._fs = self.project.get_feature_store()
+        return self._fs
+
+    @property
+    def mr(self):
+        if self._mr is None:
+            self._mr = self.project.get_model_registry()
+        return self._mr
+
+    @property
+    def openmeteo(self):
+        if self._openmeteo is None:
+            self._openmeteo = self.openmeteo_factory()
+        return self._openmeteo
+
+    @property
+    def history_store(self):
+        if self._history_store is None:
+            self._history_store = HistoryStore(self.path(HISTORY_STORE_PATH), key = FG_HISTORY_PK)
+        return self._history_store
+
+    @property
+    def locations(self):
+        if self._locations is None:
+            self._locations = pd.read_csv(self.path('resources', LOCATIONS_FILE))
+        return self._locations
+
+    @property
+    def prediction_cache(self):
+        if self._prediction_cache is None:
+            self._prediction_cache = PredictionCache.load(self.path(INFERENCE_CACHE_PATH, 'predictions.joblib'), PREDICTION_CACHE_SIZE)
+        return self._prediction_cache
+
+    @property
+    def evaluation_cache(self):
+        if self._evaluation_cache is None:
+            self._evaluation_cache = EvaluationCache.load(self.path(EVALUATION_CACHE_PATH, 'evaluations.joblib'), EVALUATION_CACHE_SIZE)
+        return self._evaluation_cache
+
+    @property
+    def published_forecasts(self):
+        # offline runs write to the local project, their rows are not published to Hopsworks
+        if self._published_forecasts is None:
+            file_name = f"{FG_FORECAST_NAME}_{FG_FORECAST_V}{'_offline' if self.offline else ''}.joblib"
+            self._published_forecasts = PublishedRows.load(self.path(INFERENCE_CACHE_PATH, file_name), FG_FORECAST_PK)
+        return self._published_forecasts
+
+    @property
+    def quarantine(self):
+        if self._quarantine is None:
+            self._quarantine = Quarantine(self.path(QUARANTINE_PATH), QUARANTINE_RETRY_DAYS, QUARANTINE_MAX_RETRY_DAYS)
+        return self._quarantine
+
+    @property
+    def yesterday(self):
+        return self.today - pd.Timedelta(days = 1).to_pytimedelta()
+
+    def path(self, *parts):
+        """
+        Path from the root of the local files, the project root by default
+        """
+
+        return os.path.join(self.root_dir, *parts)
@@ -0,0 +1,155 @@
+"""
+Small DAG executor: tasks run as soon as their dependencies are done, on a process pool or in the main process.
+Failed tasks are retried on their own, and completed tasks are checkpointed so a re-run resumes where it stopped.
+"""
+
+import logging
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import joblib
+
+logger = logging.getLogger(__name__)
+
+# fn is called with args followed by the results of deps, in order.
+# Tasks in_process run in the main process (they can use unpicklable state such as the connections),
+# the others on the process pool: fn and args must be picklable.
+Task = namedtuple('Task', ['name', 'fn', 'args', 'deps', 'in_process', 'checkpoint'], defaults = [(), (), False, True])
+
+class DagError(RuntimeError):
+    def __init__(self, failed, skipped):
+        self.failed = failed
+        self.skipped = skipped
+        super().__init__(f"Tasks failed: {', '.join(failed)}" + (f", not run: {', '.join(skipped)}" if skipped else ''))
+
+class Checkpoints:
+    """
+    Results of the completed tasks of a run, one joblib file each
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+
+    def task_path(self, name):
+        return os.path.join(self.path, name.replace(':', '-') + '.joblib')
+
+    def __contains__(self, name):
+        return os.path.exists(self.task_path(name))
+
+    def load(self, name):
+        return joblib.load(self.task_path(name))
+
+    def save(self, name, result):
+        # written aside and renamed, so a crash never leaves a truncated checkpoint
+        path = self.task_path(name)
+        joblib.dump(result, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def clear(self):
+        for file_name in os.listdir(self.path):
+            os.remove(os.path.join(self.path, file_name))
+        os.rmdir(self.path)
+
+def run_dag(tasks, checkpoint_path = None, max_workers = None, retries = 2, initializer = None, initargs = ()):
+    """
+    Run the tasks in dependency order, with at most max_workers pool tasks at a time.
+    Each task is tried up to 1 + retries times; the tasks depending on a failed task are not run, the others go on.
+    Return the results by task name and the wall time of each task, raise DagError if a task failed.
+    The checkpoints are removed once every task succeeded.
+    """
+
+    tasks = {task.name: task for task in tasks}
+    checkpoints = Checkpoints(checkpoint_path) if checkpoint_path is not None else None
+
+    results, timings = {}, {}
+    pending = dict(tasks)
+    attempts = {name: 0 for name in tasks}
+    failed = []
+
+    def ready(task):
+        return all(dep in results for dep in task.deps)
+
+    with ProcessPoolExecutor(max_workers = max_workers, initializer = initializer, initargs = initargs) as executor:
+        running = {}
+        while pending or running:
+            # resume from the checkpoints, run the main process tasks and submit the pool tasks that are ready
+            progress = False
+            for name, task in list(pending.items()):
+                if not ready(task):
+                    continue
+                del pending[name]
+                progress = True
+
+                if checkpoints is not None and task.checkpoint and name in checkpoints:
+                    results[name] = checkpoints.load(name)
+                    logger.info("Task %s resumed from checkpoint", name)
+                    continue
+
+                args = tuple(task.args) + tuple(results[dep] for dep in task.deps)
+                if task.in_process:
+                    finish(task, run_in_process(task, args, retries), results, timings, failed, checkpoints)
+                else:
+                    attempts[name] += 1
+                    running[executor.submit(timed, task.fn, args)] = (task, args)
+
+            if not running:
+                # nothing can run anymore: the remaining tasks depend on a failed one
+                if not progress:
+                    break
+                continue
+
+            done, _ = wait(running, return_when = FIRST_COMPLETED)
+            for future in done:
+                task, args = running.pop(future)
+                try:
+                    outcome = future.result()
+                except Exception as error:
+                    if attempts[task.name] <= retries:
+                        logger.warning("Task %s failed (%s), retry %d of %d", task.name, error, attempts[task.name], retries)
+                        attempts[task.name] += 1
+                        running[executor.submit(timed, task.fn, args)] = (task, args)
+                        continue
+                    logger.error("Task %s failed after %d attempts: %s", task.name, attempts[task.name], error)
+                    outcome = None
+                finish(task, outcome, results, timings, failed, checkpoints)
+
+    if failed:
+        raise DagError(failed, sorted(pending))
+
+    if checkpoints is not None:
+        checkpoints.clear()
+    return results, timings
+
+def timed(fn, args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def run_in_process(task, args, retries):
+    for attempt in range(1 + retries):
+        try:
+            return timed(task.fn, args)
+        except Exception as error:
+            if attempt == retries:
+                logger.error("Task %s failed after %d attempts: %s", task.name, attempt + 1, error)
+                return None
+            logger.warning("Task %s failed (%s), retry %d of %d", task.name, error, attempt + 1, retries)
+
+def finish(task, outcome, results, timings, failed, checkpoints):
+    """
+    Record the result of a task, None outcome for a task that failed every attempt
+    """
+
+    if outcome is None:
+        failed.append(task.name)
+        return
+
+    result, seconds = outcome
+    results[task.name] = result
+    timings[task.name] = seconds
+    if checkpoints is not None and task.checkpoint:
+        checkpoints.save(task.name, result)
+    logger.info("Task %s done in %.2f s", task.name, seconds)
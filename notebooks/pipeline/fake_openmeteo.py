@@ -0,0 +1,191 @@
+"""
+Fake Open-Meteo for the offline runs, the tests and the benchmarks: synthetic daily values encoded as FlatBuffers
+WeatherApiResponse messages with the same layout as the API, answered in process or from a local HTTP server.
+"""
+
+import threading
+import time
+import zlib
+from datetime import date
+
+import flatbuffers
+import numpy as np
+import pandas as pd
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+
+# Midnight of 2023-12-10 in Europe/Berlin, as returned by Open-Meteo
+START_TIME = 1702162800
+DAY_SECONDS = 86400
+
+def encode_daily_response(values, start_time = START_TIME, utc_offset = 3600):
+    """
+    Encode a list of daily value arrays into a length-prefixed WeatherApiResponse message
+    """
+
+    n_days = len(values[0])
+    builder = flatbuffers.Builder(1024 + 4 * n_days * len(values))
+
+    # VariableWithValues tables: variable (slot 0) and values (slot 3)
+    variables = []
+    for i, variable_values in enumerate(values):
+        vector = builder.CreateNumpyVector(np.asarray(variable_values, dtype = np.float32))
+        builder.StartObject(4)
+        builder.PrependUint8Slot(0, i + 1, 0)
+        builder.PrependUOffsetTRelativeSlot(3, vector, 0)
+        variables.append(builder.EndObject())
+
+    builder.StartVector(4, len(variables), 4)
+    for variable in reversed(variables):
+        builder.PrependUOffsetTRelative(variable)
+    variables_vector = builder.EndVector()
+
+    # VariablesWithTime table: time, time_end, interval and variables
+    builder.StartObject(4)
+    builder.PrependInt64Slot(0, start_time, 0)
+    builder.PrependInt64Slot(1, start_time + n_days * DAY_SECONDS, 0)
+    builder.PrependInt32Slot(2, DAY_SECONDS, 0)
+    builder.PrependUOffsetTRelativeSlot(3, variables_vector, 0)
+    daily = builder.EndObject()
+
+    # WeatherApiResponse table: utc_offset_seconds (slot 6) and daily (slot 10)
+    builder.StartObject(11)
+    builder.PrependInt32Slot(6, utc_offset, 0)
+    builder.PrependUOffsetTRelativeSlot(10, daily, 0)
+    builder.Finish(builder.EndObject())
+
+    message = bytes(builder.Output())
+    return len(message).to_bytes(4, byteorder = 'little') + message
+
+def decode_messages(data):
+    """
+    Split a FlatBuffers payload into WeatherApiResponse objects, as the Open-Meteo client does
+    """
+
+    responses = []
+    pos = 0
+    while pos < len(data):
+        length = int.from_bytes(data[pos:pos + 4], byteorder = 'little')
+        responses.append(WeatherApiResponse.GetRootAs(data, pos + 4))
+        pos += length + 4
+    return responses
+
+def synthetic_daily_values(n_days, with_weather_code = True, seed = 0):
+    """
+    Plausible daily values: WMO code, minimum temperature, precipitation sum and maximum wind gusts
+    """
+
+    rng = np.random.default_rng(seed)
+    values = [
+        rng.normal(5, 8, n_days),
+        rng.gamma(0.6, 3, n_days),
+        rng.gamma(4, 9, n_days),
+    ]
+    if with_weather_code:
+        wmo_codes = np.array([0, 1, 2, 3, 45, 48, 51, 53, 55, 61, 63, 65, 71, 73, 75, 80, 95])
+        values.insert(0, rng.choice(wmo_codes, n_days))
+    return values
+
+def fake_openmeteo_payload(params, today = None):
+    """
+    FlatBuffers payload answering an Open-Meteo request with synthetic daily values, one message per location.
+    Values are deterministic for a given location and time range.
+    """
+
+    latitudes = params['latitude'] if isinstance(params['latitude'], list) else [params['latitude']]
+    longitudes = params['longitude'] if isinstance(params['longitude'], list) else [params['longitude']]
+
+    # time range of the request, from the dates or from the days around today
+    if 'start_date' in params:
+        start = pd.Timestamp(params['start_date'])
+        end = pd.Timestamp(params['end_date'])
+    else:
+        today = pd.Timestamp(today or date.today())
+        start = today - pd.Timedelta(days = int(params.get('past_days', 0)))
+        end = today + pd.Timedelta(days = int(params.get('forecast_days', 7)) - 1)
+    n_days = (end - start).days + 1
+
+    # days start at the local midnight, as in the API
+    local_start = start.tz_localize(params.get('timezone', 'GMT'))
+    start_time = int(local_start.timestamp())
+    utc_offset = int(local_start.utcoffset().total_seconds())
+    with_weather_code = params['daily'][0] == 'weather_code'
+
+    data = b''
+    for latitude, longitude in zip(latitudes, longitudes):
+        seed = zlib.crc32(f"{float(latitude)},{float(longitude)},{start.date()},{n_days}".encode())
+        values = synthetic_daily_values(n_days, with_weather_code, seed = seed)
+        data += encode_daily_response(values, start_time = start_time, utc_offset = utc_offset)
+    return data
+
+class FakeOpenMeteo:
+    """
+    Open-Meteo client answering with synthetic daily values, without any HTTP request
+    """
+
+    def __init__(self, today = None):
+        self.today = today
+        self.calls = []
+
+    def weather_api(self, url, params):
+        self.calls.append(dict(params))
+        return decode_messages(fake_openmeteo_payload(params, self.today))
+
+class FakeOpenMeteoServer:
+    """
+    Local HTTP server answering Open-Meteo requests with synthetic daily values, after latency seconds.
+    The first failures requests are answered with failure_status, to check the retries.
+    Counts the requests received, to check caching and coalescing.
+
+        with FakeOpenMeteoServer(latency = 0.05) as server:
+            client.weather_api(server.url, params)
+    """
+
+    def __init__(self, today = None, latency = 0, failures = 0, failure_status = 503, host = '127.0.0.1', port = 0):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import parse_qs, urlparse
+
+        fake = self
+        self.today = today
+        self.latency = latency
+        self.failures = failures
+        self.failure_status = failure_status
+        self.n_requests = 0
+        self.lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with fake.lock:
+                    fake.n_requests += 1
+                    failing = fake.n_requests <= fake.failures
+                # lists come comma-separated or as repeated parameters, depending on the client
+                query = parse_qs(urlparse(self.path).query)
+                params = {name: ','.join(values).split(',') if name in ('latitude', 'longitude', 'daily') else values[0]
+                          for name, values in query.items()}
+                time.sleep(fake.latency)
+
+                if failing:
+                    self.send_response(fake.failure_status)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                body = fake_openmeteo_payload(params, fake.today)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self.httpd.server_port}/v1/forecast"
+
+    def __enter__(self):
+        threading.Thread(target = self.httpd.serve_forever, daemon = True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,203 @@
+"""
+Local stand-ins for Hopsworks, to run the pipeline offline.
+Feature groups are Parquet files, the model registry is the file-based LocalModelRegistry and datasets are plain files.
+Open-Meteo is replaced by the fakes of pipeline/fake_openmeteo.py.
+"""
+
+import json
+import os
+import shutil
+from datetime import date, datetime
+
+import pandas as pd
+
+from local_registry import LocalModelRegistry
+
+class LocalFilter:
+    """
+    Row filter of a local query, combined with & as in (fg.date > '2024-01-01') & (fg.date < '2024-02-01')
+    """
+
+    def __init__(self, row_filter):
+        self.row_filter = row_filter
+
+    def __call__(self, df):
+        return self.row_filter(df)
+
+    def __and__(self, other):
+        return LocalFilter(lambda df: self(df) & other(df))
+
+class LocalFeature:
+    """
+    Feature of a local feature group, compared to a value into a row filter as in fg.date > '2024-01-01'
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def condition(self, compare, value):
+        def row_filter(df):
+            column = df[self.name]
+            if isinstance(value, (str, date, datetime)):
+                return compare(pd.to_datetime(column), pd.Timestamp(value))
+            return compare(column, value)
+        return LocalFilter(row_filter)
+
+    def __gt__(self, value):
+        return self.condition(lambda column, value: column > value, value)
+
+    def __ge__(self, value):
+        return self.condition(lambda column, value: column >= value, value)
+
+    def __lt__(self, value):
+        return self.condition(lambda column, value: column < value, value)
+
+    def __le__(self, value):
+        return self.condition(lambda column, value: column <= value, value)
+
+class LocalQuery:
+    def __init__(self, feature_group, row_filter = None):
+        self.feature_group = feature_group
+        self.row_filter = row_filter
+
+    def read(self):
+        df = self.feature_group.read()
+        if self.row_filter is not None:
+            df = df[self.row_filter(df)].reset_index(drop = True)
+        return df
+
+class LocalFeatureGroup:
+    """
+    Feature group stored as one Parquet file, with the subset of the Hopsworks API used by the pipelines.
+    Inserted rows replace the rows with the same primary key. An insert missing a primary key column, or with several
+    rows of the same key, is rejected: Hopsworks would keep one of them silently.
+    """
+
+    def __init__(self, path, name, version, primary_key = None):
+        self.name = name
+        self.version = version
+        self.data_path = os.path.join(path, f"{name}_{version}.parquet")
+        self.metadata_path = os.path.join(path, f"{name}_{version}.json")
+
+        # primary key given at creation, retrieved from the metadata afterwards
+        if primary_key is None and os.path.exists(self.metadata_path):
+            with open(self.metadata_path) as file:
+                primary_key = json.load(file)['primary_key']
+        self.primary_key = list(primary_key or [])
+        if not os.path.exists(self.metadata_path):
+            with open(self.metadata_path, 'w') as file:
+                json.dump({'primary_key': self.primary_key}, file)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return LocalFeature(name)
+
+    def read(self):
+        if not os.path.exists(self.data_path):
+            return pd.DataFrame()
+        return pd.read_parquet(self.data_path)
+
+    def insert(self, df, write_options = None):
+        missing = [column for column in self.primary_key if column not in df.columns]
+        if missing:
+            raise KeyError(f"{self.name}: primary key columns {missing} missing from the inserted rows")
+        if self.primary_key and df.duplicated(subset = self.primary_key).any():
+            raise ValueError(f"{self.name}: {int(df.duplicated(subset = self.primary_key).sum())} inserted rows "
+                             f"duplicate the primary key {self.primary_key}")
+
+        df = pd.concat([self.read(), df], ignore_index = True)
+        df = df.drop_duplicates(subset = self.primary_key or None, keep = 'last', ignore_index = True)
+
+        tmp_path = self.data_path + '.tmp'
+        df.to_parquet(tmp_path, index = False)
+        os.replace(tmp_path, self.data_path)
+
+    def select_all(self):
+        return LocalQuery(self)
+
+    def filter(self, row_filter):
+        return LocalQuery(self, row_filter)
+
+class LocalFeatureView:
+    def __init__(self, query, labels):
+        self.query = query
+        self.labels = list(labels)
+
+    def train_test_split(self, test_size = None, train_start = None, train_end = None, test_start = None, test_end = None):
+        """
+        Random split, or time-based split on the date event time when test_start is given (starts included, ends
+        excluded), returned in the Hopsworks order: X_train, y_train, X_test, y_test
+        """
+
+        df = self.query.read()
+        if test_start is None:
+            from sklearn.model_selection import train_test_split
+
+            X_train, X_test, y_train, y_test = train_test_split(df.drop(columns = self.labels), df[self.labels], test_size = test_size)
+            return X_train, y_train, X_test, y_test
+
+        dates = pd.to_datetime(df['date'])
+        def between(start, end):
+            start = pd.Timestamp(start) if start is not None else dates.min()
+            end = pd.Timestamp(end) if end is not None else dates.max() + pd.Timedelta(days = 1)
+            return df[(dates >= start) & (dates < end)]
+
+        df_train, df_test = between(train_start, train_end), between(test_start, test_end)
+        return df_train.drop(columns = self.labels), df_train[self.labels], df_test.drop(columns = self.labels), df_test[self.labels]
+
+class LocalFeatureStore:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+
+    def get_or_create_feature_group(self, name, version, primary_key = None, **kwargs):
+        return LocalFeatureGroup(self.path, name, version, primary_key)
+
+    def get_or_create_feature_view(self, name, version, query, labels = None, **kwargs):
+        return LocalFeatureView(query, labels or [])
+
+class LocalDatasetApi:
+    """
+    Files uploaded to a local folder, with the subset of the Hopsworks dataset API used by the pipelines and the web app
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def upload(self, local_path, upload_path, overwrite = False):
+        target_dir = os.path.join(self.path, upload_path)
+        os.makedirs(target_dir, exist_ok = True)
+        target_path = os.path.join(target_dir, os.path.basename(local_path))
+        if os.path.exists(target_path) and not overwrite:
+            raise FileExistsError(target_path)
+        shutil.copyfile(local_path, target_path)
+        return target_path
+
+    def download(self, path, local_path = None, overwrite = False):
+        target_path = os.path.join(local_path or '.', os.path.basename(path))
+        if os.path.exists(target_path) and not overwrite:
+            raise FileExistsError(target_path)
+        shutil.copyfile(os.path.join(self.path, path), target_path)
+        return target_path
+
+    def get(self, path):
+        return {'attributes': {'modificationTime': int(os.path.getmtime(os.path.join(self.path, path)) * 1000)}}
+
+class LocalProject:
+    """
+    Local Hopsworks project: feature store and datasets under path, models in the file-based registry
+    """
+
+    def __init__(self, path, registry_path):
+        self.path = path
+        self.registry_path = registry_path
+
+    def get_feature_store(self):
+        return LocalFeatureStore(os.path.join(self.path, 'feature_store'))
+
+    def get_model_registry(self):
+        return LocalModelRegistry(self.registry_path)
+
+    def get_dataset_api(self):
+        return LocalDatasetApi(os.path.join(self.path, 'datasets'))
@@ -0,0 +1,163 @@
+"""
+Pipeline as a DAG over location shards: ingest and inference of each shard run in parallel on a process pool,
+joined at training, which needs all of the data.
+
+    ingest:0000 ... ingest:N  ->  ingest  ->  training  ->  inference:0000 ... inference:N  ->  inference
+"""
+
+import logging
+import zlib
+
+import pandas as pd
+
+import metrics as run_metrics
+from config import (FG_HISTORY_PK, HISTORY_STORE_PATH, MODEL_FEATURES, MODEL_NAME, PIPELINE_CHECKPOINT_PATH,
+                    PIPELINE_MAX_WORKERS, PIPELINE_SHARD_SIZE, PIPELINE_TASK_RETRIES, PREDICTION_CACHE_SIZE,
+                    VALIDATION_RANGES)
+from artifacts import load_model
+from forecast_cache import PredictionCache, model_version
+from pipeline.dag import Task, run_dag
+from pipeline.stages import (best_model, compact_quarantine, fetch_forecasts, fetch_weather_days, predict_forecasts, prepare_weather_days,
+                             publish_forecasts, publish_weather_days, training_stage)
+from weather_store import HistoryStore
+
+logger = logging.getLogger(__name__)
+
+# Open-Meteo session of a worker process, opened once by the pool initializer
+worker_openmeteo = None
+
+def init_worker(openmeteo_factory):
+    global worker_openmeteo
+    worker_openmeteo = openmeteo_factory()
+
+def with_metrics(metrics_enabled, fn, *args):
+    """
+    Run fn in a worker process with an empty metrics registry, return its result and the snapshot of the metrics it
+    recorded, merged by the parent (merge_metrics): the registry of a worker is not the one exported
+    """
+
+    run_metrics.reset()
+    if metrics_enabled:
+        run_metrics.enable()
+    else:
+        run_metrics.disable()
+    return fn(*args), run_metrics.snapshot()
+
+def merge_metrics(shard_results):
+    """
+    Results of the shard tasks run with_metrics, their metrics merged into the registry of this process
+    """
+
+    for _, series_snapshot in shard_results:
+        run_metrics.merge(series_snapshot)
+    return [result for result, _ in shard_results]
+
+def ingest_shard(url, store_path, quarantine, locations, end):
+    """
+    Fetch and prepare the missing days of a shard of locations. The store is only read here (rolling feature windows),
+    the days are written once by the join. Days failing validation are quarantined by the shard, and the quarantined
+    days waiting for their retry are not fetched. The quarantine is compacted by the parent, before the shards run.
+    """
+
+    store = HistoryStore(store_path, key = FG_HISTORY_PK)
+    return prepare_weather_days(fetch_weather_days(worker_openmeteo, url, store, locations, end, quarantine), store,
+                                VALIDATION_RANGES, quarantine)
+
+def infer_shard(url, store_path, cache_path, locations, today, model_dir):
+    """
+    Fetch the forecast features of a shard of locations and predict their weather codes.
+    The prediction cache is only read here, the new predictions are cached once by the join.
+    Return the model version with the forecast.
+    """
+
+    store = HistoryStore(store_path, key = FG_HISTORY_PK)
+    model = load_model(model_dir, MODEL_NAME)
+    cache = PredictionCache.load(cache_path, PREDICTION_CACHE_SIZE)
+    df_forecasts = predict_forecasts(model, fetch_forecasts(worker_openmeteo, url, store, locations, today), cache)
+    return model_version(model), df_forecasts
+
+def shard_locations(locations, shard_size):
+    return [locations.iloc[i:i + shard_size] for i in range(0, len(locations), shard_size)]
+
+def build_tasks(ctx, stages, shard_size):
+    """
+    Tasks of the given stages, the stages left out are replaced by what they would have produced:
+    nothing new for the feature stage, the best model of the registry for the training stage
+    """
+
+    shards = shard_locations(ctx.locations, shard_size)
+    tasks = []
+
+    def join_ingest(*shard_results):
+        dfs = merge_metrics(shard_results)
+        df_weather_new = pd.concat(dfs, ignore_index = True) if dfs else pd.DataFrame()
+        publish_weather_days(ctx, df_weather_new)
+        ctx.frames['weather_new'] = df_weather_new
+        return df_weather_new
+
+    def train(*deps):
+        training_stage(ctx)
+        return ctx.model_dir
+
+    def best_model_dir():
+        return best_model(ctx)[1]
+
+    def join_inference(*shard_results):
+        shard_results = merge_metrics(shard_results)
+        df_forecasts = pd.concat([df for _, df in shard_results], ignore_index = True)
+        for version, df in shard_results:
+            ctx.prediction_cache.add(version, df[MODEL_FEATURES], df['weather_code'])
+        ctx.prediction_cache.save()
+        df_forecasts = publish_forecasts(ctx, df_forecasts, version = shard_results[0][0] if shard_results else None)
+        ctx.frames['forecasts'] = df_forecasts
+        return df_forecasts
+
+    training_deps = ()
+    if 'feature' in stages:
+        ingest_names = [f"ingest:{i:04d}" for i in range(len(shards))]
+        for name, shard in zip(ingest_names, shards):
+            tasks.append(Task(name, with_metrics, (run_metrics.is_enabled(), ingest_shard, ctx.openmeteo_url, ctx.path(HISTORY_STORE_PATH),
+                                                   ctx.quarantine, shard, ctx.yesterday)))
+        tasks.append(Task('ingest', join_ingest, deps = ingest_names, in_process = True, checkpoint = False))
+        training_deps = ('ingest',)
+
+    if 'training' in stages:
+        tasks.append(Task('training', train, deps = training_deps, in_process = True))
+        model_task = 'training'
+    elif 'inference' in stages:
+        tasks.append(Task('model', best_model_dir, in_process = True, checkpoint = False))
+        model_task = 'model'
+
+    if 'inference' in stages:
+        inference_names = [f"inference:{i:04d}" for i in range(len(shards))]
+        for name, shard in zip(inference_names, shards):
+            tasks.append(Task(name, with_metrics, (run_metrics.is_enabled(), infer_shard, ctx.openmeteo_url, ctx.path(HISTORY_STORE_PATH),
+                                                   ctx.prediction_cache.path, shard, ctx.today),
+                              deps = (model_task,)))
+        tasks.append(Task('inference', join_inference, deps = inference_names, in_process = True, checkpoint = False))
+
+    return tasks
+
+def checkpoint_path(ctx, stages, shard_size):
+    """
+    Checkpoints of a run, for the day and the sharding of the locations: a re-run on the same day resumes from them
+    """
+
+    fingerprint = zlib.crc32(','.join(list(stages) + list(ctx.locations['location_id']) + [str(shard_size)]).encode())
+    return ctx.path(PIPELINE_CHECKPOINT_PATH, f"{ctx.today}-{fingerprint:08x}")
+
+def run_sharded_pipeline(ctx, stages = ('feature', 'training', 'inference'), shard_size = PIPELINE_SHARD_SIZE,
+                         max_workers = PIPELINE_MAX_WORKERS, retries = PIPELINE_TASK_RETRIES):
+    """
+    Run the stages as a DAG of location shards on a process pool, recording the wall time of each task
+    """
+
+    if 'feature' in stages:
+        compact_quarantine(ctx)
+    tasks = build_tasks(ctx, stages, shard_size)
+    results, timings = run_dag(tasks, checkpoint_path(ctx, stages, shard_size),
+                               max_workers = max_workers, retries = retries,
+                               initializer = init_worker, initargs = (ctx.openmeteo_factory,))
+
+    ctx.timings.extend(timings.items())
+    return results
@@ -0,0 +1,485 @@
+"""
+Feature, training and inference stages, ported from the notebooks 2, 3 and 4.
+Each stage reads what it needs from the context and leaves its output there for the next one.
+"""
+
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import metrics as run_metrics
+from artifacts import FORECAST_FILE, load_model, save_model
+from config import *
+from forecast_cache import model_version
+from local_registry import LocalModelRegistry
+from pipeline.context import NOTEBOOKS_DIR
+from weather_training import (continue_training, load_training_state, plan_training, rank_models, save_training_state,
+                              update_training_state)
+from weather_utils import (FORECAST_SCHEMA, WEATHER_SCHEMA, add_weather_code_labels, apply_schema, daily_variables,
+                           fetch_locations, process_forecast_request)
+from weather_backfill import stream_backfill
+from weather_codes import to_weather_codes
+from weather_store import add_forecast_rolling_features, fetch_missing_history, prepare_weather_days
+from webapp.forecast_file import write_forecast
+
+logger = logging.getLogger(__name__)
+
+# Model files of the last training, published to the registry from here
+MODEL_DIR = os.path.join(NOTEBOOKS_DIR, MODEL_PATH)
+
+def fetch_weather_days(openmeteo, url, store, locations, end, quarantine = None):
+    """
+    Fetch the days of the locations missing from the store in the last HISTORY_LOOKBACK_DAYS days up to end,
+    so missed days are caught up. Quarantined days waiting for their retry are left out.
+    """
+
+    params = {
+        "daily": daily_variables(WEATHER_SCHEMA),
+        "timezone": TIMEZONE,
+    }
+    start = pd.Timestamp(end) - pd.Timedelta(days = HISTORY_LOOKBACK_DAYS - 1)
+    held = quarantine.held_ranges() if quarantine is not None else None
+    return fetch_missing_history(openmeteo, url, store, locations, params, start = start, end = end, held = held,
+                                 chunk_size = FETCH_CHUNK_SIZE, max_workers = FETCH_MAX_WORKERS)
+
+def compact_quarantine(ctx):
+    """
+    Forget the quarantined days that have since landed in the history store or that were not quarantined again
+    within QUARANTINE_MAX_RETRY_DAYS, before the fetches read the held days
+    """
+
+    forgotten = ctx.quarantine.compact(ctx.history_store, as_of = ctx.today)
+    if forgotten:
+        logger.info("Quarantine: %d days forgotten", forgotten)
+
+def publish_weather_days(ctx, df_weather):
+    """
+    Insert the new days in the history Feature Group and the local history store
+    """
+
+    if df_weather.empty:
+        logger.info("No new days to ingest")
+        return
+
+    historical_weather_fg = ctx.fs.get_or_create_feature_group(
+        name = FG_HISTORY_NAME,
+        description = FG_HISTORY_DESC,
+        version = FG_HISTORY_V,
+        primary_key = FG_HISTORY_PK,
+        event_time = ["date"],
+        statistics_config = {"enabled": True, "histograms": True, "correlations": True}
+    )
+    with run_metrics.timer('feature_group_insert_seconds', feature_group = FG_HISTORY_NAME):
+        historical_weather_fg.insert(df_weather, write_options = {"wait_for_job": False})
+    run_metrics.incr('feature_group_rows_total', len(df_weather), feature_group = FG_HISTORY_NAME)
+
+    ctx.history_store.append(df_weather)
+    logger.info("Ingested %d days", len(df_weather))
+
+def feature_stage(ctx):
+    """
+    Fetch the days missing from the history, derive the weather codes,
+    and insert them in the history Feature Group and the local history store
+    """
+
+    compact_quarantine(ctx)
+    df_weather_new = fetch_weather_days(ctx.openmeteo, ctx.openmeteo_url, ctx.history_store, ctx.locations, ctx.yesterday,
+                                        ctx.quarantine)
+    df_weather_new = prepare_weather_days(df_weather_new, ctx.history_store, VALIDATION_RANGES, ctx.quarantine)
+    run_metrics.record_frame('weather_new_frame', df_weather_new)
+    publish_weather_days(ctx, df_weather_new)
+
+    ctx.frames['weather_new'] = df_weather_new
+    return df_weather_new
+
+def backfill_stage(ctx, start, end = None, url = BASELINE_URL_OPEN_METEO_ARCHIVE):
+    """
+    Streaming backfill of the history from start until end (yesterday by default), chunk by chunk into the history
+    Feature Group and the local history store. Resumes where an interrupted backfill stopped.
+    """
+
+    historical_weather_fg = ctx.fs.get_or_create_feature_group(
+        name = FG_HISTORY_NAME,
+        description = FG_HISTORY_DESC,
+        version = FG_HISTORY_V,
+        primary_key = FG_HISTORY_PK,
+        event_time = ["date"],
+        statistics_config = {"enabled": True, "histograms": True, "correlations": True}
+    )
+
+    def insert_chunk(df):
+        with run_metrics.timer('feature_group_insert_seconds', feature_group = FG_HISTORY_NAME):
+            historical_weather_fg.insert(df, write_options = {"wait_for_job": False})
+        run_metrics.incr('feature_group_rows_total', len(df), feature_group = FG_HISTORY_NAME)
+
+    params = {
+        "daily": daily_variables(WEATHER_SCHEMA),
+        "timezone": TIMEZONE,
+    }
+    compact_quarantine(ctx)
+    progress = stream_backfill(ctx.openmeteo, url, ctx.history_store, ctx.locations, params,
+                               start = start, end = end or ctx.yesterday, validation_ranges = VALIDATION_RANGES,
+                               sinks = [insert_chunk],
+                               chunk_days = BACKFILL_CHUNK_DAYS, location_chunk_size = BACKFILL_LOCATION_CHUNK_SIZE,
+                               quarantine = ctx.quarantine, chunk_size = FETCH_CHUNK_SIZE, max_workers = FETCH_MAX_WORKERS)
+    logger.info("Backfill done: %s", progress.summary())
+    for name, value in progress.summary().items():
+        run_metrics.set_gauge('backfill_' + name, value)
+    return progress
+
+def backtest_stage(ctx, start, end = None):
+    """
+    Backtest the model of the run (the best model of the registry by default) on the forecasts archived in the forecast
+    Feature Group for the prediction dates from start until end (the day before yesterday by default). Only the
+    forecast dates after the last day the model was trained on are scored, against the local history store.
+    Return the scored rows and the metrics per horizon.
+    """
+
+    from weather_backtest import backtest
+
+    if ctx.model is not None:
+        model, model_dir = ctx.model, ctx.model_dir
+    else:
+        model, model_dir = best_model(ctx)
+    training_state = load_training_state(model_dir)
+    if training_state is None:
+        raise ValueError(f"No training state next to the model in {model_dir}: the days it was trained on are unknown")
+    cutoff = pd.Timestamp(training_state['last_trained_date'])
+
+    end = pd.Timestamp(end or ctx.yesterday - pd.Timedelta(days = 1))
+    prediction_dates = pd.date_range(start, end)
+
+    # forecasts of the prediction dates, one row per location, forecast date and prediction date
+    forecast_weather_fg = ctx.fs.get_or_create_feature_group(name = FG_FORECAST_NAME, version = FG_FORECAST_V)
+    df_forecasts = forecast_weather_fg.filter(forecast_weather_fg.prediction_date >= str(prediction_dates[0].date())).read()
+
+    # observed days after the cutoff are all that is read from the history
+    df_history = ctx.history_store.read(start = max(prediction_dates[0], cutoff + pd.Timedelta(days = 1)),
+                                        end = end + pd.Timedelta(days = BACKTEST_HORIZON_DAYS - 1))
+
+    with run_metrics.timer('backtest_seconds'):
+        df_backtest, df_metrics = backtest(model.predict, df_history, df_forecasts, prediction_dates, after = cutoff,
+                                           horizon_days = BACKTEST_HORIZON_DAYS, batch_size = BACKTEST_BATCH_SIZE)
+    logger.info("Backtest of %d prediction dates, %d forecast days after %s scored:\n%s",
+                len(prediction_dates), len(df_backtest), cutoff.date(), df_metrics.round(3).to_string())
+
+    ctx.frames['backtest'] = df_backtest
+    return df_backtest, df_metrics
+
+def holdout_dates(ctx):
+    """
+    First and last day of the test set of the run: the TEST_HOLDOUT_DAYS days up to yesterday
+    """
+
+    end = pd.Timestamp(ctx.yesterday)
+    return end - pd.Timedelta(days = TEST_HOLDOUT_DAYS - 1), end
+
+def ranked_registry_models(ctx, X_holdout, y_holdout):
+    """
+    The latest RANKED_MODEL_VERSIONS versions of the registry scored on the given holdout, the test days of the run,
+    best first. Their published metrics were measured on the holdouts of the runs that trained them, so they are not
+    compared. The versions already scored on these days by an earlier run are answered from the evaluation cache.
+    Return (metrics, model directory, model) tuples.
+    """
+
+    versions = sorted(ctx.mr.get_models(MODEL_NAME), key = lambda registry_model: registry_model.version)
+    candidates = []
+    with run_metrics.timer('model_load_seconds'):
+        for registry_model in versions[-RANKED_MODEL_VERSIONS:]:
+            model_dir = registry_model.download()
+            candidates.append((model_dir, load_model(model_dir, MODEL_NAME)))
+    ranked = rank_models(candidates, X_holdout, y_holdout, MODEL_METRIC, OPTIMIZE_DIRECTION,
+                         holdout = holdout_dates(ctx), cache = ctx.evaluation_cache)
+    logger.info("Evaluation cache: %(hits)d hits, %(misses)d misses", ctx.evaluation_cache.stats)
+    return ranked
+
+def best_model(ctx):
+    """
+    Best model of the registry on the test days of the run, read from the history store. Without any of these days
+    in the store, the best model by its published metric. Return the model and its directory.
+    """
+
+    start, end = holdout_dates(ctx)
+    df_holdout = ctx.history_store.read(start = start, end = end)
+    if df_holdout.empty:
+        model_dir = ctx.mr.get_best_model(MODEL_NAME, MODEL_METRIC, OPTIMIZE_DIRECTION).download()
+        return load_model(model_dir, MODEL_NAME), model_dir
+
+    _, model_dir, model = ranked_registry_models(ctx, df_holdout[MODEL_FEATURES], df_holdout[MODEL_LABEL])[0]
+    return model, model_dir
+
+def training_stage(ctx):
+    """
+    Tune and train the model, or update the current best model incrementally, evaluate it and publish it.
+    The trained model is kept in the context for the inference stage.
+    """
+
+    # training libraries loaded by this stage only, the feature and inference stages start without them
+    from xgboost import XGBRegressor
+    from weather_evaluation import evaluate_model, report_text
+    from weather_tuning import tune_hyperparameters
+
+    model_dir = MODEL_DIR
+    os.makedirs(model_dir, exist_ok = True)
+
+    historical_weather_fg = ctx.fs.get_or_create_feature_group(name = FG_HISTORY_NAME, version = FG_HISTORY_V)
+
+    # Training and test set: the most recent days are the test set, the same for every model trained today,
+    # and no model is trained on them
+    test_start, _ = holdout_dates(ctx)
+    if USE_LOCAL_HISTORY:
+        df_history = ctx.history_store.read()
+        test = pd.to_datetime(df_history['date']) >= test_start
+        X_train, y_train = df_history.loc[~test, MODEL_FEATURES], df_history.loc[~test, MODEL_LABEL]
+        X_test, y_test = df_history.loc[test, MODEL_FEATURES], df_history.loc[test, MODEL_LABEL]
+        train_dates = pd.to_datetime(df_history.loc[~test, 'date'])
+    else:
+        feature_view = ctx.fs.get_or_create_feature_view(
+            name = FEATURE_VIEW_NAME,
+            version = FEATURE_VIEW_V,
+            query = historical_weather_fg.select_all(),
+            labels = [MODEL_LABEL],
+        )
+        X_train, y_train, X_test, y_test = feature_view.train_test_split(train_end = str(test_start.date()),
+                                                                         test_start = str(test_start.date()),
+                                                                         test_end = str(ctx.today))
+        # the Feature Store returns its own dtypes, the compact schema is enforced again
+        train_dates = pd.to_datetime(X_train['date'])
+        X_train, X_test = apply_schema(X_train[MODEL_FEATURES]), apply_schema(X_test[MODEL_FEATURES])
+        y_train, y_test = apply_schema(y_train), apply_schema(y_test)
+    logger.info("Training set: %d entries, test set: %d entries", len(X_train), len(X_test))
+
+    # Current models, ranked on the test days of this run
+    ranked = ranked_registry_models(ctx, X_test, y_test)
+    for registry_metrics, registry_model_dir, _ in ranked:
+        logger.info("Registry model %s: test %s %.2f", registry_model_dir, MODEL_METRIC, registry_metrics[MODEL_METRIC])
+
+    # Training mode
+    mode, reason = 'full', 'incremental training disabled'
+    training_state, current_model = None, None
+    new = np.zeros(len(X_train), dtype = bool)
+    if INCREMENTAL_TRAINING:
+        if ranked:
+            _, current_model_dir, current_model = ranked[0]
+            training_state = load_training_state(current_model_dir)
+
+        # training days after the last one the current model was trained on
+        if training_state is not None:
+            new = (train_dates > pd.Timestamp(training_state['last_trained_date'])).to_numpy()
+
+        mode, reason = plan_training(training_state, current_model, X_train[new], y_train[new],
+                                     today = ctx.today,
+                                     retune_every_days = RETUNE_EVERY_DAYS,
+                                     drift_tolerance = RETUNE_DRIFT_TOLERANCE)
+    logger.info("Training mode: %s - %s", mode, reason)
+
+    if mode == 'full':
+        param_dist = {
+            'learning_rate': LEARNING_RATE_RANGE,
+            'n_estimators': N_ESTIMATORS_RANGE,
+            'max_depth': MAX_DEPTH_RANGE,
+            'subsample': SUBSAMPLE_RANGE,
+            'colsample_bytree': COLSAMPLE_BYTREE_RANGE,
+        }
+        best_params, cv_mse, df_trials = tune_hyperparameters(X_train, y_train, param_dist,
+                                                              n_iter = TUNING_N_ITER,
+                                                              n_folds = N_FOLD_CV,
+                                                              early_stopping_rounds = TUNING_EARLY_STOPPING_ROUNDS,
+                                                              early_stopping_fraction = TUNING_EARLY_STOPPING_FRACTION,
+                                                              halving_factor = TUNING_HALVING_FACTOR,
+                                                              random_state = 42)
+        logger.info("Best hyperparameters: %s, CV MSE mean: %.2f", best_params, cv_mse)
+
+        xgb_model = XGBRegressor(objective = 'reg:squarederror', **best_params)
+        with run_metrics.timer('model_fit_seconds', mode = 'full'):
+            xgb_model.fit(X_train, y_train)
+    elif new.any():
+        # continue boosting the current model on the trailing days of the training set, the new days included,
+        # keeping the tuned parameters
+        window = (train_dates >= test_start - pd.Timedelta(days = INCREMENTAL_WINDOW_DAYS)).to_numpy()
+        with run_metrics.timer('model_fit_seconds', mode = 'incremental'):
+            xgb_model = continue_training(current_model, X_train[window], y_train[window], n_rounds = INCREMENTAL_ROUNDS)
+        best_params = training_state['best_params']
+        cv_mse = training_state['cv_mse']
+    else:
+        xgb_model = current_model
+        best_params = training_state['best_params']
+        cv_mse = training_state['cv_mse']
+
+    # Evaluate on the unseen test set, rounding predictions to the closest weather code as a classification
+    evaluation = evaluate_model(xgb_model, X_test, y_test)
+    metrics = {name: evaluation['metrics'][name] for name in ('F1', 'R2', 'MSE', 'RMSE')}
+
+    # the cross-validation error is only measured by the tuning of a full run
+    if mode == 'full':
+        metrics['CV MSE mean'] = cv_mse
+    logger.info("Test metrics: %s", {name: round(value, 2) for name, value in metrics.items()})
+
+    # Save model, F1 report and training state locally
+    save_model(xgb_model, model_dir, MODEL_NAME)
+    with open(model_dir + "/f1_report.txt", 'w') as file:
+        file.write(report_text(evaluation))
+
+    if mode == 'incremental' and not new.any():
+        last_trained_date = training_state['last_trained_date']
+    else:
+        last_trained_date = (test_start - pd.Timedelta(days = 1)).date()
+    training_state = update_training_state(training_state, mode,
+                                           today = ctx.today,
+                                           last_trained_date = last_trained_date,
+                                           best_params = best_params,
+                                           validation_mse = evaluation['metrics']['MSE'],
+                                           cv_mse = cv_mse)
+    save_training_state(model_dir, training_state)
+
+    # Model schema describing inputs and outputs, only known to Hopsworks
+    model_kwargs = {}
+    if not ctx.offline:
+        from hsml.model_schema import ModelSchema
+        from hsml.schema import Schema
+        model_kwargs['model_schema'] = ModelSchema(input_schema = Schema(X_train), output_schema = Schema(y_train))
+
+    # Publish to the model registry
+    weather_code_model = ctx.mr.python.create_model(
+        name = MODEL_NAME,
+        metrics = metrics,
+        input_example = X_test.sample().values,
+        description = "Weather Code predictor.",
+        **model_kwargs)
+    weather_code_model.save(model_dir)
+
+    # File-based registry read by the resident inference service (already the registry when offline)
+    if not ctx.offline:
+        LocalModelRegistry(ctx.path(MODEL_REGISTRY_PATH)).python.create_model(
+            name = MODEL_NAME,
+            metrics = metrics,
+            description = "Weather Code predictor.").save(model_dir)
+
+    # the model served is the best on the test days of this run, the new one or one of the registry
+    ctx.model, ctx.model_dir = xgb_model, model_dir
+    if ranked:
+        best_metrics, best_model_dir, best_registry_model = ranked[0]
+        sign = -1 if OPTIMIZE_DIRECTION == 'max' else 1
+        if sign * best_metrics[MODEL_METRIC] < sign * metrics[MODEL_METRIC]:
+            logger.info("Serving %s, better than the new model on the test days: %s %.2f", best_model_dir,
+                        MODEL_METRIC, best_metrics[MODEL_METRIC])
+            ctx.model, ctx.model_dir = best_registry_model, best_model_dir
+
+    ctx.frames['metrics'] = metrics
+    return ctx.model
+
+def fetch_forecasts(openmeteo, url, store, locations, today):
+    """
+    Forecast features of the next 14 days for the locations, predicted on today.
+    The rolling features start from the last days of the history store.
+    """
+
+    params = {
+        "daily": daily_variables(FORECAST_SCHEMA),
+        "timezone": TIMEZONE,
+        "past_days": 0,
+        "forecast_days": 15
+    }
+    df_forecasts = fetch_locations(openmeteo, url, locations, params,
+                                   process_response = process_forecast_request,
+                                   chunk_size = FETCH_CHUNK_SIZE, max_workers = FETCH_MAX_WORKERS)
+    df_forecasts['prediction_date'] = pd.Timestamp(today)
+    df_forecasts['month'] = df_forecasts['forecast_date'].dt.month.astype('uint8')
+    return add_forecast_rolling_features(store, df_forecasts)
+
+def predict_codes(model, X):
+    run_metrics.incr('predicted_rows_total', len(X))
+    with run_metrics.timer('model_predict_seconds'):
+        # rounded to the closest code, within the code range
+        return to_weather_codes(model.predict(X))
+
+def predict_forecasts(model, df_forecasts, cache = None):
+    """
+    Add the predicted weather code and its descriptions to the forecast features.
+    With a prediction cache, only the rows whose features or model changed since a previous run are scored.
+    """
+
+    X = df_forecasts[MODEL_FEATURES]
+    if cache is None:
+        df_forecasts['weather_code'] = predict_codes(model, X)
+    else:
+        df_forecasts['weather_code'] = cache.predict(model_version(model), X, lambda X: predict_codes(model, X))
+    return add_weather_code_labels(apply_schema(df_forecasts))
+
+def publish_forecasts(ctx, df_forecasts, version = None):
+    """
+    Store the new or changed forecast rows in their Feature Group, and upload the forecast of every location for the web app,
+    as an Arrow file whose header records the version of the model that predicted it
+    """
+
+    forecast_weather_fg = ctx.fs.get_or_create_feature_group(
+        name = FG_FORECAST_NAME,
+        version = FG_FORECAST_V,
+        primary_key = FG_FORECAST_PK,
+        description = FG_FORECAST_DESC,
+        statistics_config = {"enabled": True, "histograms": True, "correlations": True}
+    )
+
+    # rows already published unchanged by a previous run are not inserted again; nothing reads the
+    # Feature Group back during the run, so the materialization job is not awaited
+    published = ctx.published_forecasts
+    df_delta = published.delta(df_forecasts)
+    if len(df_delta) > 0:
+        with run_metrics.timer('feature_group_insert_seconds', feature_group = FG_FORECAST_NAME):
+            forecast_weather_fg.insert(df_delta, write_options = {"wait_for_job": False})
+    run_metrics.incr('feature_group_rows_total', len(df_delta), feature_group = FG_FORECAST_NAME)
+    published.mark_published(df_delta, keep_since = ctx.today)
+    published.save()
+    logger.info("Inserted %d new or changed forecast rows of %d", len(df_delta), len(df_forecasts))
+
+    df_forecasts = df_forecasts.merge(ctx.locations[['location_id', 'location_name']], on = 'location_id', how = 'left')
+    forecast_path = ctx.path('resources', FORECAST_FILE)
+    write_forecast(df_forecasts, forecast_path, model_version = version, prediction_date = ctx.today)
+    ctx.project.get_dataset_api().upload(forecast_path, "Resources/weather_forecast", overwrite = True)
+
+    logger.info("Predicted %d forecast days", len(df_forecasts))
+    return df_forecasts
+
+def inference_stage(ctx):
+    """
+    Predict the weather code of the next 14 days for every location, store the forecast in its Feature Group
+    and upload it for the web app
+    """
+
+    # Model trained in this run, otherwise the best model of the registry
+    model = ctx.model if ctx.model is not None else best_model(ctx)[0]
+
+    df_forecasts = fetch_forecasts(ctx.openmeteo, ctx.openmeteo_url, ctx.history_store, ctx.locations, ctx.today)
+    df_forecasts = predict_forecasts(model, df_forecasts, ctx.prediction_cache)
+    ctx.prediction_cache.save()
+    logger.info("Prediction cache: %(hits)d rows cached, %(misses)d scored", ctx.prediction_cache.stats)
+    run_metrics.incr('prediction_cache_hits_total', ctx.prediction_cache.stats['hits'])
+    run_metrics.incr('prediction_cache_misses_total', ctx.prediction_cache.stats['misses'])
+    run_metrics.record_frame('forecasts_frame', df_forecasts)
+    df_forecasts = publish_forecasts(ctx, df_forecasts, version = model_version(model))
+
+    ctx.frames['forecasts'] = df_forecasts
+    return df_forecasts
+
+# Stages in running order
+STAGES = {
+    'feature': feature_stage,
+    'training': training_stage,
+    'inference': inference_stage,
+}
+
+def run_pipeline(ctx, stages = tuple(STAGES)):
+    """
+    Run the given stages in order within the context, recording the wall time of each one
+    """
+
+    for name in stages:
+        start = time.perf_counter()
+        STAGES[name](ctx)
+        seconds = time.perf_counter() - start
+        ctx.timings.append((name, seconds))
+        logger.info("Stage %s done in %.2f s", name, seconds)
+    return ctx.timings
@@ -0,0 +1,127 @@
+"""
+Streaming backfill of the weather history: the date range is walked in chunks of days and locations through a chain
+of generators (fetch -> prepare -> sinks), and each chunk is written as soon as it is prepared. Only one chunk is in
+memory at a time, whatever the length of the range. The history store records the days of each chunk written, so an
+interrupted backfill resumes at the first missing chunk.
+
+    store = HistoryStore('../history_store', key = ['location_id', 'date'])
+    progress = stream_backfill(openmeteo, BASELINE_URL_OPEN_METEO_ARCHIVE, store, locations, params,
+                               start = '2014-01-01', end = yesterday(), validation_ranges = VALIDATION_RANGES,
+                               sinks = [historical_weather_fg_insert])
+"""
+
+import logging
+import time
+
+import numpy as np
+
+from weather_store import ONE_DAY, fetch_missing_history, prepare_weather_days
+
+logger = logging.getLogger(__name__)
+
+def backfill_chunks(locations, start, end, chunk_days = 90, location_chunk_size = 100):
+    """
+    (locations, start, end) chunks covering the range, both ends included.
+    The days of a block of locations come in order, so the rolling windows of a chunk start in the chunk before it.
+    """
+
+    start, end = np.datetime64(start, 'D'), np.datetime64(end, 'D')
+    for i in range(0, len(locations), location_chunk_size):
+        block = locations.iloc[i:i + location_chunk_size]
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(chunk_start + (chunk_days - 1) * ONE_DAY, end)
+            yield block, chunk_start, chunk_end
+            chunk_start = chunk_end + ONE_DAY
+
+def fetch_chunks(openmeteo, url, store, chunks, params, held = None, **fetch_kwargs):
+    """
+    Fetch the days of each chunk missing from the store and not held by the quarantine: chunks written by an
+    interrupted run come out empty
+    """
+
+    for locations, start, end in chunks:
+        df = fetch_missing_history(openmeteo, url, store, locations, params, start = start, end = end, held = held,
+                                   **fetch_kwargs)
+        yield (locations, start, end), df
+
+def prepare_chunks(chunks, store, validation_ranges, quarantine = None):
+    """
+    Validation, weather codes, labels and rolling features of each fetched chunk
+    """
+
+    for chunk, df in chunks:
+        yield chunk, prepare_weather_days(df, store, validation_ranges, quarantine) if not df.empty else df
+
+class BackfillProgress:
+    """
+    Chunks, rows and location days processed so far, with the throughput and the estimated time left
+    """
+
+    def __init__(self, n_chunks, n_location_days, report = logger.info):
+        self.n_chunks = n_chunks
+        self.n_location_days = n_location_days
+        self.report = report
+        self.start_time = time.perf_counter()
+        self.chunks = 0
+        self.resumed = 0
+        self.rows = 0
+        self.location_days = 0
+        self.fetched_location_days = 0
+
+    def update(self, chunk, n_rows):
+        locations, start, end = chunk
+        self.chunks += 1
+        self.resumed += n_rows == 0
+        self.rows += n_rows
+        location_days = len(locations) * (int((end - start) / ONE_DAY) + 1)
+        self.location_days += location_days
+        self.fetched_location_days += location_days if n_rows > 0 else 0
+
+        # chunks resumed from the store take no time, they are left out of the rate
+        elapsed = self.elapsed
+        rate = self.fetched_location_days / elapsed if elapsed > 0 else 0
+        eta = (self.n_location_days - self.location_days) / rate if rate > 0 else 0
+        self.report(f"chunk {self.chunks}/{self.n_chunks} {start}..{end} ({len(locations)} locations): {n_rows} rows, "
+                    f"{self.location_days / self.n_location_days:.0%} done, {self.rows / elapsed:,.0f} rows/s, "
+                    f"{eta:.0f} s left")
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def summary(self):
+        return {
+            'chunks': self.chunks,
+            'resumed_chunks': self.resumed,
+            'rows': self.rows,
+            'seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows / self.elapsed, 1) if self.elapsed > 0 else 0,
+        }
+
+def stream_backfill(openmeteo, url, store, locations, params, start, end, validation_ranges, sinks = (), chunk_days = 90,
+                    location_chunk_size = 100, report = logger.info, quarantine = None, **fetch_kwargs):
+    """
+    Backfill the history between start and end (both included), chunk by chunk. Each prepared chunk is passed to
+    every sink (e.g. the insert of the history Feature Group), then appended to the history store, which marks it done:
+    a chunk interrupted before the store append is fetched and written again on resume, the sinks being idempotent
+    on the primary key. Days failing validation (e.g. measurements outside validation_ranges) are left out of the chunk,
+    and written to the quarantine if given, whose days waiting for their retry are not fetched.
+    Return the progress, with the throughput summary.
+    """
+
+    n_days = int((np.datetime64(end, 'D') - np.datetime64(start, 'D')) / ONE_DAY) + 1
+    n_chunks = -(-len(locations) // location_chunk_size) * -(-n_days // chunk_days)
+    progress = BackfillProgress(n_chunks, len(locations) * n_days, report)
+
+    chunks = backfill_chunks(locations, start, end, chunk_days, location_chunk_size)
+    held = quarantine.held_ranges() if quarantine is not None else None
+    for chunk, df in prepare_chunks(fetch_chunks(openmeteo, url, store, chunks, params, held, **fetch_kwargs), store,
+                                    validation_ranges, quarantine):
+        if not df.empty:
+            for sink in sinks:
+                sink(df)
+            store.append(df)
+        progress.update(chunk, len(df))
+
+    return progress
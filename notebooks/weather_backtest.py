@@ -0,0 +1,89 @@
+"""
+Backtest of the weather code model on the forecasts archived in the forecast Feature Group.
+Each archived forecast is replayed as it was published, one row per (location_id, forecast_date, prediction_date):
+its features are those of the Open-Meteo forecast of that prediction date, so the errors of the horizons differ by
+forecast skill. Forecasts are joined to the observed weather code of their forecast date through an index of the
+history, scored in large batches on a thread pool, and evaluated per horizon as in the training pipeline.
+Only the forecast dates after the training cutoff of the model are scored: it has seen the observed days until then.
+
+    df_backtest, df_metrics = backtest(model.predict, df_history, df_forecasts, after = training_state['last_trained_date'])
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from config import MODEL_FEATURES, MODEL_LABEL
+from weather_evaluation import evaluate
+
+# Key of an archived forecast
+FORECAST_KEY = ['location_id', 'forecast_date', 'prediction_date']
+
+def history_index(df_history):
+    """
+    History indexed by (location_id, date), sorted, for the point-in-time lookups of the observed weather codes
+    """
+
+    df = df_history.assign(date = pd.to_datetime(df_history['date']))
+    return df.set_index(['location_id', 'date']).sort_index()
+
+def observed_codes(index, location_ids, dates):
+    """
+    Observed weather code of each (location, date) pair, NaN where the history has no such day
+    """
+
+    keys = pd.MultiIndex.from_arrays([np.asarray(location_ids), pd.to_datetime(np.asarray(dates))])
+    return index[MODEL_LABEL].reindex(keys).to_numpy(dtype = np.float64)
+
+def score_batches(predict_fn, X, batch_size = 100000, max_workers = None):
+    """
+    Raw model outputs of X, predicted in batches of batch_size rows on a thread pool (XGBoost and NumPy release the GIL)
+    """
+
+    if len(X) == 0:
+        return np.empty(0, dtype = np.float32)
+    batches = [X.iloc[i:i + batch_size] for i in range(0, len(X), batch_size)]
+    with ThreadPoolExecutor(max_workers = max_workers or os.cpu_count()) as executor:
+        return np.concatenate([np.asarray(y, dtype = np.float32) for y in executor.map(predict_fn, batches)])
+
+def horizon_metrics(df):
+    """
+    Metrics of weather_evaluation.evaluate (weighted F1 of the rounded predictions, R2, MSE, RMSE, accuracy)
+    for each horizon, and over all horizons
+    """
+
+    def metrics(group):
+        return {'rows': len(group), **evaluate(group[MODEL_LABEL].to_numpy(), group['prediction'].to_numpy())['metrics']}
+
+    rows = {horizon: metrics(group) for horizon, group in df.groupby('horizon', sort = True)}
+    if len(df) > 0:
+        rows['all'] = metrics(df)
+    return pd.DataFrame.from_dict(rows, orient = 'index').rename_axis('horizon')
+
+def backtest(predict_fn, df_history, df_forecasts, prediction_dates = None, after = None, horizon_days = 14,
+             batch_size = 100000, max_workers = None):
+    """
+    Score the archived forecasts (FORECAST_KEY and the features) of the prediction dates (all of them by default)
+    and compare them with the observed weather codes. predict_fn returns the raw model output of a batch of
+    MODEL_FEATURES rows. Forecast dates until after (the training cutoff of the model) and the ones not observed yet
+    are left out. Return the scored rows and the metrics per horizon.
+    """
+
+    df = df_forecasts.assign(prediction_date = pd.to_datetime(df_forecasts['prediction_date']),
+                             forecast_date = pd.to_datetime(df_forecasts['forecast_date']))
+    df = df.drop_duplicates(subset = FORECAST_KEY, keep = 'last')
+    if prediction_dates is not None:
+        df = df[df['prediction_date'].isin(pd.DatetimeIndex(prediction_dates))]
+    if after is not None:
+        df = df[df['forecast_date'] > pd.Timestamp(after)]
+    df = df.assign(horizon = (df['forecast_date'] - df['prediction_date']).dt.days)
+    df = df[(df['horizon'] >= 0) & (df['horizon'] < horizon_days)]
+
+    # the archived weather code is the prediction of that day's model, the label is the observed one
+    index = history_index(df_history)
+    df = df.assign(**{MODEL_LABEL: observed_codes(index, df['location_id'], df['forecast_date'])})
+    df = df[df[MODEL_LABEL].notna()].sort_values(FORECAST_KEY, ignore_index = True)
+    df['prediction'] = score_batches(predict_fn, df[MODEL_FEATURES], batch_size, max_workers)
+    return df, horizon_metrics(df)
@@ -0,0 +1,102 @@
+"""
+Process-wide lookup tables between WMO weather codes, the grouped weather codes and their labels.
+The mapping CSV is read and compiled once, the first time a table is needed.
+"""
+
+import os
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Resolved from this file, so it does not depend on the working directory
+MAPPING_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'resources', 'weather_code_mapping.csv')
+
+# WMO weather codes range from 0 to 99
+N_WMO_CODES = 100
+
+# Grouped code used for WMO codes without a group
+NO_CODE = 0
+
+CodeTables = namedtuple('CodeTables', ['wmo_to_code', 'desc', 'desc_short', 'codes'])
+
+@lru_cache(maxsize = None)
+def get_code_tables():
+    """
+    Compile the mapping CSV into dense lookup arrays:
+    - wmo_to_code: grouped weather code for each WMO code, NO_CODE if not mapped
+    - desc, desc_short: categorical labels indexed by grouped weather code, missing for unknown codes
+    - codes: the grouped weather codes in the mapping
+    """
+
+    df_codes_mapping = pd.read_csv(MAPPING_PATH, encoding = 'utf-8-sig')
+
+    # WMO codes are given as comma-separated lists for each group code
+    wmo_to_code = np.full(N_WMO_CODES, NO_CODE, dtype = np.uint8)
+    for wmo_codes, code in zip(df_codes_mapping['weather_code_wmo'], df_codes_mapping['weather_code']):
+        wmo_to_code[[int(wmo_code) for wmo_code in wmo_codes.split(',')]] = code
+
+    # Labels are stored once as categories, each grouped code points to its category
+    codes = df_codes_mapping['weather_code'].to_numpy()
+    labels = {}
+    for column in ['weather_code_desc', 'weather_code_desc_short']:
+        categories = pd.unique(df_codes_mapping[column])
+        category_index = np.full(codes.max() + 1, -1, dtype = np.int8)
+        category_index[codes] = pd.Index(categories).get_indexer(df_codes_mapping[column])
+        labels[column] = (category_index, pd.Index(categories))
+
+    return CodeTables(wmo_to_code, labels['weather_code_desc'], labels['weather_code_desc_short'], codes)
+
+def lookup_index(values, size):
+    """
+    Turn an array of codes into safe indexes of a table with the given size.
+    Return the indexes and the mask of the codes that are valid positions (not missing, integer, in range).
+    """
+
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        valid = (values >= 0) & (values < size) & (values == np.floor(values))
+    else:
+        valid = (values >= 0) & (values < size)
+    index = np.where(valid, values, 0).astype(np.intp)
+    return index, valid
+
+def wmo_to_weather_codes(wmo_codes):
+    """
+    Map an array of WMO weather codes to grouped weather codes, NO_CODE where there is no group
+    """
+
+    tables = get_code_tables()
+    index, valid = lookup_index(wmo_codes, N_WMO_CODES)
+    codes = tables.wmo_to_code.take(index)
+    codes[~valid] = NO_CODE
+    return codes
+
+def to_weather_codes(predictions):
+    """
+    Round the raw model predictions to the closest grouped weather code, clipped to the codes of the mapping
+    """
+
+    codes = get_code_tables().codes
+    return np.clip(np.rint(np.asarray(predictions, dtype = np.float64)), codes.min(), codes.max()).astype(np.uint8)
+
+def weather_code_labels(codes, short = False):
+    """
+    Categorical labels of an array of grouped weather codes, missing for unknown codes
+    """
+
+    tables = get_code_tables()
+    category_index, categories = tables.desc_short if short else tables.desc
+    index, valid = lookup_index(codes, len(category_index))
+    label_codes = category_index.take(index)
+    label_codes[~valid] = -1
+    return pd.Categorical.from_codes(label_codes, categories = categories)
+
+def weather_code_label_dtype(short = False):
+    """
+    Categorical dtype of the (short) labels, with every label of the mapping as category
+    """
+
+    tables = get_code_tables()
+    return pd.CategoricalDtype((tables.desc_short if short else tables.desc)[1])
@@ -0,0 +1,267 @@
+"""
+Evaluation of the weather code model on the test set.
+All the metrics come from one vectorized pass over the labels and predictions: regression errors on the raw
+predictions, and per-code precision, recall and F1 of the rounded predictions from a confusion matrix built with
+np.bincount. The metrics of a model on a holdout are cached by model version and holdout days, as every run of a day
+ranks the same registry models on the same days. The figures are rendered on a background thread pool, only the ones
+asked for.
+
+    evaluation = evaluate_model(model, X_test, y_test)
+    cache = EvaluationCache.load('../evaluation_cache/evaluations.joblib')
+    metrics = holdout_metrics(model, X_holdout, y_holdout, (first_day, last_day), cache)
+    futures = render_plots(evaluation, MODEL_PATH, plots = ['f1', 'residuals'], model = model)
+"""
+
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from forecast_cache import load_state, model_version, save_state
+from weather_codes import get_code_tables, to_weather_codes
+
+def confusion_matrix(y_true, y_pred, labels):
+    """
+    Counts of (true, predicted) label pairs, rows indexed by the true label and columns by the predicted one.
+    labels is the sorted array of consecutive integer labels covering both arrays.
+    """
+
+    offset, n_labels = labels[0], len(labels)
+    pairs = (y_true - offset) * n_labels + (y_pred - offset)
+    return np.bincount(pairs, minlength = n_labels * n_labels).reshape(n_labels, n_labels)
+
+def evaluate(y_true, y_pred):
+    """
+    Metrics of the raw predictions y_pred against the weather codes y_true, the predictions being rounded and clipped
+    to the code range as the published ones (to_weather_codes) for the classification metrics, which equal the weighted ones of sklearn. The per-code table covers
+    every code of the mapping, and any other code seen or predicted.
+    """
+
+    y_true = np.asarray(y_true, dtype = np.float64).ravel()
+    y_pred = np.asarray(y_pred, dtype = np.float64).ravel()
+    true_codes = y_true.astype(np.int64)
+    pred_codes = to_weather_codes(y_pred).astype(np.int64)
+
+    # Regression errors
+    residuals = y_pred - y_true
+    mse = float(np.mean(residuals ** 2))
+    total_variance = float(np.sum((y_true - y_true.mean()) ** 2))
+    r2 = 1 - float(np.sum(residuals ** 2)) / total_variance if total_variance > 0 else float('nan')
+
+    # Confusion matrix over every code of the mapping, and any code out of its range that shows up
+    codes = get_code_tables().codes
+    low = min(codes.min(), true_codes.min(), pred_codes.min())
+    high = max(codes.max(), true_codes.max(), pred_codes.max())
+    labels = np.arange(low, high + 1)
+    matrix = confusion_matrix(true_codes, pred_codes, labels)
+
+    # Per-code precision, recall and F1 from the matrix diagonal and margins
+    true_positives = np.diag(matrix).astype(np.float64)
+    support = matrix.sum(axis = 1)
+    predicted = matrix.sum(axis = 0)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        precision = np.where(predicted > 0, true_positives / predicted, 0.0)
+        recall = np.where(support > 0, true_positives / support, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+
+    df_codes = pd.DataFrame({
+        'code': labels,
+        'precision': precision,
+        'recall': recall,
+        'f1': f1,
+        'support': support,
+        'predicted': predicted,
+        'true_positives': true_positives.astype(np.int64),
+    })
+    present = (support > 0) | (predicted > 0)
+
+    return {
+        'metrics': {
+            'F1': float(np.sum(f1 * support) / support.sum()),
+            'R2': r2,
+            'MSE': mse,
+            'RMSE': float(np.sqrt(mse)),
+            'accuracy': float(true_positives.sum() / len(y_true)),
+        },
+        'codes': df_codes[present | np.isin(labels, codes)].reset_index(drop = True),
+        'confusion_matrix': pd.DataFrame(matrix, index = pd.Index(labels, name = 'true'), columns = pd.Index(labels, name = 'predicted')),
+        'y_true': y_true.astype(np.float32),
+        'y_pred': y_pred.astype(np.float32),
+    }
+
+def report_text(evaluation):
+    """
+    Per-code precision, recall, F1 and support as text, laid out like the sklearn classification report
+    """
+
+    df = evaluation['codes']
+    df = df[(df['support'] > 0) | (df['predicted'] > 0)]
+    lines = [f"{'':>12} {'precision':>9} {'recall':>9} {'f1-score':>9} {'support':>9}", '']
+    for row in df.itertuples():
+        lines.append(f"{row.code:>12} {row.precision:9.2f} {row.recall:9.2f} {row.f1:9.2f} {row.support:9d}")
+    support = df['support'].sum()
+    weighted = [np.sum(df[column] * df['support']) / support for column in ('precision', 'recall', 'f1')]
+    lines += ['',
+              f"{'accuracy':>12} {'':>9} {'':>9} {evaluation['metrics']['accuracy']:9.2f} {support:9d}",
+              f"{'macro avg':>12} {df['precision'].mean():9.2f} {df['recall'].mean():9.2f} {df['f1'].mean():9.2f} {support:9d}",
+              f"{'weighted avg':>12} {weighted[0]:9.2f} {weighted[1]:9.2f} {weighted[2]:9.2f} {support:9d}"]
+    return '\n'.join(lines) + '\n'
+
+def evaluate_model(model, X_test, y_test):
+    """
+    Evaluation of the model on the test set
+    """
+
+    return evaluate(y_test, model.predict(X_test))
+
+class EvaluationCache:
+    """
+    Bounded LRU cache of holdout metrics, keyed by (model version, first holdout day, last holdout day, holdout rows).
+    Only the metrics are kept, not the predictions they were computed from.
+    """
+
+    def __init__(self, max_size = 64, path = None, entries = None):
+        self.max_size = max_size
+        self.path = path
+        self.entries = entries if entries is not None else OrderedDict()
+
+        # evaluations answered from the cache and evaluations computed, since the cache was loaded
+        self.stats = {'hits': 0, 'misses': 0}
+
+    @classmethod
+    def load(cls, path, max_size = 64):
+        return cls(max_size, path, load_state(path, None))
+
+    def save(self, path = None):
+        save_state(path or self.path, self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        metrics = self.entries.get(key)
+        if metrics is not None:
+            self.entries.move_to_end(key)
+        return metrics
+
+    def put(self, key, metrics):
+        self.entries[key] = metrics
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last = False)
+
+def holdout_metrics(model, X_holdout, y_holdout, holdout, cache = None):
+    """
+    Metrics of the model on the holdout, whose (first day, last day) are given. With a cache, a model already scored
+    on the same holdout days is not scored again, and new metrics are cached and saved. The number of holdout rows is
+    part of the key, so a day landing late in the holdout (a quarantined day retried) is not answered from the cache.
+    """
+
+    if cache is None:
+        return evaluate_model(model, X_holdout, y_holdout)['metrics']
+
+    first_day, last_day = holdout
+    key = (model_version(model), str(pd.Timestamp(first_day).date()), str(pd.Timestamp(last_day).date()), len(y_holdout))
+    metrics = cache.get(key)
+    if metrics is not None:
+        cache.stats['hits'] += 1
+        return metrics
+
+    cache.stats['misses'] += 1
+    metrics = evaluate_model(model, X_holdout, y_holdout)['metrics']
+    cache.put(key, metrics)
+    if cache.path is not None:
+        cache.save()
+    return metrics
+
+def plot_f1(evaluation, ax):
+    """
+    Correct predictions, false alarms and misses of each weather code, with its F1 score
+    """
+
+    df = evaluation['codes']
+    false_positives = df['predicted'] - df['true_positives']
+    false_negatives = df['support'] - df['true_positives']
+    ax.bar(df['code'], df['true_positives'], label = 'True Positives', color = 'green')
+    ax.bar(df['code'], false_positives, bottom = df['true_positives'], label = 'False Positives', color = 'red')
+    ax.bar(df['code'], false_negatives, bottom = df['true_positives'] + false_positives, label = 'False Negatives', color = 'orange')
+    for code, f1, height in zip(df['code'], df['f1'], df['predicted'] + false_negatives):
+        ax.annotate(f"{f1:.2f}", (code, height), ha = 'center', va = 'bottom', fontsize = 8)
+    ax.set_xticks(df['code'])
+    ax.set_xlabel('Weather Code')
+    ax.set_ylabel('Count')
+    ax.set_title('F1 Metrics for Each Weather Code')
+    ax.legend(bbox_to_anchor = (1.05, 1), loc = 'upper left')
+
+def plot_frequency(evaluation, ax):
+    """
+    Frequency of each weather code in the labels and in the rounded predictions, over every code
+    """
+
+    df = evaluation['codes']
+    bar_width = 0.35
+    ax.bar(df['code'] - bar_width / 2, df['support'], bar_width, label = 'True Labels', color = 'blue', edgecolor = 'black')
+    ax.bar(df['code'] + bar_width / 2, df['predicted'], bar_width, label = 'Predictions', color = 'orange', edgecolor = 'black')
+    ax.set_xticks(df['code'])
+    ax.set_xlabel('Weather Code')
+    ax.set_ylabel('Frequency')
+    ax.set_title('Frequency Distribution of Weather Codes')
+    ax.legend()
+
+def plot_residuals(evaluation, ax):
+    """
+    Residuals against the true weather code: unbiased predictions scatter around zero
+    """
+
+    y_true, y_pred = evaluation['y_true'], evaluation['y_pred']
+    ax.scatter(y_true, y_pred - y_true, s = 4, alpha = 0.3, color = 'orange')
+    ax.axhline(0, color = 'gray', linestyle = '--')
+    ax.set_xlabel('Weather Code')
+    ax.set_ylabel('Error')
+    ax.set_title('Model Residuals')
+
+def plot_importance(model, ax):
+    """
+    Number of splits on each feature, as plotted by xgboost.plot_importance
+    """
+
+    scores = pd.Series(model.get_booster().get_score(importance_type = 'weight')).sort_values()
+    ax.barh(scores.index, scores.to_numpy())
+    ax.set_xlabel('F score')
+    ax.set_title('Feature importance')
+
+PLOTS = {
+    'f1': plot_f1,
+    'frequency': plot_frequency,
+    'residuals': plot_residuals,
+    'importance': plot_importance,
+}
+
+def render_plot(name, evaluation, model, output_dir):
+    """
+    Draw one figure and save it as <output_dir>/plot_<name>.png. Figures are created without pyplot, so several
+    can be drawn at once on different threads.
+    """
+
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize = (8, 5), layout = 'tight')
+    ax = figure.add_subplot()
+    PLOTS[name](model if name == 'importance' else evaluation, ax)
+    path = os.path.join(output_dir, f"plot_{name}.png")
+    figure.savefig(path)
+    return path
+
+def render_plots(evaluation, output_dir, plots = tuple(PLOTS), model = None, max_workers = None):
+    """
+    Render the requested figures in the background. Return a future of the saved path of each figure, by name.
+    The importance figure needs the model.
+    """
+
+    os.makedirs(output_dir, exist_ok = True)
+    executor = ThreadPoolExecutor(max_workers = max_workers or min(len(plots), os.cpu_count()) or 1)
+    futures = {name: executor.submit(render_plot, name, evaluation, model, output_dir) for name in plots}
+    executor.shutdown(wait = False)
+    return futures
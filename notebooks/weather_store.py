@@ -0,0 +1,290 @@
+"""
+Local history store: daily weather data as Parquet files partitioned by location and month,
+with a manifest of the date ranges present for each location.
+"""
+
+import json
+import logging
+import os
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from weather_utils import (ROLLING_CONTEXT_DAYS, ROLLING_FEATURES, add_rolling_features, add_weather_code_labels, apply_schema,
+                           fetch_locations, group_wmo_weather_codes)
+from weather_validation import validate_weather_days
+
+logger = logging.getLogger(__name__)
+
+ONE_DAY = np.timedelta64(1, 'D')
+
+def dates_to_ranges(dates):
+    """
+    Coalesce dates into a sorted list of (start, end) ranges of consecutive days, both ends included
+    """
+
+    dates = np.unique(np.asarray(dates, dtype = 'datetime64[D]'))
+    if len(dates) == 0:
+        return []
+
+    # a new range starts wherever the gap with the previous date is larger than one day
+    breaks = np.flatnonzero(np.diff(dates) > ONE_DAY)
+    starts = np.concatenate([[0], breaks + 1])
+    ends = np.concatenate([breaks, [len(dates) - 1]])
+    return [(dates[s], dates[e]) for s, e in zip(starts, ends)]
+
+def merge_ranges(ranges):
+    """
+    Merge overlapping or adjacent (start, end) ranges
+    """
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + ONE_DAY:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+class HistoryStore:
+    """
+    Parquet history store, idempotent on the (location_id, date) key
+    """
+
+    def __init__(self, path, key = ('location_id', 'date')):
+        self.path = path
+        self.key = list(key)
+        self.date_column = self.key[-1]
+        self.manifest_path = os.path.join(path, 'manifest.json')
+        os.makedirs(path, exist_ok = True)
+
+        # date ranges present for each location
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as file:
+                manifest = json.load(file)
+            self.manifest = {
+                location_id: [(np.datetime64(start, 'D'), np.datetime64(end, 'D')) for start, end in ranges]
+                for location_id, ranges in manifest.items()
+            }
+
+    def partition_path(self, location_id, month):
+        return os.path.join(self.path, f"location_id={location_id}", f"month={month}", 'part.parquet')
+
+    def present_ranges(self, location_id):
+        """
+        Date ranges already in the store for the location
+        """
+
+        return self.manifest.get(str(location_id), [])
+
+    def missing_ranges(self, location_id, start, end):
+        """
+        Date ranges between start and end (both included) that are not in the store for the location
+        """
+
+        start, end = np.datetime64(start, 'D'), np.datetime64(end, 'D')
+        missing = []
+        cursor = start
+        for present_start, present_end in self.present_ranges(location_id):
+            if present_end < cursor:
+                continue
+            if present_start > end:
+                break
+            if present_start > cursor:
+                missing.append((cursor, present_start - ONE_DAY))
+            cursor = present_end + ONE_DAY
+        if cursor <= end:
+            missing.append((cursor, end))
+        return missing
+
+    def append(self, df):
+        """
+        Write the rows into their partitions, replacing the rows with the same key, and update the manifest
+        """
+
+        if df.empty:
+            return
+
+        df = df.copy()
+        df[self.date_column] = pd.to_datetime(df[self.date_column]).dt.normalize()
+        months = df[self.date_column].dt.strftime('%Y-%m')
+
+        for (location_id, month), df_partition in df.groupby([df['location_id'], months], sort = False):
+            path = self.partition_path(location_id, month)
+            if os.path.exists(path):
+                df_partition = pd.concat([pd.read_parquet(path), df_partition], ignore_index = True)
+
+            # newest rows win on the same key
+            df_partition = df_partition.drop_duplicates(subset = self.key, keep = 'last')
+            df_partition = df_partition.sort_values(by = self.date_column, ignore_index = True)
+            self.write_atomic(df_partition, path)
+
+        for location_id, dates in df.groupby('location_id')[self.date_column]:
+            location_id = str(location_id)
+            self.manifest[location_id] = merge_ranges(self.present_ranges(location_id) + dates_to_ranges(dates))
+        self.save_manifest()
+
+    def read(self, location_ids = None, start = None, end = None):
+        """
+        Read the history of the given locations (all by default) between start and end (both included)
+        """
+
+        if location_ids is None:
+            location_ids = list(self.manifest)
+
+        # only the month partitions overlapping the dates are read
+        first_month = pd.Timestamp(start).strftime('%Y-%m') if start is not None else ''
+        last_month = pd.Timestamp(end).strftime('%Y-%m') if end is not None else '9999-12'
+
+        paths = []
+        for location_id in location_ids:
+            location_path = os.path.join(self.path, f"location_id={location_id}")
+            if os.path.isdir(location_path):
+                months = [partition.split('=', 1)[1] for partition in sorted(os.listdir(location_path))]
+                paths += [self.partition_path(location_id, month) for month in months if first_month <= month <= last_month]
+        if not paths:
+            return apply_schema(pd.DataFrame(columns = self.key))
+
+        # partitions written before the compact schema are cast on read
+        df = apply_schema(pd.concat([pd.read_parquet(path) for path in paths], ignore_index = True))
+        if start is not None:
+            df = df[df[self.date_column] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df[self.date_column] <= pd.Timestamp(end)]
+        return df.reset_index(drop = True)
+
+    def write_atomic(self, df, path):
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        tmp_path = path + '.tmp'
+        df.to_parquet(tmp_path, index = False)
+        os.replace(tmp_path, path)
+
+    def save_manifest(self):
+        manifest = {
+            location_id: [[str(start), str(end)] for start, end in ranges]
+            for location_id, ranges in self.manifest.items()
+        }
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(manifest, file, indent = 1)
+        os.replace(tmp_path, self.manifest_path)
+
+def subtract_ranges(ranges, excluded):
+    """
+    Parts of the sorted (start, end) ranges outside the sorted excluded ranges, both ends included
+    """
+
+    remaining = []
+    for start, end in ranges:
+        for excluded_start, excluded_end in excluded:
+            if excluded_end < start or excluded_start > end:
+                continue
+            if excluded_start > start:
+                remaining.append((start, excluded_start - ONE_DAY))
+            start = excluded_end + ONE_DAY
+        if start <= end:
+            remaining.append((start, end))
+    return remaining
+
+def fetch_missing_history(openmeteo, url, store, locations, params, start, end, held = None, **fetch_kwargs):
+    """
+    Fetch from Open-Meteo only the days between start and end (both included) that are missing from the store,
+    leaving out the held date ranges of each location (quarantined days waiting for their retry, Quarantine.held_ranges).
+    Missing days are coalesced into date ranges, and locations missing the same range share multi-location requests.
+    """
+
+    # group the locations by missing date range
+    requests = {}
+    held = held or {}
+    for i, location_id in enumerate(locations['location_id']):
+        for date_range in subtract_ranges(store.missing_ranges(location_id, start, end), held.get(str(location_id), [])):
+            requests.setdefault(date_range, []).append(i)
+
+    dfs = []
+    for (range_start, range_end), rows in requests.items():
+        # Open-Meteo days are labelled from the UTC time of the local midnight, which can fall on the previous day:
+        # the end of the range is padded by one day and the result clipped to the range
+        range_params = dict(params)
+        range_params["start_date"] = str(range_start)
+        range_params["end_date"] = str(range_end + ONE_DAY)
+
+        df = fetch_locations(openmeteo, url, locations.iloc[rows], range_params, **fetch_kwargs)
+        dates = pd.to_datetime(df['date'])
+        dfs.append(df[(dates >= pd.Timestamp(range_start)) & (dates <= pd.Timestamp(range_end))])
+
+    if not dfs:
+        return pd.DataFrame(columns = ['location_id', 'date'])
+
+    return pd.concat(dfs, ignore_index = True)
+
+def yesterday():
+    """
+    Last day Open-Meteo can have complete historical data for
+    """
+
+    return pd.Timestamp.today().date() - timedelta(days = 1)
+
+def refresh_rolling_features(store, df_new):
+    """
+    Rolling features of the new days, and of the stored days whose windows include a new day.
+    Only the ROLLING_CONTEXT_DAYS days around the new days are read from the store, so the cost does not grow with
+    the history. Return the new days and the updated stored days, to be written back to the store.
+    """
+
+    if df_new.empty:
+        return df_new.assign(**{name: pd.Series(dtype = 'float32') for name in ROLLING_FEATURES})
+
+    dates = pd.to_datetime(df_new['date'])
+    context_days = pd.Timedelta(days = ROLLING_CONTEXT_DAYS)
+    first_day, last_day = dates.min(), dates.max()
+
+    # stored days before the new ones start the windows, stored days after them have windows to update
+    df_stored = store.read(location_ids = df_new['location_id'].astype(str).unique(),
+                           start = first_day - context_days, end = last_day + context_days)
+    df_stored = df_stored[df_stored.columns.intersection(df_new.columns)]
+    df_context = df_stored[df_stored['date'] < first_day]
+    df_affected = df_stored[df_stored['date'] >= first_day]
+
+    # new days replace the stored ones
+    df_new = df_new.assign(date = dates.dt.normalize())
+    df_affected = df_affected.merge(df_new[['location_id', 'date']], on = ['location_id', 'date'], how = 'left', indicator = True)
+    df_affected = df_affected[df_affected['_merge'] == 'left_only'].drop(columns = ['_merge'])
+    df_days = add_rolling_features(pd.concat([df_new, df_affected], ignore_index = True), context = df_context)
+    return apply_schema(df_days)
+
+def prepare_weather_days(df_weather, store, validation_ranges, quarantine = None):
+    """
+    Validate the fetched days (measurements within validation_ranges), add the month, the weather codes and the rolling features of the valid ones.
+    Days failing validation (days not yet available in Open-Meteo, values out of range, unknown codes, duplicates)
+    are left out, written to the quarantine if given, and queried again once their backoff is over.
+    The stored days whose windows include a new day are returned too, with updated features.
+    """
+
+    validation = validate_weather_days(df_weather, validation_ranges, store)
+    if quarantine is not None:
+        quarantine.add(validation.rejected)
+    if len(validation.rejected) > 0 or len(validation.gaps) > 0:
+        logger.info("Validation: %d of %d days quarantined, %d days missing in %d gaps", len(validation.rejected),
+                    len(df_weather), validation.counts['gap_days'], len(validation.gaps))
+
+    df_weather = validation.valid
+    if df_weather.empty:
+        return df_weather
+
+    df_weather = apply_schema(df_weather)
+    df_weather['month'] = df_weather['date'].dt.month.astype('uint8')
+    df_weather = group_wmo_weather_codes(df_weather)
+    df_weather = add_weather_code_labels(df_weather)
+    return refresh_rolling_features(store, df_weather)
+
+def add_forecast_rolling_features(store, df_forecasts):
+    """
+    Rolling features of the forecast days, with the windows starting in the last stored days of each location
+    """
+
+    first_day = pd.to_datetime(df_forecasts['forecast_date']).min()
+    df_context = store.read(location_ids = df_forecasts['location_id'].astype(str).unique(),
+                            start = first_day - pd.Timedelta(days = ROLLING_CONTEXT_DAYS), end = first_day - pd.Timedelta(days = 1))
+    return apply_schema(add_rolling_features(df_forecasts, context = df_context, date_column = 'forecast_date'))
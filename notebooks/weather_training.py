@@ -0,0 +1,103 @@
+"""
+Incremental training of the weather code model: continue boosting the current model on the trailing days of the
+history, which include the newly ingested ones, and re-tune the hyperparameters only on schedule or when the
+validation error drifts. Models are compared on one holdout, each metric of the registry being measured on the
+holdout of the run that published it.
+"""
+
+import json
+import os
+from datetime import date
+
+import numpy as np
+
+# Saved next to the model, so it is uploaded to and downloaded from the registry with it
+TRAINING_STATE_FILE = 'training_state.json'
+
+def load_training_state(model_dir):
+    """
+    Training state saved with a model, None if the model has none
+    """
+
+    path = os.path.join(model_dir, TRAINING_STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+def save_training_state(model_dir, state):
+    with open(os.path.join(model_dir, TRAINING_STATE_FILE), 'w') as file:
+        json.dump(state, file, indent = 4)
+
+def plan_training(state, model, X_new, y_new, today, retune_every_days, drift_tolerance):
+    """
+    Decide between a full re-tuning and training ('full') and an incremental update ('incremental').
+    Return the mode and the reason of the choice.
+    """
+
+    if state is None or model is None:
+        return 'full', 'no previous training'
+
+    days_since_tuning = (date.fromisoformat(str(today)) - date.fromisoformat(state['last_tuned'])).days
+    if days_since_tuning >= retune_every_days:
+        return 'full', f"last tuned {days_since_tuning} days ago"
+
+    if len(X_new) == 0:
+        return 'incremental', 'no new days'
+
+    # validation error of the current model on the days it has not seen yet
+    mse = float(np.mean((model.predict(X_new) - np.asarray(y_new)) ** 2))
+    if mse > state['validation_mse'] * (1 + drift_tolerance):
+        return 'full', f"validation MSE drifted from {state['validation_mse']:.2f} to {mse:.2f}"
+
+    return 'incremental', f"validation MSE {mse:.2f} within tolerance"
+
+def continue_training(model, X_window, y_window, n_rounds):
+    """
+    Add n_rounds boosting rounds to the model, fitted on a trailing window of days: the new days and the ones before
+    them, so that the new trees do not overfit the few rows of a single day.
+    Return a new model, the given one is left unchanged.
+    """
+
+    if len(X_window) == 0:
+        return model
+
+    from xgboost import XGBRegressor
+
+    params = model.get_params()
+    params['n_estimators'] = n_rounds
+    updated_model = XGBRegressor(**params)
+    updated_model.fit(X_window, y_window, xgb_model = model.get_booster())
+    return updated_model
+
+def rank_models(candidates, X_holdout, y_holdout, metric, direction, holdout = None, cache = None):
+    """
+    Score the (name, model) candidates on the same holdout and sort them from the best to the worst value of the
+    metric ('max' or 'min' direction). With the (first day, last day) of the holdout and an EvaluationCache,
+    the candidates already scored on these days are not scored again. Return (metrics, name, model) tuples.
+    """
+
+    from weather_evaluation import holdout_metrics
+
+    if holdout is None:
+        cache = None
+    scored = [(holdout_metrics(model, X_holdout, y_holdout, holdout, cache), name, model) for name, model in candidates]
+    sign = -1 if direction == 'max' else 1
+    return sorted(scored, key = lambda candidate: sign * candidate[0][metric])
+
+def update_training_state(state, mode, today, last_trained_date, best_params = None, validation_mse = None, cv_mse = None):
+    """
+    New training state after a run: a full run resets the tuning date, the hyperparameters and the validation baseline
+    """
+
+    state = dict(state or {})
+    if mode == 'full':
+        state.update({
+            'last_tuned': str(today),
+            'best_params': best_params,
+            'validation_mse': validation_mse,
+            'cv_mse': cv_mse,
+        })
+    state['last_trained_date'] = str(last_trained_date)
+    state['last_mode'] = mode
+    return state
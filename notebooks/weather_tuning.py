@@ -0,0 +1,135 @@
+"""
+Hyperparameter search for the XGBoost weather code model.
+Candidates are sampled from the configuration ranges and cross-validated in parallel on folds built once,
+pruned with successive halving over the folds and with XGBoost early stopping over the boosting rounds.
+Early stopping monitors a share of the training rows of each fold, so the validation rows it is scored on stay unseen.
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.model_selection import KFold, ParameterSampler
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+def make_folds(X, y, n_folds, early_stopping_fraction = 0.1, random_state = 42):
+    """
+    Build the training, early stopping and validation matrices of each cross-validation fold once, shared by all
+    candidates. The early stopping rows are a random early_stopping_fraction of the training rows of the fold.
+    """
+
+    X = np.asarray(X, dtype = np.float32)
+    y = np.asarray(y, dtype = np.float32)
+    rng = np.random.default_rng(random_state)
+
+    folds = []
+    for train_index, valid_index in KFold(n_splits = n_folds, shuffle = True, random_state = random_state).split(X):
+        train_index = rng.permutation(train_index)
+        n_stop = max(1, int(round(len(train_index) * early_stopping_fraction)))
+        stop_index, train_index = train_index[:n_stop], train_index[n_stop:]
+
+        # quantized once, so concurrent trainings only read the matrices
+        dtrain = xgb.QuantileDMatrix(X[train_index], y[train_index])
+        dstop = xgb.DMatrix(X[stop_index], y[stop_index])
+        dvalid = xgb.DMatrix(X[valid_index], y[valid_index])
+        folds.append((dtrain, dstop, dvalid))
+    return folds
+
+def booster_params(candidate, random_state):
+    """
+    Translate the XGBRegressor hyperparameters of a candidate into xgboost.train parameters
+    """
+
+    params = {key: value for key, value in candidate.items() if key != 'n_estimators'}
+    params.update({
+        'objective': 'reg:squarederror', # Square error is the most common loss function for regression prediction problems
+        'eval_metric': 'rmse',
+        'nthread': 1, # parallelism is across trials
+        'seed': random_state,
+    })
+    return params
+
+def run_trial(candidate, fold, early_stopping_rounds, random_state):
+    """
+    Train one candidate on one fold, stopping when the error on the early stopping rows does not improve.
+    Return the MSE on the validation rows, the number of boosting rounds used, the wall-clock and the CPU time.
+    """
+
+    dtrain, dstop, dvalid = fold
+    start_wall, start_cpu = time.perf_counter(), time.thread_time()
+
+    booster = xgb.train(booster_params(candidate, random_state), dtrain,
+                        num_boost_round = candidate['n_estimators'],
+                        evals = [(dstop, 'stop')],
+                        early_stopping_rounds = early_stopping_rounds,
+                        verbose_eval = False)
+
+    # scored with the trees kept by early stopping, on rows it did not look at
+    n_rounds = booster.best_iteration + 1
+    residuals = booster.predict(dvalid, iteration_range = (0, n_rounds)).astype(np.float64) - dvalid.get_label()
+
+    trial = {
+        'mse': float(np.mean(residuals ** 2)),
+        'n_rounds': n_rounds,
+        'wall_time': time.perf_counter() - start_wall,
+        'cpu_time': time.thread_time() - start_cpu,
+    }
+    metrics.incr('tuning_trials_total')
+    metrics.incr('tuning_boosting_rounds_total', trial['n_rounds'])
+    metrics.observe('tuning_trial_seconds', trial['wall_time'])
+    return trial
+
+def tune_hyperparameters(X, y, param_distributions, n_iter = 10, n_folds = 10, early_stopping_rounds = 10,
+                         early_stopping_fraction = 0.1, halving_factor = 3, min_folds = 2, n_jobs = None, random_state = 42):
+    """
+    Successive halving random search: all candidates are evaluated on min_folds folds, the best 1/halving_factor
+    are evaluated on halving_factor times more folds, and so on until the survivors are evaluated on all the folds.
+    Return the best XGBRegressor hyperparameters, their mean cross-validation MSE and the table of the trials.
+    The number of trees of the best candidate is the mean found by early stopping, within the n_estimators range.
+    """
+
+    candidates = list(ParameterSampler(param_distributions, n_iter = n_iter, random_state = random_state))
+    folds = make_folds(X, y, n_folds, early_stopping_fraction, random_state)
+
+    # one trial per candidate and fold, each computed at most once across the rungs
+    results = {}
+    survivors = list(range(len(candidates)))
+    rung = 0
+    with ThreadPoolExecutor(max_workers = n_jobs or os.cpu_count()) as executor:
+        while True:
+            n_rung_folds = min(n_folds, min_folds * halving_factor ** rung)
+            trials = [(c, f) for c in survivors for f in range(n_rung_folds) if (c, f) not in results]
+            futures = [executor.submit(run_trial, candidates[c], folds[f], early_stopping_rounds, random_state)
+                       for c, f in trials]
+            for (c, f), future in zip(trials, futures):
+                results[(c, f)] = dict(future.result(), candidate = c, fold = f, rung = rung)
+
+            # rank the survivors by their mean validation error on the folds of this rung
+            scores = {c: np.mean([results[(c, f)]['mse'] for f in range(n_rung_folds)]) for c in survivors}
+            survivors = sorted(survivors, key = scores.get)
+            if n_rung_folds == n_folds or len(survivors) == 1:
+                break
+            survivors = survivors[:max(1, len(survivors) // halving_factor)]
+            rung += 1
+
+    df_trials = pd.DataFrame(list(results.values()))
+    df_trials = df_trials.join(pd.DataFrame(candidates), on = 'candidate')
+
+    # the best candidate keeps the number of trees early stopping found on its folds
+    best = survivors[0]
+    best_params = dict(candidates[best])
+    n_rounds = int(round(df_trials.loc[df_trials['candidate'] == best, 'n_rounds'].mean()))
+    low, high = min(param_distributions['n_estimators']), max(param_distributions['n_estimators'])
+    best_params['n_estimators'] = int(np.clip(n_rounds, low, high))
+    if best_params['n_estimators'] != n_rounds:
+        logger.warning("Early stopping kept %d trees, outside the n_estimators range [%d, %d]: using %d",
+                       n_rounds, low, high, best_params['n_estimators'])
+
+    return best_params, float(scores[best]), df_trials
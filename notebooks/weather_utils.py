@@ -1,129 +1,298 @@
+import numpy as np
 import pandas as pd
-import openmeteo_requests
-import requests_cache
-from retry_requests import retry
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from weather_codes import NO_CODE, weather_code_label_dtype, weather_code_labels, wmo_to_weather_codes
 
-def get_openmeteo_connection():
+# Daily variables of the Open-Meteo queries, in the same order as requested, with the correspondant dataframe column
+WEATHER_SCHEMA = [
+    ("weather_code", "weather_code_wmo"),
+    ("temperature_2m_min", "temperature_min"),
+    ("precipitation_sum", "precipitation_sum"),
+    ("wind_gusts_10m_max", "wind_gusts_max"),
+]
+FORECAST_SCHEMA = [
+    ("temperature_2m_min", "temperature_min"),
+    ("precipitation_sum", "precipitation_sum"),
+    ("wind_gusts_10m_max", "wind_gusts_max"),
+]
+
+# Rolling-window and lag features: precipitation over the last N days and change of the minimum temperature over N days
+ROLLING_WINDOWS = (3, 7)
+ROLLING_FEATURES = [f"precipitation_sum_{days}d" for days in ROLLING_WINDOWS] + \
+                   [f"temperature_min_delta_{days}d" for days in ROLLING_WINDOWS]
+ROLLING_CONTEXT_DAYS = max(ROLLING_WINDOWS) # previous days the features of a day depend on
+
+# Compact dtypes of the pipeline columns, applied when the responses are parsed and at every stage boundary:
+# codes and month fit in uint8, measurements in float32, days are datetime64 and descriptions categorical
+COLUMN_DTYPES = {
+    'date': 'datetime64[ns]',
+    'forecast_date': 'datetime64[ns]',
+    'prediction_date': 'datetime64[ns]',
+    'weather_code_wmo': 'uint8',
+    'weather_code': 'uint8',
+    'month': 'uint8',
+    'temperature_min': 'float32',
+    'precipitation_sum': 'float32',
+    'wind_gusts_max': 'float32',
+    **{name: 'float32' for name in ROLLING_FEATURES},
+    'weather_code_desc': 'category',
+    'weather_code_desc_short': 'category',
+}
+
+def apply_schema(df):
     """
-    Setup the Open-Meteo API client with cache and retry on error
+    Cast the columns of df declared in COLUMN_DTYPES to their compact dtype, the other columns are left as they are.
+    Integer columns with missing values (days not available yet, unmapped codes) stay float32 until those rows are dropped.
     """
-    
+
+    casts = {}
+    for column, dtype in COLUMN_DTYPES.items():
+        if column not in df.columns:
+            continue
+        if dtype == 'category':
+            dtype = weather_code_label_dtype(short = column.endswith('_short'))
+        elif dtype == 'uint8' and df[column].isna().any():
+            dtype = 'float32'
+        if df[column].dtype != dtype:
+            casts[column] = dtype
+    return df.astype(casts) if casts else df
+
+def memory_footprint(df):
+    """
+    Bytes of the dataframe in memory (strings included), pickled (as handed over between processes) and as Parquet
+    """
+
+    import io
+    import pickle
+
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index = False)
+    return {
+        'memory_bytes': int(df.memory_usage(deep = True).sum()),
+        'pickle_bytes': len(pickle.dumps(df, protocol = pickle.HIGHEST_PROTOCOL)),
+        'parquet_bytes': buffer.tell(),
+    }
+
+def daily_variables(schema):
+    """
+    Return the list of daily variables to request to Open-Meteo for the given schema
+    """
+
+    return [variable for variable, column in schema]
+
+def get_openmeteo_connection(asynchronous = False, **client_kwargs):
+    """
+    Setup the Open-Meteo API client with cache and retry on error.
+    With asynchronous set, the client is the asyncio one of openmeteo_async (rate limited, with a cache shared
+    across processes), configured by client_kwargs.
+    """
+
+    if asynchronous:
+        from openmeteo_async import OpenMeteoClient
+        return OpenMeteoClient(**client_kwargs)
+
+    # HTTP client stack loaded on first connection, the code mapping and feature helpers do not need it
+    import openmeteo_requests
+    import requests_cache
+    from retry_requests import retry
+
     cache_session = requests_cache.CachedSession('.cache', expire_after = 3600)
+    # count the responses served by the cache
+    cache_session.hooks['response'].append(metrics.requests_cache_hook)
     retry_session = retry(cache_session, retries = 5, backoff_factor = 0.2)
     openmeteo = openmeteo_requests.Client(session = retry_session)
     return openmeteo
 
-def process_weather_request(response):
+def fetch_locations(openmeteo, url, locations, params, process_response = None, chunk_size = 100, max_workers = 4):
     """
-    Process the Open-Meteo response, formatting the data and returnin the correspondant Pandas dataframe.
+    Query Open-Meteo for a whole table of locations, returning one long-format Pandas dataframe keyed by (location_id, date).
+    The locations dataframe needs the columns 'location_id', 'latitude' and 'longitude'. Locations are sent in chunks of
+    multi-coordinate requests, with at most max_workers requests in flight, and each response is processed on its own.
     """
-    
-    # the order of variables needs to be the same as requested
-    daily = response.Daily()
-    daily_weather_code = daily.Variables(0).ValuesAsNumpy()
-    daily_temperature_min = daily.Variables(1).ValuesAsNumpy()
-    daily_precipitation_sum = daily.Variables(2).ValuesAsNumpy()
-    daily_wind_speed_10m_max = daily.Variables(3).ValuesAsNumpy()
-
-    # arrange features into a Numpy array
-    daily_data = {"date": pd.date_range(
-        start = pd.to_datetime(daily.Time(), unit = "s"),
-        end = pd.to_datetime(daily.TimeEnd(), unit = "s"),
-        freq = pd.Timedelta(seconds = daily.Interval()),
-        inclusive = "left"
-    )}
-    daily_data["weather_code_wmo"] = daily_weather_code
-    daily_data["temperature_min"] = daily_temperature_min
-    daily_data["precipitation_sum"] = daily_precipitation_sum
-    daily_data["wind_gusts_max"] = daily_wind_speed_10m_max
-
-    # transform table into Pandas dataframe
-    df = pd.DataFrame(data = daily_data)
-
-    # Format date column to include only the day
-    df['date'] = pd.to_datetime(df['date']).dt.date
-    
+
+    # by default the query is about historical weather data
+    if process_response is None:
+        process_response = process_weather_request
+
+    # split the locations into chunks, one multi-coordinate request each
+    chunks = [locations.iloc[i:i + chunk_size] for i in range(0, len(locations), chunk_size)]
+
+    def fetch_chunk(chunk):
+        chunk_params = dict(params)
+        chunk_params["latitude"] = chunk['latitude'].tolist()
+        chunk_params["longitude"] = chunk['longitude'].tolist()
+
+        # Open-Meteo returns one response per location, in the same order as requested
+        with metrics.timer('openmeteo_request_seconds'):
+            responses = openmeteo.weather_api(url, params = chunk_params)
+        metrics.incr('openmeteo_requests_total')
+        metrics.incr('openmeteo_locations_total', len(chunk))
+
+        dfs = []
+        for location_id, response in zip(chunk['location_id'], responses):
+            df = process_response(response)
+            df.insert(0, 'location_id', location_id)
+            dfs.append(df)
+        return dfs
+
+    # bounded number of concurrent requests
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        dfs = [df for chunk_dfs in executor.map(fetch_chunk, chunks) for df in chunk_dfs]
+
+    if not dfs:
+        return pd.DataFrame(columns = ['location_id'])
+
+    # one long-format table, keyed by location and date
+    df = pd.concat(dfs, ignore_index = True)
+    date_column = 'forecast_date' if 'forecast_date' in df.columns else 'date'
+    df = df.sort_values(by = ['location_id', date_column], ignore_index = True)
+    metrics.record_frame('openmeteo_frame', df)
+
     return df
 
-def process_forecast_request(response):
+def process_weather_request(response, as_arrow = False):
     """
-    Process the Open-Meteo response, formatting the data and returnin the correspondant Pandas dataframe.
+    Process the Open-Meteo response of the WEATHER_SCHEMA variables, returning the days as a Pandas dataframe
+    (or a pyarrow Table if as_arrow is set).
     """
-    
-    # the order of variables needs to be the same as requested
-    daily = response.Daily()
-    daily_temperature_min = daily.Variables(0).ValuesAsNumpy()
-    daily_precipitation_sum = daily.Variables(1).ValuesAsNumpy()
-    daily_wind_speed_10m_max = daily.Variables(2).ValuesAsNumpy()
-
-    # arrange features into a Numpy array
-    daily_data = {"date": pd.date_range(
-        start = pd.to_datetime(daily.Time(), unit = "s"),
-        end = pd.to_datetime(daily.TimeEnd(), unit = "s"),
-        freq = pd.Timedelta(seconds = daily.Interval()),
-        inclusive = "left"
-    )}
-    daily_data["temperature_min"] = daily_temperature_min
-    daily_data["precipitation_sum"] = daily_precipitation_sum
-    daily_data["wind_gusts_max"] = daily_wind_speed_10m_max
-
-    # transform table into Pandas dataframe
-    df = pd.DataFrame(data = daily_data)
-
-    # Format date column to include only the day
-    df['date'] = pd.to_datetime(df['date']).dt.date
-
-    # Rename date column to avoid confusing with the other prediction date feature
-    df = df.rename(columns={'date': 'forecast_date'})
-
-    # Sort the DataFrame by a date
-    df = df.sort_values(by='forecast_date')
-
-    # Drop the first row because it is about yesterday (Open-Meteo first next day is still yesterday)
-    df = df.iloc[1:]
-    
-    return df
+
+    return decode_daily_response(response, WEATHER_SCHEMA, as_arrow = as_arrow)
+
+def process_forecast_request(response, as_arrow = False):
+    """
+    Process the Open-Meteo response of the FORECAST_SCHEMA variables, returning the days as a Pandas dataframe
+    (or a pyarrow Table if as_arrow is set). The date column is forecast_date, to avoid confusing it with the
+    prediction date, and the first day is left out because it is about yesterday (Open-Meteo first next day is
+    still yesterday). The time axis of Open-Meteo is already sorted, so this is a slice.
+    """
+
+    return decode_daily_response(response, FORECAST_SCHEMA, date_column = 'forecast_date', skip_days = 1, as_arrow = as_arrow)
 
 def group_wmo_weather_codes(df):
     """
     For each day of the dataframe, add the new weather code based on the WMO weather code
     """
-    
-    # Given mapping between WMO codes and new codes
-    df_codes_mapping = pd.read_csv("../resources/weather_code_mapping.csv")
-
-    # Select useful columns
-    df_codes_mapping = df_codes_mapping[['weather_code_wmo', 'weather_code']]
 
-    # Create a dictionary to map WMO weather codes to group codes
-    weather_mapping = {}
-    for index, row in df_codes_mapping.iterrows():
-        codes = [int(code) for code in row['weather_code_wmo'].split(',')]  # WMO codes need to be split into a list
-        weather_code = row['weather_code']
-        for code in codes:
-            weather_mapping[code] = weather_code  # Removed unnecessary parentheses
+    # Grouped code of each WMO code, with a single lookup in the precompiled table
+    codes = wmo_to_weather_codes(df['weather_code_wmo'].to_numpy())
 
-    # Function to map WMO codes to new codes
-    def map_weather_code_to_code_wmo(code):
-        return weather_mapping.get(code, None)
+    # WMO codes without a group are missing values, as for an unmapped code
+    if (codes == NO_CODE).any():
+        df['weather_code'] = np.where(codes == NO_CODE, np.nan, codes).astype(np.float32)
+    else:
+        df['weather_code'] = codes
 
-    # Add new columns 'weather_code_label' and 'associated_code' based on the mapping
-    df['weather_code'] = df['weather_code_wmo'].apply(map_weather_code_to_code_wmo)
-    
     return df
 
 def add_weather_code_labels(df):
     """
     For each day of the dataframe, add both a long and a short description of the weather code
     """
-    
-    # Add label of weather code
-    df_codes_mapping = pd.read_csv("../resources/weather_code_mapping.csv")
-
-    # Select useful columns
-    df_codes_mapping = df_codes_mapping[['weather_code', 'weather_code_desc', 'weather_code_desc_short']]
-    
-    # Merge DataFrames on the 'weather_code' column
-    df = pd.merge(df, df_codes_mapping, on='weather_code', how='left')
-    
-    return df
\ No newline at end of file
+
+    # Labels are looked up by weather code, as categorical columns
+    codes = df['weather_code'].to_numpy()
+    df = df.copy(deep = False)
+    df['weather_code_desc'] = weather_code_labels(codes)
+    df['weather_code_desc_short'] = weather_code_labels(codes, short = True)
+
+    return df
+
+
+def decode_daily_response(response, schema, date_column = 'date', skip_days = 0, as_arrow = False):
+    """
+    Decode the daily variables of an Open-Meteo response into columns, without copying the value buffers.
+    Variable positions come from the schema (the order of the request, see daily_variables), dates are kept as
+    datetime64 and the first skip_days days are left out.
+    Return a Pandas dataframe, or a pyarrow Table if as_arrow is set.
+    """
+
+    daily = response.Daily()
+    if daily.VariablesLength() != len(schema):
+        raise ValueError(f"Expected {len(schema)} daily variables, the response has {daily.VariablesLength()}")
+
+    # days as datetime64, straight from the time range of the response
+    seconds = np.arange(daily.Time(), daily.TimeEnd(), daily.Interval(), dtype = 'int64')
+    columns = {date_column: seconds.astype('datetime64[s]').astype('datetime64[D]')[skip_days:]}
+
+    # views on the FlatBuffers value vectors, in the order declared by the schema
+    for i, (variable, column) in enumerate(schema):
+        columns[column] = daily.Variables(i).ValuesAsNumpy()[skip_days:]
+
+    if as_arrow:
+        import pyarrow as pa
+        return pa.table(columns)
+
+    return apply_schema(pd.DataFrame(columns, copy = False))
+
+def rolling_window_features(location_ids, dates, precipitation, temperature):
+    """
+    Rolling features of rows sorted by location and date, one row per day.
+    The row k positions back is the day k days before only if it is the same location and the dates are k days apart:
+    windows over missing days are missing values. Window sums always add the days in the same order,
+    so a day gets the same features whether it is computed with its whole history or only with the days before it.
+    """
+
+    n = len(dates)
+    dates = dates.astype('datetime64[D]')
+
+    def lag_valid(k):
+        valid = np.zeros(n, dtype = bool)
+        valid[k:] = (location_ids[k:] == location_ids[:-k]) & (dates[k:] - dates[:-k] == np.timedelta64(k, 'D'))
+        return valid
+
+    def shifted(values, k):
+        values_shifted = np.full(n, np.nan)
+        values_shifted[k:] = values[:-k]
+        return values_shifted
+
+    features = {}
+    for days in ROLLING_WINDOWS:
+        total = precipitation.astype(np.float64)
+        for k in range(1, days):
+            total = total + shifted(precipitation, k)
+        features[f"precipitation_sum_{days}d"] = np.where(lag_valid(days - 1), total, np.nan)
+    for days in ROLLING_WINDOWS:
+        delta = temperature - shifted(temperature, days)
+        features[f"temperature_min_delta_{days}d"] = np.where(lag_valid(days), delta, np.nan)
+    return features
+
+def add_rolling_features(df, context = None, date_column = 'date'):
+    """
+    Add the rolling features to the days of df. context holds previous days of the same locations (with a 'date' column),
+    only used as the start of the windows: ROLLING_CONTEXT_DAYS days before the first day of df are enough.
+    Training and inference go through this function, so historical and forecast days get the same features.
+    df must have one row per location and day, a ValueError is raised otherwise.
+    """
+
+    columns = ['location_id', 'date', 'precipitation_sum', 'temperature_min']
+    frame = df.rename(columns = {date_column: 'date'})[columns].assign(is_target = True, position = np.arange(len(df)))
+    frame['date'] = pd.to_datetime(frame['date']).dt.normalize()
+
+    # a day of df kept twice would have a single row of features for both
+    duplicated = frame.duplicated(subset = ['location_id', 'date'])
+    if duplicated.any():
+        raise ValueError(f"{duplicated.sum()} duplicate (location_id, {date_column}) rows, the rolling features need one row "
+                         "per location and day")
+
+    if context is not None and not context.empty:
+        frame = pd.concat([context[columns].assign(is_target = False, position = -1), frame], ignore_index = True)
+
+    # one row per location and day, the days of df win over the context
+    frame['date'] = pd.to_datetime(frame['date']).dt.normalize()
+    frame = frame.drop_duplicates(subset = ['location_id', 'date'], keep = 'last')
+    frame = frame.sort_values(by = ['location_id', 'date'], kind = 'stable')
+
+    features = rolling_window_features(frame['location_id'].to_numpy(), frame['date'].to_numpy(),
+                                       frame['precipitation_sum'].to_numpy(dtype = np.float64),
+                                       frame['temperature_min'].to_numpy(dtype = np.float64))
+
+    # back to the order of df
+    target = frame['is_target'].to_numpy()
+    order = np.empty(len(df), dtype = np.int64)
+    order[frame['position'].to_numpy()[target]] = np.arange(target.sum())
+
+    df = df.copy(deep = False)
+    for name, values in features.items():
+        df[name] = values[target][order].astype(np.float32)
+    return df
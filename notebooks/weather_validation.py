@@ -0,0 +1,269 @@
+"""
+Validation of the fetched weather days, before they reach the feature store and the history store.
+All the row checks run as NumPy masks over the whole batch, with one sort for the duplicates and the gaps:
+- missing values: days not available yet in Open-Meteo;
+- value ranges of the measurements, passed in by the caller (VALIDATION_RANGES of config.py);
+- WMO weather codes that are not in weather_code_mapping.csv;
+- duplicate days of a location (primary key FG_HISTORY_PK), the first one is kept.
+Failing days are not inserted but quarantined, with the checks they failed, and the batch goes on with the others.
+They are not in the history store either, so they are queried again, after a backoff: retry_days after the first
+failure, doubled at each new failure up to max_retry_days (QUARANTINE_RETRY_DAYS and QUARANTINE_MAX_RETRY_DAYS of
+config.py). A day Open-Meteo does not have yet is queried again the next day, a day that is permanently invalid is not
+fetched again by every run. The quarantine is compacted before the fetches: the days that have since landed in the
+store and the days not quarantined again within max_retry_days are forgotten.
+Date gaps (days missing between the days of a location, in the batch and the store) are reported rather than
+quarantined: the days around a gap are valid, and the missing days are queried again too.
+
+    quarantine = Quarantine('../quarantine', retry_days = 1, max_retry_days = 32)
+    quarantine.compact(store)
+    df_weather = fetch_missing_history(..., held = quarantine.held_ranges())
+    validation = validate_weather_days(df_weather, VALIDATION_RANGES, store)
+    quarantine.add(validation.rejected)
+"""
+
+import os
+import uuid
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from weather_codes import NO_CODE, wmo_to_weather_codes
+
+ONE_DAY = np.timedelta64(1, 'D')
+
+# Columns of a fetched day that must not be missing, besides the measurements with a value range
+KEY_COLUMNS = ['location_id', 'date', 'weather_code_wmo']
+
+Validation = namedtuple('Validation', ['valid', 'rejected', 'gaps', 'counts'])
+
+def check_bits(validation_ranges):
+    """
+    Checks of the rows, one bit of the failure mask each
+    """
+
+    checks = ['missing', 'unknown_weather_code'] + [f"{column}_range" for column in validation_ranges] + ['duplicate']
+    return {name: np.uint16(1 << i) for i, name in enumerate(checks)}
+
+def check_names(failures, bits):
+    """
+    Comma-separated names of the checks failed by each row, from the failure masks
+    """
+
+    masks, inverse = np.unique(failures, return_inverse = True)
+    names = np.array([','.join(name for name, bit in bits.items() if mask & bit) for mask in masks], dtype = object)
+    return names[inverse]
+
+def day_keys(location_codes, days):
+    """
+    Sortable int64 keys of (location code, day) pairs
+    """
+
+    return (location_codes.astype(np.int64) << 32) + days.astype(np.int64) + (1 << 31)
+
+def last_stored_days(store, location_ids, location_codes, days):
+    """
+    Last day in the store before each day of its location, NaT if there is none. The ranges of the store are looked up
+    once per location, and all the days are searched at once in the ranges of all the locations.
+    """
+
+    last = np.full(len(days), np.datetime64('NaT'), dtype = 'datetime64[D]')
+    codes = np.unique(location_codes)
+    ranges = [np.array(store.present_ranges(location_ids[code]), dtype = 'datetime64[D]').reshape(-1, 2) for code in codes]
+    range_codes = np.repeat(codes, [len(location_ranges) for location_ranges in ranges])
+    if len(range_codes) == 0:
+        return last
+    starts, ends = np.concatenate(ranges).T
+
+    # last range of the location starting before the day: the store days before the day end with it
+    i = np.searchsorted(day_keys(range_codes, starts), day_keys(location_codes, days)) - 1
+    found = (i >= 0) & (range_codes[np.maximum(i, 0)] == location_codes)
+    last[found] = np.minimum(ends[i[found]], days[found] - ONE_DAY)
+    return last
+
+def find_gaps(location_codes, location_ids, days, store = None):
+    """
+    Ranges of days missing before the days of each location, the days being sorted by location code and day and
+    location_ids the location of each code. A day whose previous day is not in the batch nor in the store follows
+    a gap, unless the location has no earlier day at all.
+    """
+
+    n = len(days)
+    same_location = np.zeros(n, dtype = bool)
+    same_location[1:] = location_codes[1:] == location_codes[:-1]
+    previous = np.full(n, np.datetime64('NaT'), dtype = 'datetime64[D]')
+    previous[1:] = days[:-1]
+    previous[~same_location] = np.datetime64('NaT')
+
+    # only the first day of each location and the days after a break can follow a gap
+    candidates = np.flatnonzero(~same_location | (days - previous > ONE_DAY))
+    candidate_codes, candidate_days, last = location_codes[candidates], days[candidates], previous[candidates]
+    if store is not None and len(candidates):
+        last = np.fmax(last, last_stored_days(store, location_ids, candidate_codes, candidate_days))
+
+    gap = ~np.isnat(last) & (candidate_days - last > ONE_DAY)
+    return pd.DataFrame({
+        'location_id': location_ids[candidate_codes[gap]],
+        'start': (last[gap] + ONE_DAY).astype('datetime64[ns]'),
+        'end': (candidate_days[gap] - ONE_DAY).astype('datetime64[ns]'),
+    })
+
+def validate_weather_days(df, validation_ranges, store = None):
+    """
+    Split the fetched days into the valid ones and the rejected ones, the latter with a failed_checks column.
+    validation_ranges maps each measurement to its (low, high) plausible values, both ends included.
+    Gaps are looked for in the valid days and, if a store is given, in the stored days before them.
+    Return the valid days, the rejected ones, the gaps and the number of rows failing each check.
+    """
+
+    n = len(df)
+    bits = check_bits(validation_ranges)
+    failures = np.zeros(n, dtype = np.uint16)
+
+    # Missing values, and rows without one of the columns
+    missing = np.zeros(n, dtype = bool)
+    for column in KEY_COLUMNS + list(validation_ranges):
+        missing |= df[column].isna().to_numpy() if column in df.columns else True
+    failures[missing] |= bits['missing']
+
+    # WMO codes in the mapping (missing ones already fail above)
+    if 'weather_code_wmo' in df.columns:
+        wmo_codes = df['weather_code_wmo'].to_numpy(dtype = np.float64, na_value = np.nan)
+        unknown = (wmo_to_weather_codes(wmo_codes) == NO_CODE) & ~np.isnan(wmo_codes)
+        failures[unknown] |= bits['unknown_weather_code']
+
+    # Value ranges, both ends included (NaN compares False)
+    for column, (low, high) in validation_ranges.items():
+        if column in df.columns:
+            values = df[column].to_numpy(dtype = np.float64, na_value = np.nan)
+            failures[(values < low) | (values > high)] |= bits[f"{column}_range"]
+
+    # Duplicate days of a location: one stable sort by (location, day), the first occurrence is kept
+    location_codes, location_ids = pd.factorize(df['location_id'] if 'location_id' in df.columns else np.zeros(n))
+    days = pd.to_datetime(df['date']).to_numpy().astype('datetime64[D]') if 'date' in df.columns \
+        else np.full(n, np.datetime64('NaT'), dtype = 'datetime64[D]')
+    day_numbers = np.where(np.isnat(days), 0, days.astype(np.int64))
+    keys = (location_codes.astype(np.int64) << 32) + day_numbers - day_numbers.min(initial = 0)
+    order = np.argsort(keys, kind = 'stable')
+    duplicate = np.zeros(n, dtype = bool)
+    duplicate[order[1:]] = keys[order[1:]] == keys[order[:-1]]
+    failures[duplicate & ~missing] |= bits['duplicate']
+
+    rejected = failures != 0
+    order = order[~rejected[order]]
+    gaps = find_gaps(location_codes[order], np.asarray(location_ids).astype(str), days[order], store)
+
+    counts = {name: int(np.count_nonzero(failures & bit)) for name, bit in bits.items()}
+    counts['gap_days'] = int(((gaps['end'] - gaps['start']).dt.days + 1).sum()) if len(gaps) else 0
+
+    metrics.incr('validation_rows_total', n)
+    for name, count in counts.items():
+        if count:
+            metrics.incr('validation_failures_total', count, check = name)
+
+    df_rejected = df[rejected].assign(failed_checks = check_names(failures[rejected], bits))
+    return Validation(df[~rejected], df_rejected, gaps, counts)
+
+class Quarantine:
+    """
+    Rejected days, one Parquet file per validated batch. Files are named by time, process and a random suffix,
+    so worker processes can quarantine at the same time. A day quarantined n times is held from the fetches
+    retry_days * 2^(n-1) days after its last quarantine, at most max_retry_days.
+    """
+
+    def __init__(self, path, retry_days, max_retry_days):
+        self.path = path
+        self.retry_days = retry_days
+        self.max_retry_days = max_retry_days
+
+    def files(self):
+        """
+        Quarantine files, oldest first
+        """
+
+        names = sorted(os.listdir(self.path)) if os.path.isdir(self.path) else []
+        return [os.path.join(self.path, name) for name in names if name.endswith('.parquet')]
+
+    def write(self, df):
+        now = datetime.now(timezone.utc)
+        os.makedirs(self.path, exist_ok = True)
+        path = os.path.join(self.path, f"{now:%Y%m%dT%H%M%S}-{os.getpid()}-{uuid.uuid4().hex[:8]}.parquet")
+        df.to_parquet(path + '.tmp', index = False)
+        os.replace(path + '.tmp', path)
+        return path
+
+    def add(self, df_rejected):
+        """
+        Write the rejected days with the time they were quarantined, return the file path
+        """
+
+        if df_rejected.empty:
+            return None
+        return self.write(df_rejected.assign(quarantined = pd.Timestamp(datetime.now(timezone.utc)).tz_localize(None)))
+
+    def read(self, paths = None):
+        """
+        All the quarantined days, oldest first
+        """
+
+        dfs = [pd.read_parquet(path) for path in (paths if paths is not None else self.files())]
+        return pd.concat(dfs, ignore_index = True) if dfs else pd.DataFrame()
+
+    def compact(self, store = None, as_of = None):
+        """
+        Rewrite the quarantine as one file, forgetting the days now in the store and the days not quarantined again
+        within max_retry_days of their last quarantine (a day failing again after that starts its backoff over).
+        Files added while compacting are kept as they are. Run it in one process, not in the workers.
+        Return the number of rows forgotten.
+        """
+
+        paths = self.files()
+        df = self.read(paths)
+        if df.empty:
+            return 0
+
+        # days without a location or a date are never held, they are forgotten too
+        n_rows = len(df)
+        df = df.dropna(subset = ['location_id', 'date'])
+        dates = pd.to_datetime(df['date']).dt.normalize()
+        last = df.assign(date = dates).groupby(['location_id', 'date'])['quarantined'].transform('max')
+        as_of = pd.Timestamp(as_of if as_of is not None else datetime.now(timezone.utc).date())
+        keep = (last.dt.normalize() + pd.Timedelta(days = self.max_retry_days) >= as_of).to_numpy()
+
+        if store is not None:
+            location_codes, location_ids = pd.factorize(df['location_id'].astype(str))
+            days = dates.to_numpy().astype('datetime64[D]')
+            stored = last_stored_days(store, np.asarray(location_ids), location_codes, days + ONE_DAY)
+            keep = keep & (stored != days)
+
+        if keep.all() and len(df) == n_rows and len(paths) == 1:
+            return 0
+        if keep.any():
+            self.write(df[keep])
+        for path in paths:
+            os.remove(path)
+        return n_rows - int(keep.sum())
+
+    def held_ranges(self, as_of = None):
+        """
+        Date ranges of each location not to query yet on as_of (today by default)
+        """
+
+        df = self.read()
+        if df.empty:
+            return {}
+
+        # one attempt per batch a day was quarantined in (duplicates of a day are rejected with the day itself)
+        df = df[['location_id', 'date', 'quarantined']].dropna().drop_duplicates()
+        df['date'] = pd.to_datetime(df['date']).dt.normalize()
+        attempts = df.groupby(['location_id', 'date'])['quarantined'].agg(['size', 'max'])
+
+        backoff_days = np.minimum(self.retry_days * 2.0 ** (attempts['size'].to_numpy() - 1), self.max_retry_days)
+        retry_on = attempts['max'].dt.normalize() + pd.to_timedelta(backoff_days, unit = 'D')
+        as_of = pd.Timestamp(as_of if as_of is not None else datetime.now(timezone.utc).date())
+        held = attempts.index[(retry_on > as_of).to_numpy()].to_frame(index = False)
+
+        from weather_store import dates_to_ranges
+        return {str(location_id): dates_to_ranges(group['date']) for location_id, group in held.groupby('location_id')}
@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules are imported as the notebooks and the pipeline runner import them
+sys.path[:0] = [os.path.join(ROOT_DIR, 'notebooks'), ROOT_DIR]
@@ -0,0 +1,44 @@
+"""
+Published forecast rows: only new or changed rows are published again, and the rows of past forecast days are
+forgotten, whatever the position of the forecast date in the primary key.
+"""
+
+import pandas as pd
+
+from config import FG_FORECAST_PK
+from forecast_cache import PublishedRows
+
+def forecasts(prediction_date, location_ids = ('stockholm', 'malmo'), n_days = 3):
+    prediction_date = pd.Timestamp(prediction_date)
+    forecast_dates = pd.date_range(prediction_date, periods = n_days)
+    return pd.DataFrame({
+        'location_id': [location_id for location_id in location_ids for _ in forecast_dates],
+        'forecast_date': list(forecast_dates) * len(location_ids),
+        'prediction_date': prediction_date,
+        'weather_code': 3,
+    })
+
+def test_past_forecast_days_are_pruned(tmp_path):
+    published = PublishedRows(FG_FORECAST_PK, str(tmp_path / 'published.joblib'))
+    for prediction_date in ['2024-03-10', '2024-03-11']:
+        df = forecasts(prediction_date)
+        df_delta = published.delta(df)
+        assert len(df_delta) == len(df)
+        published.mark_published(df_delta, keep_since = pd.Timestamp(prediction_date).date())
+
+    # the forecast days before the last prediction date are forgotten, the others kept
+    position = FG_FORECAST_PK.index('forecast_date')
+    forecast_dates = {key[position] for key in published.hashes}
+    assert min(pd.to_datetime(list(forecast_dates))) == pd.Timestamp('2024-03-11')
+    assert len(published.hashes) == len(forecasts('2024-03-10')) + 2 * 2
+
+    # unchanged rows are not published again
+    published.save()
+    reloaded = PublishedRows.load(published.path, FG_FORECAST_PK)
+    assert reloaded.delta(forecasts('2024-03-11')).empty
+
+def test_numeric_location_ids_are_kept():
+    published = PublishedRows(FG_FORECAST_PK)
+    df = forecasts('2024-03-10', location_ids = (1, 2))
+    published.mark_published(df, keep_since = pd.Timestamp('2024-03-10').date())
+    assert len(published.hashes) == len(df)
@@ -0,0 +1,25 @@
+"""
+Prometheus export of the metrics: every family is typed once, its samples together after its TYPE line.
+"""
+
+import metrics
+
+def test_families_are_contiguous():
+    metrics.reset()
+    metrics.enable()
+    try:
+        for stage in ['fetch', 'predict']:
+            metrics.observe('stage_seconds', 0.5, stage = stage)
+            metrics.incr('rows_total', 10, stage = stage)
+        text = metrics.prometheus_text()
+    finally:
+        metrics.disable()
+        metrics.reset()
+
+    families = []
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            families.append(line.split()[2])
+            continue
+        assert line.split('{')[0] in (families[-1], families[-1] + '_count', families[-1] + '_sum')
+    assert families == ['rows_total', 'stage_seconds', 'stage_seconds_max']
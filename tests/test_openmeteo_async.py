@@ -0,0 +1,126 @@
+"""
+Asynchronous Open-Meteo client against the local fake server: shared response cache, coalescing, request budget
+and retries, without blocking the event loop on SQLite.
+"""
+
+import asyncio
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+from openmeteo_requests.Client import OpenMeteoRequestsError
+
+from openmeteo_async import AsyncOpenMeteo, OpenMeteoClient
+from pipeline.fake_openmeteo import FakeOpenMeteoServer
+from weather_utils import WEATHER_SCHEMA, daily_variables, fetch_locations
+
+def history_params(n_locations = 1, end_date = '2024-01-31'):
+    return {
+        "latitude": list(np.linspace(55, 60, n_locations).round(4)),
+        "longitude": list(np.linspace(11, 18, n_locations).round(4)),
+        "daily": daily_variables(WEATHER_SCHEMA),
+        "timezone": 'Europe/Berlin',
+        "start_date": '2024-01-01',
+        "end_date": end_date,
+    }
+
+@pytest.fixture
+def server():
+    with FakeOpenMeteoServer() as server:
+        yield server
+
+def test_responses_are_cached_across_clients(server, tmp_path):
+    locations = pd.DataFrame({'location_id': ['a', 'b', 'c'], 'latitude': [55.6, 57.7, 59.3], 'longitude': [13.0, 12.0, 18.1]})
+    params = {key: value for key, value in history_params().items() if key not in ('latitude', 'longitude')}
+
+    client = OpenMeteoClient(cache_path = str(tmp_path / 'cache.sqlite'))
+    df = fetch_locations(client, server.url, locations, params, chunk_size = 2)
+    assert server.n_requests == 2
+    assert len(df) == 3 * 31
+
+    # the same fetch is served by the cache, also to another client sharing the file
+    other_client = OpenMeteoClient(cache_path = str(tmp_path / 'cache.sqlite'))
+    pd.testing.assert_frame_equal(fetch_locations(client, server.url, locations, params, chunk_size = 2), df)
+    pd.testing.assert_frame_equal(fetch_locations(other_client, server.url, locations, params, chunk_size = 2), df)
+    assert server.n_requests == 2
+    assert client.stats['hits'] == 2 and other_client.stats['hits'] == 2
+    client.close()
+    other_client.close()
+
+def test_identical_requests_are_coalesced(tmp_path):
+    async def run():
+        client = AsyncOpenMeteo(cache_path = str(tmp_path / 'cache.sqlite'))
+        try:
+            return await asyncio.gather(*[client.weather_api(server.url, history_params()) for _ in range(5)]), client.stats
+        finally:
+            await client.close()
+
+    with FakeOpenMeteoServer(latency = 0.2) as server:
+        responses, stats = asyncio.run(run())
+    assert server.n_requests == 1
+    assert stats['misses'] == 1 and stats['coalesced'] == 4
+    assert all(len(location_responses) == 1 for location_responses in responses)
+
+def test_request_budget_throttles_requests(server, tmp_path):
+    async def run():
+        # 2 calls per second, the first request of 120 locations spends the whole bucket
+        client = AsyncOpenMeteo(cache_path = str(tmp_path / 'cache.sqlite'), rate_per_minute = 120)
+        try:
+            await client.weather_api(server.url, history_params(n_locations = 120))
+            start = time.perf_counter()
+            await client.weather_api(server.url, history_params(end_date = '2024-01-30'))
+            return time.perf_counter() - start
+        finally:
+            await client.close()
+
+    assert asyncio.run(run()) >= 0.4
+
+def test_sqlite_lock_does_not_block_the_event_loop(server, tmp_path):
+    cache_path = str(tmp_path / 'cache.sqlite')
+
+    async def run(blocker):
+        client = AsyncOpenMeteo(cache_path = cache_path)
+        try:
+            await client.weather_api(server.url, history_params())
+
+            # another process holds the write lock: the uncached request waits for the budget in a worker thread
+            blocker.execute("BEGIN IMMEDIATE")
+            waiting = asyncio.ensure_future(client.weather_api(server.url, history_params(end_date = '2024-01-30')))
+            await asyncio.sleep(0.1)
+
+            # while the cached request is served by the event loop
+            start = time.perf_counter()
+            await asyncio.wait_for(client.weather_api(server.url, history_params()), timeout = 2)
+            cached_seconds = time.perf_counter() - start
+            assert not waiting.done()
+
+            blocker.execute("COMMIT")
+            await asyncio.wait_for(waiting, timeout = 5)
+            return cached_seconds
+        finally:
+            await client.close()
+
+    blocker = sqlite3.connect(cache_path, isolation_level = None)
+    try:
+        assert asyncio.run(run(blocker)) < 1
+    finally:
+        blocker.close()
+
+def test_failed_requests_are_retried(tmp_path):
+    async def run(retries):
+        client = AsyncOpenMeteo(cache_path = str(tmp_path / f"cache_{retries}.sqlite"), retries = retries, backoff_factor = 0.01)
+        try:
+            return await client.weather_api(server.url, history_params())
+        finally:
+            await client.close()
+
+    with FakeOpenMeteoServer(failures = 2) as server:
+        assert len(asyncio.run(run(retries = 2))) == 1
+    assert server.n_requests == 3
+
+    with FakeOpenMeteoServer(failures = 2) as server:
+        with pytest.raises(OpenMeteoRequestsError):
+            asyncio.run(run(retries = 1))
+    assert server.n_requests == 2
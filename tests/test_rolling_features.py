@@ -0,0 +1,38 @@
+"""
+Rolling features: one row per location and day, and the same features whether a day is computed with the whole
+history or with the trailing days of the store only.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from weather_store import HistoryStore, refresh_rolling_features
+from weather_utils import ROLLING_FEATURES, add_rolling_features
+
+def weather_days(location_ids, start, n_days, seed = 0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, periods = n_days)
+    return pd.DataFrame({
+        'location_id': np.repeat(location_ids, n_days),
+        'date': np.tile(dates, len(location_ids)),
+        'precipitation_sum': rng.gamma(0.6, 3, n_days * len(location_ids)).astype(np.float32),
+        'temperature_min': rng.normal(5, 8, n_days * len(location_ids)).astype(np.float32),
+    })
+
+def test_duplicate_days_are_rejected():
+    df = weather_days(['stockholm', 'malmo'], '2024-01-01', 10)
+    with pytest.raises(ValueError, match = 'duplicate'):
+        add_rolling_features(pd.concat([df, df.iloc[[3]]], ignore_index = True))
+
+def test_trailing_window_matches_the_whole_history(tmp_path):
+    df = weather_days(['stockholm', 'malmo'], '2024-01-01', 40)
+    new = df['date'] >= '2024-02-01'
+
+    store = HistoryStore(str(tmp_path / 'history'), key = ['location_id', 'date'])
+    store.append(add_rolling_features(df[~new]))
+    df_days = refresh_rolling_features(store, df[new].reset_index(drop = True))
+
+    expected = add_rolling_features(df)[new].set_index(['location_id', 'date'])[ROLLING_FEATURES]
+    actual = df_days.set_index(['location_id', 'date']).loc[expected.index, ROLLING_FEATURES]
+    np.testing.assert_array_equal(actual.to_numpy(dtype = np.float32), expected.to_numpy(dtype = np.float32))
@@ -0,0 +1,90 @@
+"""
+Offline runs of the sharded pipeline: every location of every shard must reach the feature groups,
+one row per location and day, and the metrics recorded by the worker processes must reach the run report.
+"""
+
+import os
+from functools import partial
+
+import pandas as pd
+import pytest
+
+import metrics
+from config import FG_FORECAST_NAME, FG_FORECAST_PK, FG_FORECAST_V, FG_HISTORY_NAME, FG_HISTORY_PK, FG_HISTORY_V, HISTORY_LOOKBACK_DAYS
+from pipeline import sharded, stages
+from pipeline.context import PipelineContext
+from pipeline.fake_openmeteo import FakeOpenMeteo
+from pipeline.local import LocalProject
+
+LOCATIONS = pd.DataFrame({
+    'location_id': ['stockholm', 'gothenburg', 'malmo'],
+    'location_name': ['Stockholm', 'Gothenburg', 'Malmö'],
+    'latitude': [59.3294, 57.7089, 55.6050],
+    'longitude': [18.0687, 11.9746, 13.0038],
+})
+
+TODAY = pd.Timestamp('2024-03-10').date()
+
+@pytest.fixture
+def ctx(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / 'resources')
+    LOCATIONS.to_csv(tmp_path / 'resources' / 'locations.csv', index = False)
+
+    # the trained model is written to the temporary folder, not to the model of the repository
+    monkeypatch.setattr(stages, 'MODEL_DIR', str(tmp_path / 'model'))
+
+    project = LocalProject(str(tmp_path / 'local_project'), str(tmp_path / 'model_registry'))
+    return PipelineContext(project = project, openmeteo_factory = partial(FakeOpenMeteo, today = TODAY), today = TODAY,
+                           offline = True, root_dir = str(tmp_path))
+
+def feature_group(ctx, name, version):
+    return ctx.fs.get_or_create_feature_group(name = name, version = version).read()
+
+def test_every_location_reaches_the_feature_groups(ctx):
+    sharded.run_sharded_pipeline(ctx, shard_size = 1, max_workers = 2)
+
+    n_locations = len(LOCATIONS)
+    df_history = feature_group(ctx, FG_HISTORY_NAME, FG_HISTORY_V)
+    assert len(df_history) == n_locations * HISTORY_LOOKBACK_DAYS
+    assert not df_history.duplicated(subset = FG_HISTORY_PK).any()
+    assert df_history.groupby('location_id').size().to_dict() == dict.fromkeys(LOCATIONS['location_id'], HISTORY_LOOKBACK_DAYS)
+
+    df_forecasts = feature_group(ctx, FG_FORECAST_NAME, FG_FORECAST_V)
+    assert len(df_forecasts) == n_locations * 14
+    assert not df_forecasts.duplicated(subset = FG_FORECAST_PK).any()
+    assert set(df_forecasts['location_id']) == set(LOCATIONS['location_id'])
+
+def test_sharded_run_matches_the_sequential_run(ctx, tmp_path):
+    sharded.run_sharded_pipeline(ctx, stages = ('feature',), shard_size = 1, max_workers = 2)
+    df_sharded = feature_group(ctx, FG_HISTORY_NAME, FG_HISTORY_V)
+
+    project = LocalProject(str(tmp_path / 'sequential_project'), str(tmp_path / 'model_registry'))
+    sequential = PipelineContext(project = project, openmeteo_factory = ctx.openmeteo_factory, today = TODAY,
+                                 offline = True, root_dir = str(tmp_path / 'sequential'))
+    sequential._locations = LOCATIONS
+    stages.run_pipeline(sequential, stages = ('feature',))
+    df_sequential = feature_group(sequential, FG_HISTORY_NAME, FG_HISTORY_V)
+
+    columns = ['location_id', 'date', 'weather_code', 'temperature_min']
+    pd.testing.assert_frame_equal(df_sharded[columns].sort_values(FG_HISTORY_PK, ignore_index = True),
+                                  df_sequential[columns].sort_values(FG_HISTORY_PK, ignore_index = True))
+
+def test_worker_metrics_are_merged(ctx):
+    metrics.reset()
+    metrics.enable()
+    try:
+        sharded.run_sharded_pipeline(ctx, shard_size = 1, max_workers = 2)
+        series = {(row['name'], tuple(sorted(row['labels'].items()))): row for row in metrics.series()}
+    finally:
+        metrics.disable()
+        metrics.reset()
+
+    # recorded by the ingest shards: one history and one forecast request per location, every fetched day validated
+    n_locations = len(LOCATIONS)
+    assert series[('openmeteo_requests_total', ())]['value'] == 2 * n_locations
+    assert series[('validation_rows_total', ())]['value'] == n_locations * HISTORY_LOOKBACK_DAYS
+    assert series[('openmeteo_request_seconds', ())]['count'] == 2 * n_locations
+
+    # recorded by the inference shards, and by the joins in this process
+    assert series[('predicted_rows_total', ())]['value'] == n_locations * 14
+    assert series[('feature_group_rows_total', (('feature_group', FG_HISTORY_NAME),))]['value'] == n_locations * HISTORY_LOOKBACK_DAYS
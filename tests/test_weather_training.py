@@ -0,0 +1,62 @@
+"""
+Incremental training: the new trees are fitted on a trailing window of days, and models are ranked on one holdout,
+their metrics cached by model version and holdout days.
+"""
+
+import numpy as np
+import pandas as pd
+from xgboost import XGBRegressor
+
+from weather_evaluation import EvaluationCache
+from weather_training import continue_training, rank_models
+
+def synthetic_data(n_rows = 400, seed = 0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size = (n_rows, 4))
+    y = np.clip(np.round(6 + 2 * X[:, 0] - X[:, 1] + rng.normal(scale = 0.5, size = n_rows)), 1, 13)
+    return X, y
+
+def test_continue_training_adds_rounds_to_a_copy():
+    X, y = synthetic_data()
+    model = XGBRegressor(n_estimators = 20, max_depth = 3).fit(X, y)
+    updated_model = continue_training(model, X[-100:], y[-100:], n_rounds = 5)
+    assert updated_model.get_booster().num_boosted_rounds() == 25
+    assert model.get_booster().num_boosted_rounds() == 20
+    assert continue_training(model, X[:0], y[:0], n_rounds = 5) is model
+
+def test_models_are_ranked_on_the_same_holdout():
+    X, y = synthetic_data()
+    X_holdout, y_holdout = synthetic_data(seed = 1)
+    weak = XGBRegressor(n_estimators = 2, max_depth = 1).fit(X, y)
+    strong = XGBRegressor(n_estimators = 50, max_depth = 3).fit(X, y)
+
+    ranked = rank_models([('weak', weak), ('strong', strong)], X_holdout, y_holdout, 'MSE', 'min')
+    assert [name for _, name, _ in ranked] == ['strong', 'weak']
+    assert ranked[0][0]['MSE'] < ranked[1][0]['MSE']
+    assert [name for _, name, _ in rank_models([('weak', weak), ('strong', strong)], X_holdout, y_holdout, 'MSE', 'max')] \
+        == ['weak', 'strong']
+
+def test_ranking_metrics_are_cached_by_model_and_holdout_days(tmp_path):
+    X, y = synthetic_data()
+    X_holdout, y_holdout = synthetic_data(seed = 1)
+    candidates = [('weak', XGBRegressor(n_estimators = 2, max_depth = 1).fit(X, y)),
+                  ('strong', XGBRegressor(n_estimators = 50, max_depth = 3).fit(X, y))]
+    holdout = (pd.Timestamp('2024-03-01'), pd.Timestamp('2024-03-14'))
+    path = str(tmp_path / 'evaluations.joblib')
+
+    cache = EvaluationCache.load(path)
+    ranked = rank_models(candidates, X_holdout, y_holdout, 'MSE', 'min', holdout = holdout, cache = cache)
+    assert cache.stats == {'hits': 0, 'misses': 2}
+
+    # the same models on the same days, from the saved cache: nothing is scored again
+    cache = EvaluationCache.load(path)
+    assert rank_models(candidates, X_holdout, y_holdout, 'MSE', 'min', holdout = holdout, cache = cache) == ranked
+    assert cache.stats == {'hits': 2, 'misses': 0}
+
+    # the holdout moved by a day: both models are scored again
+    next_holdout = (holdout[0] + pd.Timedelta(days = 1), holdout[1] + pd.Timedelta(days = 1))
+    rank_models(candidates, X_holdout, y_holdout, 'MSE', 'min', holdout = next_holdout, cache = cache)
+    assert cache.stats == {'hits': 2, 'misses': 2}
+
+    # only the metrics are kept
+    assert all(set(metrics) == set(ranked[0][0]) for metrics in cache.entries.values())
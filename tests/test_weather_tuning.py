@@ -0,0 +1,31 @@
+"""
+Hyperparameter search: early stopping must not look at the scored validation rows, and the number of trees
+of the best candidate must stay within the configured range.
+"""
+
+import numpy as np
+
+from weather_tuning import make_folds, tune_hyperparameters
+
+def synthetic_data(n_rows = 400, seed = 0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size = (n_rows, 4))
+    y = np.clip(np.round(6 + 2 * X[:, 0] - X[:, 1] + rng.normal(scale = 0.5, size = n_rows)), 1, 13)
+    return X, y
+
+def test_early_stopping_rows_are_split_from_the_training_rows():
+    X, y = synthetic_data()
+    for dtrain, dstop, dvalid in make_folds(X, y, n_folds = 4, early_stopping_fraction = 0.1):
+        assert dvalid.num_row() == len(X) // 4
+        assert dstop.num_row() == round(0.1 * (len(X) - dvalid.num_row()))
+        assert dtrain.num_row() + dstop.num_row() + dvalid.num_row() == len(X)
+
+def test_n_estimators_stays_within_the_range():
+    X, y = synthetic_data()
+    params = {'learning_rate': [0.3], 'n_estimators': [50, 100, 200], 'max_depth': [3]}
+
+    # early stopping halts after a few rounds at this learning rate, below the smallest n_estimators
+    best_params, cv_mse, df_trials = tune_hyperparameters(X, y, params, n_iter = 3, n_folds = 3, early_stopping_rounds = 2)
+    assert df_trials['n_rounds'].max() < 50
+    assert best_params['n_estimators'] == 50
+    assert np.isfinite(cv_mse)
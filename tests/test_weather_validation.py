@@ -0,0 +1,81 @@
+"""
+Quarantine of the days failing validation: a day is held from the fetches until its retry, the wait doubling at each
+new failure, the held days are not queried again, and the days stored since or not failing again are forgotten.
+Gaps are the days missing between the fetched days and the stored ones.
+"""
+
+import numpy as np
+import pandas as pd
+
+from weather_store import HistoryStore, subtract_ranges
+from weather_validation import Quarantine, find_gaps
+
+def rejected_days(location_id, dates):
+    return pd.DataFrame({'location_id': location_id, 'date': pd.to_datetime(dates), 'failed_checks': 'missing'})
+
+def test_retry_backs_off_at_each_failure(tmp_path):
+    quarantine = Quarantine(str(tmp_path / 'quarantine'), retry_days = 1, max_retry_days = 3)
+    today = pd.Timestamp.now(tz = 'UTC').tz_localize(None).normalize()
+
+    # one failure: held today only, queried again tomorrow
+    quarantine.add(rejected_days('stockholm', ['2024-01-01', '2024-01-02', '2024-01-05']))
+    held = quarantine.held_ranges(as_of = today)
+    assert held == {'stockholm': [(np.datetime64('2024-01-01'), np.datetime64('2024-01-02')),
+                                  (np.datetime64('2024-01-05'), np.datetime64('2024-01-05'))]}
+    assert quarantine.held_ranges(as_of = today + pd.Timedelta(days = 1)) == {}
+
+    # failing again, then again: 2 then 3 days (capped) after the last failure
+    for n_days in [2, 3, 3]:
+        quarantine.add(rejected_days('stockholm', ['2024-01-05']))
+        assert quarantine.held_ranges(as_of = today + pd.Timedelta(days = n_days - 1)) \
+            == {'stockholm': [(np.datetime64('2024-01-05'), np.datetime64('2024-01-05'))]}
+        assert quarantine.held_ranges(as_of = today + pd.Timedelta(days = n_days)) == {}
+
+def test_held_days_are_not_fetched():
+    day = lambda text: np.datetime64(text, 'D')
+    missing = [(day('2024-01-01'), day('2024-01-10')), (day('2024-01-20'), day('2024-01-21'))]
+    held = [(day('2023-12-30'), day('2024-01-02')), (day('2024-01-05'), day('2024-01-05')), (day('2024-01-20'), day('2024-01-21'))]
+    assert subtract_ranges(missing, held) == [(day('2024-01-03'), day('2024-01-04')), (day('2024-01-06'), day('2024-01-10'))]
+    assert subtract_ranges(missing, []) == missing
+
+def test_stored_and_stale_days_are_forgotten(tmp_path):
+    quarantine = Quarantine(str(tmp_path / 'quarantine'), retry_days = 1, max_retry_days = 3)
+    today = pd.Timestamp.now(tz = 'UTC').tz_localize(None).normalize()
+    quarantine.add(rejected_days('stockholm', ['2024-01-01', '2024-01-02']))
+    quarantine.add(rejected_days('malmo', ['2024-01-01']))
+
+    # nothing stored yet: both files are rewritten as one, nothing is forgotten
+    store = HistoryStore(str(tmp_path / 'history'), key = ['location_id', 'date'])
+    assert quarantine.compact(store, as_of = today) == 0
+    assert len(quarantine.files()) == 1
+    assert quarantine.compact(store, as_of = today) == 0
+
+    # a day landing in the store is forgotten, the other days stay held
+    store.append(pd.DataFrame({'location_id': ['stockholm'], 'date': pd.to_datetime(['2024-01-02'])}))
+    assert quarantine.compact(store, as_of = today) == 1
+    assert quarantine.held_ranges(as_of = today) == {'malmo': [(np.datetime64('2024-01-01'), np.datetime64('2024-01-01'))],
+                                                     'stockholm': [(np.datetime64('2024-01-01'), np.datetime64('2024-01-01'))]}
+
+    # days not quarantined again within max_retry_days are forgotten
+    assert quarantine.compact(store, as_of = today + pd.Timedelta(days = 4)) == 2
+    assert quarantine.files() == []
+
+def test_gaps_span_the_batch_and_the_store(tmp_path):
+    day = lambda text: np.datetime64(text, 'D')
+    store = HistoryStore(str(tmp_path / 'history'), key = ['location_id', 'date'])
+    store.append(pd.DataFrame({'location_id': ['stockholm', 'stockholm', 'malmo'],
+                               'date': pd.to_datetime(['2024-01-01', '2024-01-02', '2024-01-04'])}))
+
+    # sorted by location code and day: malmo (code 0) follows its stored days, stockholm (code 1) has a break
+    days = np.array(['2024-01-05', '2024-01-05', '2024-01-06', '2024-01-09'], dtype = 'datetime64[D]')
+    location_codes = np.array([0, 1, 1, 1])
+    location_ids = np.array(['malmo', 'stockholm'])
+    gaps = find_gaps(location_codes, location_ids, days, store)
+    assert list(gaps.itertuples(index = False, name = None)) == [
+        ('stockholm', pd.Timestamp(day('2024-01-03')), pd.Timestamp(day('2024-01-04'))),
+        ('stockholm', pd.Timestamp(day('2024-01-07')), pd.Timestamp(day('2024-01-08'))),
+    ]
+
+    # without the store, only the break within the batch is a gap, and a new location has none
+    assert len(find_gaps(location_codes, location_ids, days)) == 1
+    assert find_gaps(np.array([0]), np.array(['uppsala']), days[:1], store).empty
@@ -0,0 +1,120 @@
+import altair as alt
+import pandas as pd
+
+# Display names of the forecast columns, in display order
+DISPLAY_COLUMNS = {
+    'forecast_date': 'Day',
+    'weather_code': 'Weather Code',
+    'weather_code_desc_short': 'Info',
+    'temperature_min': 'Temperature Min [°C]',
+    'precipitation_sum': 'Precipitation Sum [mm]',
+    'wind_gusts_max': 'Wind Gusts Max [km/h]',
+}
+
+def format_dates(dates):
+    """
+    Format a column of dates as 'Nov 20, 2023'
+    """
+
+    return pd.to_datetime(dates).dt.strftime('%b %d, %Y')
+
+def format_date(date):
+    return date.strftime('%b %d, %Y')
+
+def make_display_frame(df):
+    """
+    Forecast table as shown to the user: rounded integer measurements, readable dates and column names
+    """
+
+    df_print = df[list(DISPLAY_COLUMNS)].copy()
+
+    # Read values as integer to avoid decimals
+    for column in ['temperature_min', 'precipitation_sum', 'wind_gusts_max']:
+        df_print[column] = df_print[column].astype(int)
+
+    # Format date
+    df_print['forecast_date'] = format_dates(df_print['forecast_date'])
+
+    # Rename and reorder columns
+    return df_print.rename(columns = DISPLAY_COLUMNS)
+
+# return the colored row based on the weather code
+def color_weather_code(row):
+    val = row['Weather Code']
+    if val <= 2:
+        background_color = 'rgba(144, 238, 144, 0.7)'  # Light Green with alpha 0.7
+        text_color = 'black'
+    elif val <= 6:
+        background_color = 'rgba(255, 255, 0, 0.7)'  # Yellow with alpha 0.7
+        text_color = 'black'
+    elif val <= 9:
+        background_color = 'rgba(255, 165, 0, 0.7)'  # Orange with alpha 0.7
+        text_color = 'black'
+    else:
+        background_color = 'rgba(255, 0, 0, 0.7)'  # Red with alpha 0.7
+        text_color = 'white'
+
+    return [
+        f'background-color: {background_color}; color: {text_color}'
+    ] * len(row)
+
+# Return colored cell based on the legend color
+def color_cells(value):
+    color_mapping = {
+        'Green': 'background-color: rgba(144, 238, 144, 0.7); color: black;',
+        'Yellow': 'background-color: rgba(255, 255, 0, 0.7); color: black;',
+        'Orange': 'background-color: rgba(255, 165, 0, 0.7); color: black;',
+        'Red': 'background-color: rgba(255, 0, 0, 0.7); color: white;'
+    }
+    return color_mapping.get(value, '')
+
+def make_legend():
+    """
+    Styled legend of the weather code colors
+    """
+
+    legend_data = {
+        'Weather Code': ["Values 1-2", "Values 3-6", "Values 7-9", "Values 10-13"],
+        'Color': ["Green", "Yellow", "Orange", "Red"]
+    }
+    legend_df = pd.DataFrame(legend_data)
+    return legend_df.style.applymap(color_cells, subset=['Color'])
+
+# Define the base time-series chart.
+def get_chart(data):
+    hover = alt.selection_single(
+        fields=["forecast_date"],
+        nearest=True,
+        on="mouseover",
+        empty="none",
+    )
+
+    lines = (
+        alt.Chart(data, title="Weather Code Trend")
+        .mark_line()
+        .encode(
+            x=alt.X("forecast_date:T", title="Date", axis=alt.Axis(labelAngle=-60)),  # Adjust labelAngle as needed
+            y=alt.Y("weather_code:Q", title="Weather Code [1-13]", scale=alt.Scale(domain=[1, 13]))
+        )
+    )
+
+    # Draw points on the line, and highlight based on selection
+    points = lines.transform_filter(hover).mark_circle(size=65)
+
+    # Draw a rule at the location of the selection
+    tooltips = (
+        alt.Chart(data)
+        .mark_rule()
+        .encode(
+            x=alt.X("yearmonthdate(forecast_date):T", title="Date"),
+            y=alt.Y("weather_code:Q", title="Weather Code [1-13]", scale=alt.Scale(domain=[1, 13])),
+            opacity=alt.condition(hover, alt.value(0.3), alt.value(0)),
+            tooltip=[
+                alt.Tooltip("forecast_date:T", title="Date"),
+                alt.Tooltip("weather_code_desc", title="Info"),
+                alt.Tooltip("weather_code", title="Weather Code"),
+            ],
+        )
+        .add_selection(hover)
+    )
+    return (lines + points + tooltips).interactive()
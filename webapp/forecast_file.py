@@ -0,0 +1,70 @@
+"""
+Forecast file shared by the inference pipeline, which writes it, and the web app, which reads it: an uncompressed
+Arrow IPC file with a metadata header (model version, prediction date, schema), memory-mapped on read so the table
+is not copied before the conversion to pandas.
+This module is deployed with the web app, the pipelines import it from here (notebooks/artifacts.py).
+
+    write_forecast(df_forecasts, '../resources/forecast.arrow', model_version = model_version(model))
+    df_forecasts, metadata = read_forecast('../resources/forecast.arrow')
+"""
+
+import json
+import os
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+
+# Version of the forecast file layout, bumped when its columns or metadata change
+FORECAST_FORMAT_VERSION = 1
+
+# Schema metadata key of the forecast header
+METADATA_KEY = b'weather_forecast'
+
+def write_forecast(df, path, model_version = None, prediction_date = None):
+    """
+    Write the forecast as an Arrow IPC file, atomically. The header records the model version, the prediction date
+    (the latest one of the rows by default), the creation time and the column types.
+    """
+
+    table = pa.Table.from_pandas(df, preserve_index = False)
+    if prediction_date is None and 'prediction_date' in df.columns and len(df) > 0:
+        prediction_date = df['prediction_date'].max()
+
+    metadata = {
+        'format_version': FORECAST_FORMAT_VERSION,
+        'model_version': model_version,
+        'prediction_date': str(pd.Timestamp(prediction_date).date()) if prediction_date is not None else None,
+        'created': datetime.now(timezone.utc).isoformat(timespec = 'seconds'),
+        'rows': len(df),
+        'schema': {field.name: str(field.type) for field in table.schema},
+    }
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), METADATA_KEY: json.dumps(metadata).encode()})
+
+    # uncompressed, so that readers can memory-map the buffers
+    os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+    with pa.OSFile(path + '.tmp', 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(path + '.tmp', path)
+    return metadata
+
+def forecast_metadata(schema):
+    return json.loads(schema.metadata[METADATA_KEY]) if schema.metadata and METADATA_KEY in schema.metadata else {}
+
+def read_forecast_metadata(path):
+    """
+    Header of a forecast file, read from its schema only
+    """
+
+    with pa.memory_map(path) as source:
+        return forecast_metadata(pa.ipc.open_file(source).schema)
+
+def read_forecast(path):
+    """
+    Forecast dataframe and header of a forecast file, the Arrow table being memory-mapped
+    """
+
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+        return table.to_pandas(), forecast_metadata(table.schema)
@@ -0,0 +1,220 @@
+"""
+Versioned forecast snapshots for the web app.
+The forecast is downloaded and prepared for display once per upstream version: a background thread checks
+the upstream file and builds a new snapshot only when it changed, page views just read the current one.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from forecast_display import color_weather_code, format_date, get_chart, make_display_frame
+from forecast_file import read_forecast
+
+logger = logging.getLogger(__name__)
+
+# Forecast uploaded by the inference pipeline, an Arrow IPC file with a metadata header
+FORECAST_PATH = 'Resources/weather_forecast/forecast.arrow'
+
+# Location of single-location forecasts, without a location_id column
+DEFAULT_LOCATION_ID = 'stockholm'
+DEFAULT_LOCATION_NAME = 'Stockholm'
+
+Snapshot = namedtuple('Snapshot', ['version', 'index', 'last_update'])
+LocationView = namedtuple('LocationView', ['df_print', 'styled', 'chart'])
+
+class ForecastIndex:
+    """
+    Multi-location forecast sorted by (location_id, forecast_date), with the row range of each location,
+    so selecting a location or a date range is a slice. Display views are built on first use and memoized.
+    """
+
+    def __init__(self, df):
+        df = df.copy()
+        if 'location_id' not in df.columns:
+            df['location_id'] = DEFAULT_LOCATION_ID
+            df['location_name'] = DEFAULT_LOCATION_NAME
+        if 'location_name' not in df.columns:
+            df['location_name'] = df['location_id']
+        df['forecast_date'] = pd.to_datetime(df['forecast_date'])
+
+        self.df = df.sort_values(by = ['location_id', 'forecast_date'], kind = 'stable', ignore_index = True)
+        self.dates = self.df['forecast_date'].to_numpy()
+
+        # row range of each location
+        location_ids = self.df['location_id'].to_numpy()
+        starts = np.concatenate([[0], np.flatnonzero(location_ids[1:] != location_ids[:-1]) + 1])
+        ends = np.concatenate([starts[1:], [len(self.df)]])
+        self.bounds = {location_ids[start]: (start, end) for start, end in zip(starts, ends)}
+
+        # locations for the selector, sorted by name
+        self.locations = (self.df.drop_duplicates('location_id')[['location_id', 'location_name']]
+                          .sort_values(by = 'location_name', ignore_index = True))
+
+        self.views = {}
+
+    def rows(self, location_id, start_date = None, end_date = None):
+        """
+        Forecast rows of a location, between start_date and end_date (both included) if given
+        """
+
+        start, end = self.bounds[location_id]
+        dates = self.dates[start:end]
+        if start_date is not None:
+            start += np.searchsorted(dates, np.datetime64(pd.Timestamp(start_date)), side = 'left')
+        if end_date is not None:
+            end = self.bounds[location_id][0] + np.searchsorted(dates, np.datetime64(pd.Timestamp(end_date)), side = 'right')
+        return self.df.iloc[start:end]
+
+    def n_pages(self, location_id, page_size):
+        start, end = self.bounds[location_id]
+        return max(1, -(-(end - start) // page_size))
+
+    def view(self, location_id, page = 0, page_size = 14):
+        """
+        Display frame, styling and chart of one page of forecast rows of a location
+        """
+
+        key = (location_id, page, page_size)
+        if key not in self.views:
+            start = self.bounds[location_id][0] + page * page_size
+            end = min(start + page_size, self.bounds[location_id][1])
+            self.views[key] = build_view(self.df.iloc[start:end])
+        return self.views[key]
+
+def build_view(df):
+    """
+    Precompute what a page view shows for a slice of forecast rows: display table, its styling and the chart
+    """
+
+    df_print = make_display_frame(df)
+
+    # cell styles computed once, page views only hand them over to the table
+    styles = df_print.apply(color_weather_code, axis=1, result_type='broadcast')
+    styled = df_print.style.apply(lambda _: styles, axis=None)
+
+    chart = get_chart(df).interactive()
+
+    return LocationView(df_print, styled, chart)
+
+def build_snapshot(df, version):
+    """
+    Index the forecast by location and date, and precompute the update date
+    """
+
+    last_update = format_date(pd.to_datetime(df['prediction_date']).max())
+    return Snapshot(version, ForecastIndex(df), last_update)
+
+class SnapshotStore:
+    """
+    Current forecast snapshot, refreshed in the background when the upstream file changes
+    """
+
+    def __init__(self, dataset_api, path = FORECAST_PATH, refresh_seconds = 300, metrics_path = None):
+        self.dataset_api = dataset_api
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.metrics_path = metrics_path
+        self.snapshot = None
+        self.stop_event = threading.Event()
+
+        # refresh checks, snapshot builds and page renders, with their total seconds
+        self.lock = threading.Lock()
+        self.stats = {'refreshes': 0, 'refresh_seconds': 0.0, 'snapshots': 0, 'download_bytes': 0, 'snapshot_rows': 0,
+                      'renders': 0, 'render_seconds': 0.0, 'render_seconds_max': 0.0}
+
+        # first snapshot synchronously, so the first page view has data
+        self.refresh()
+        threading.Thread(target = self.refresh_loop, name = 'forecast-refresh', daemon = True).start()
+
+    def upstream_version(self):
+        """
+        Modification time of the upstream file, None if the dataset API does not expose it
+        """
+
+        try:
+            attributes = self.dataset_api.get(self.path)['attributes']
+            return str(attributes['modificationTime'])
+        except Exception:
+            return None
+
+    def refresh(self):
+        """
+        Build a new snapshot if the upstream file changed, return True if the snapshot was replaced
+        """
+
+        start = time.perf_counter()
+        try:
+            return self.build_if_changed()
+        finally:
+            with self.lock:
+                self.stats['refreshes'] += 1
+                self.stats['refresh_seconds'] += time.perf_counter() - start
+
+    def build_if_changed(self):
+        version = self.upstream_version()
+        if version is not None and self.snapshot is not None and version == self.snapshot.version:
+            return False
+
+        download_dir = tempfile.mkdtemp()
+        try:
+            local_path = self.dataset_api.download(self.path, local_path = download_dir, overwrite = True)
+            download_bytes = os.path.getsize(local_path)
+            df, metadata = read_forecast(local_path)
+
+            # without a modification time, the model version and creation time of the header act as an ETag
+            if version is None:
+                version = f"{metadata.get('model_version')}@{metadata.get('created')}"
+                if self.snapshot is not None and version == self.snapshot.version:
+                    return False
+        finally:
+            shutil.rmtree(download_dir, ignore_errors = True)
+
+        # the snapshot is replaced as a whole, page views see either the old or the new one
+        self.snapshot = build_snapshot(df, version)
+        with self.lock:
+            self.stats['snapshots'] += 1
+            self.stats['download_bytes'] = download_bytes
+            self.stats['snapshot_rows'] = len(df)
+        logger.info("Forecast snapshot %s loaded", version)
+        return True
+
+    def record_render(self, seconds):
+        with self.lock:
+            self.stats['renders'] += 1
+            self.stats['render_seconds'] += seconds
+            self.stats['render_seconds_max'] = max(self.stats['render_seconds_max'], seconds)
+
+    def write_metrics(self):
+        """
+        Write the stats in the Prometheus text format to metrics_path, for the textfile collector of the node exporter
+        """
+
+        with self.lock:
+            stats = dict(self.stats)
+        lines = []
+        for name, value in stats.items():
+            metric_type = 'counter' if name in ('refreshes', 'refresh_seconds', 'snapshots', 'renders', 'render_seconds') else 'gauge'
+            lines += [f"# TYPE webapp_{name} {metric_type}", f"webapp_{name} {value}"]
+        with open(self.metrics_path + '.tmp', 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(self.metrics_path + '.tmp', self.metrics_path)
+
+    def refresh_loop(self):
+        while not self.stop_event.wait(self.refresh_seconds):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Forecast refresh failed, serving snapshot %s", self.snapshot.version)
+            if self.metrics_path is not None:
+                self.write_metrics()
+
+    def stop(self):
+        self.stop_event.set()